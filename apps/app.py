@@ -1,6 +1,8 @@
 import panel as pn
 from transformers_agent_ui import TransformersAgentUI
+from transformers_agent_ui.domain.warmup import on_startup
 
 if pn.state.served:
     pn.extension("terminal", "notifications", notifications=True, design="bootstrap")
+    on_startup()
     TransformersAgentUI().servable()
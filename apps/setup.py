@@ -0,0 +1,7 @@
+"""Runs once when `panel serve` starts, before the first session is created
+
+panel serve apps/app.py --setup apps/setup.py
+"""
+from transformers_agent_ui.domain.warmup import on_startup
+
+on_startup()
@@ -0,0 +1,122 @@
+"""Load tests the REST and WebSocket API with a stub LLM
+
+Serves the API in process with a temporary Store. Concurrent clients submit jobs, wait for them
+via the events WebSocket or by polling and then download their asset. The completions are served
+by the offline `fixture` provider after a `--delay` simulating the latency of a remote model.
+
+Half of the tasks are repeated, so they are served from the cache. The number of jobs run at once
+is limited by the `--workers` of the JobQueue.
+
+Run it via
+
+```bash
+python benchmarks/bench_api.py --clients 50 --jobs 4 --delay 0.5
+```
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+from typing import List
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+from tornado.websocket import websocket_connect
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.jobs import JobQueue
+from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.ui.api import get_routes
+
+AGENT = "Offline"
+MODEL = "stub"
+
+
+async def _wait(host: str, job_id: str, poll: float) -> dict:
+    if poll:
+        while True:
+            response = await AsyncHTTPClient().fetch(f"http://{host}/api/jobs/{job_id}")
+            job = json.loads(response.body)
+            if job["status"] in ("done", "failed"):
+                return job
+            await asyncio.sleep(poll)
+    connection = await websocket_connect(f"ws://{host}/api/jobs/{job_id}/events")
+    job = {}
+    while message := await connection.read_message():
+        job = json.loads(message)
+    return job
+
+
+async def _client(host: str, client: int, jobs: int, poll: float, latencies: List[float]):
+    http = AsyncHTTPClient(max_clients=1000)
+    for index in range(jobs):
+        # Every other task was submitted by the previous client and is read from the cache
+        task = f"Say hello to client {client - index % 2}"
+        start = time.perf_counter()
+        response = await http.fetch(
+            f"http://{host}/api/jobs",
+            method="POST",
+            body=json.dumps({"agent": AGENT, "model": MODEL, "task": task}),
+        )
+        job = await _wait(host, json.loads(response.body)["id"], poll)
+        if job["status"] != "done":
+            raise RuntimeError(f"The job failed: {job['error']}")
+        await http.fetch(f"http://{host}{job['asset']}")
+        latencies.append(time.perf_counter() - start)
+
+
+async def _benchmark(args) -> List[float]:
+    latencies: List[float] = []
+    with tempfile.TemporaryDirectory() as path:
+        job_queue = JobQueue(store=Store(path), max_concurrency=args.workers).start()
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(Application(get_routes("api", jobs=job_queue)))
+        server.add_sockets(sockets)
+        host = f"127.0.0.1:{sockets[0].getsockname()[1]}"
+        try:
+            await asyncio.gather(
+                *[
+                    _client(host, client, args.jobs, args.poll, latencies)
+                    for client in range(args.clients)
+                ]
+            )
+        finally:
+            server.stop()
+            job_queue.stop()
+    return latencies
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=4, help="The number of jobs per client")
+    parser.add_argument("--delay", type=float, default=0.5, help="The latency of the stub LLM")
+    parser.add_argument("--workers", type=int, default=4, help="The workers of the JobQueue")
+    parser.add_argument(
+        "--poll", type=float, default=0.0, help="Poll every that many seconds instead of streaming"
+    )
+    args = parser.parse_args()
+
+    AGENT_CONFIGURATION[AGENT] = {
+        "provider": "fixture",
+        "default": MODEL,
+        "models": {MODEL: {"path": None, "delay": args.delay}},
+    }
+    start = time.perf_counter()
+    latencies = sorted(asyncio.run(_benchmark(args)))
+    duration = time.perf_counter() - start
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{'Jobs':>6} {'p50 ms':>9} {'p95 ms':>9} {'Jobs/s':>9}")
+    print(
+        f"{len(latencies):6} {statistics.median(latencies) * 1000:9.1f} {p95 * 1000:9.1f} "
+        f"{len(latencies) / duration:9.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Benchmarks the sequential and concurrent evaluation of the code generated by the agent
+
+The tools are fakes that sleep to simulate the latency of a remote inference endpoint.
+
+Run it via
+
+```bash
+python benchmarks/bench_evaluate.py
+```
+"""
+import time
+
+from transformers_agent_ui.domain.custom_run import evaluate
+
+LATENCY = 0.5
+CODE = """
+caption = image_captioner(boat_image)
+translation = translator(text, src_lang="English", tgt_lang="French")
+summary = summarizer(text)
+audio = text_reader(caption)
+"""
+STATE = {"boat_image": "boat_image", "text": "text"}
+
+
+def _fake_tool(name):
+    def tool(*args, **kwargs):
+        time.sleep(LATENCY)
+        return f"{name}{args}{kwargs}"
+
+    return tool
+
+
+TOOL_NAMES = ["image_captioner", "translator", "summarizer", "text_reader"]
+TOOLS = {name: _fake_tool(name) for name in TOOL_NAMES}
+
+
+def _time(max_workers: int) -> float:
+    start = time.perf_counter()
+    evaluate(CODE, TOOLS, state=STATE.copy(), max_workers=max_workers)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sequential = _time(max_workers=1)
+    concurrent = _time(max_workers=4)
+    print(f"Tool latency: {LATENCY:.2f}s")
+    print(f"Sequential:   {sequential:.2f}s")
+    print(f"Concurrent:   {concurrent:.2f}s ({sequential / concurrent:.1f}x speedup)")
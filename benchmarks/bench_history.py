@@ -0,0 +1,91 @@
+"""Benchmarks querying the history of runs in a Store with many runs
+
+Run it via
+
+```bash
+python benchmarks/bench_history.py --runs 100000
+```
+"""
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.store import DB_NAME, Store
+
+WORDS = ["boat", "water", "river", "lake", "capybara", "snow", "image", "audio", "summary", "read"]
+
+
+def _populate(path: Path, runs: int):
+    """Inserts the runs directly via SQL. Writing assets for each run would take much longer"""
+    Store(path=path)  # Creates the tables, indexes and triggers
+    agents_models = [
+        (agent, model)
+        for agent, configuration in AGENT_CONFIGURATION.items()
+        for model in configuration["models"]
+    ]
+    random.seed(42)
+    rows = []
+    for index in range(runs):
+        agent, model = random.choice(agents_models)
+        task = " ".join(random.choices(WORDS, k=6)) + f" {index}"
+        time_ = f"2023-{1 + index * 12 // runs:02d}-01 00:00:{index % 60:02d}"
+        rows.append((time_, agent, model, task, "prompt", "explanation", "code", "missing.png"))
+    with sqlite3.connect(path / DB_NAME) as conn:
+        conn.executemany("INSERT INTO RESULTS VALUES(?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def _time(name: str, function, repeat: int = 20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    duration = (time.perf_counter() - start) / repeat
+    print(f"{name:40} {duration * 1000:8.2f} ms")
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--runs", type=int, default=100_000)
+    parser.add_argument("--page-size", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+        start = time.perf_counter()
+        _populate(path, args.runs)
+        print(f"Inserted {args.runs} runs in {time.perf_counter() - start:.1f}s")
+
+        store = Store(path=path)
+        limit = args.page_size
+        _time("First page", lambda: store.query_runs(limit=limit))
+        _time("First page of agent", lambda: store.query_runs("OpenAI", limit=limit))
+        _time("Full text search", lambda: store.query_runs(search="boat capybara", limit=limit))
+        _time(
+            "Time range",
+            lambda: store.query_runs(start="2023-06-01", end="2023-07-01", limit=limit),
+        )
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        runs, cursor = store.query_runs(limit=limit)
+        pages = 1
+        while cursor is not None and pages < 1000:
+            runs, cursor = store.query_runs(limit=limit, after=cursor)
+            pages += 1
+        duration = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"Paged through {pages} pages in {duration:.2f}s "
+            f"({duration / pages * 1000:.2f} ms per page, peak memory {peak / 1024:.0f} KiB)"
+        )
+        assert runs
+
+
+if __name__ == "__main__":
+    main()
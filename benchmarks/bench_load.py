@@ -0,0 +1,421 @@
+"""Load tests `panel serve apps/app.py` with concurrent sessions and a stub LLM
+
+Serves the app in a subprocess with a temporary Store. Its default agent is replaced by the offline
+`fixture` provider via `TRANSFORMERS_AGENT_UI_AGENTS`. The completions are served after a `--delay`
+simulating the latency of a remote model.
+
+Each simulated session speaks the Bokeh WebSocket protocol like a browser. It pulls the document,
+selects the examples of the example selection widget one after the other and clicks RUN until the
+output is shown. The runs of the same example are served from the cache unless `--unique-tasks`.
+
+Reports the p50/p95 latencies of opening the sessions and of the runs, the WebSocket bytes sent and
+received per session and the CPU time and memory of the server process.
+
+Run it via
+
+```bash
+python benchmarks/bench_load.py --sessions 20 --runs 3 --delay 0.5
+```
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import pkgutil
+import resource
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import panel.models
+from bokeh.core.serialization import Serializable
+from bokeh.document import Document
+from bokeh.document.events import DocumentPatchedEvent, MessageSentEvent
+from bokeh.events import ButtonClick, DocumentReady
+from bokeh.models import Button, Select, TextAreaInput
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+from bokeh.util.token import generate_jwt_token, generate_session_id
+from tornado import locks
+from tornado.httpclient import HTTPRequest
+from tornado.netutil import bind_sockets
+from tornado.websocket import websocket_connect
+
+from transformers_agent_ui.domain.examples import get_examples_map
+
+APP_PATH = Path(__file__).parent.parent / "apps" / "app.py"
+# The default agent of the app. Replaced by the stub
+AGENT = "HuggingFace"
+MODEL = "StarcoderBase"
+
+
+def _import_panel_models():
+    """Registers the Bokeh models of Panel. So the documents of the app can be deserialized"""
+    for module in pkgutil.iter_modules(panel.models.__path__):
+        importlib.import_module(f"panel.models.{module.name}")
+
+
+class _Event(Serializable):  # pylint: disable=too-few-public-methods
+    """An event of the browser, for example the click on a Button"""
+
+    def __init__(self, name: str, model=None):
+        self.name = name
+        self.model = model
+
+    def to_serializable(self, serializer):
+        values = {} if self.model is None else {"model": {"id": self.model.id}}
+        return {"type": "event", "name": self.name, "values": values}
+
+
+class _Connection:  # pylint: disable=too-few-public-methods
+    """Sends the messages of a session and counts the bytes sent"""
+
+    def __init__(self, socket):
+        self._socket = socket
+        self.write_lock = locks.Lock()
+        self.sent = 0
+
+    async def write_message(self, message, binary: bool = False, locked: bool = True):
+        """Sends the message. Called by the Bokeh Message"""
+        # pylint: disable=unused-argument
+        self.sent += len(message) if binary else len(message.encode())
+        await self._socket.write_message(message, binary)
+
+
+class _Session:
+    """A browser session of the app. Applies the changes made by the server to its document and
+    sends its own changes and events to the server"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.id = generate_session_id()
+        self.document = Document()
+        self.received = 0
+        self._protocol = Protocol()
+        self._receiver = Receiver(self._protocol)
+        self._connection: Optional[_Connection] = None
+        self._replies: Dict[str, asyncio.Future] = {}
+        self._changed = asyncio.Event()
+        self._pending: List[DocumentPatchedEvent] = []
+        self._reader: Optional[asyncio.Task] = None
+
+    @property
+    def sent(self) -> int:
+        """The WebSocket bytes sent"""
+        return 0 if self._connection is None else self._connection.sent
+
+    async def open(self):
+        """Connects and pulls the document like a browser"""
+        socket = await websocket_connect(
+            HTTPRequest(self.url),
+            subprotocols=["bokeh", generate_jwt_token(self.id)],
+            max_message_size=2**30,
+        )
+        self._connection = _Connection(socket)
+        # The server accepts requests once it has acknowledged the connection
+        self._replies["ACK"] = asyncio.get_running_loop().create_future()
+        self._reader = asyncio.create_task(self._read(socket))
+        await self._replies["ACK"]
+        reply = await self._request(self._protocol.create("PULL-DOC-REQ"))
+        reply.push_to_document(self.document)
+        self.document.callbacks.on_change_dispatch_to(self)
+        await self.send_event(_Event(DocumentReady.event_name))
+
+    async def close(self):
+        """Closes the connection. The server destroys the session"""
+        if self._connection is not None:
+            self._connection._socket.close()  # pylint: disable=protected-access
+        if self._reader is not None:
+            await self._reader
+
+    async def _read(self, socket):
+        while (fragment := await socket.read_message()) is not None:
+            self.received += (
+                len(fragment) if isinstance(fragment, bytes) else len(fragment.encode())
+            )
+            message = await self._receiver.consume(fragment)
+            if message is None:
+                continue
+            if message.msgtype == "PATCH-DOC":
+                message.apply_to_document(self.document, self)
+                self._changed.set()
+            reqid = "ACK" if message.msgtype == "ACK" else message.header.get("reqid", "")
+            reply = self._replies.pop(reqid, None)
+            if reply is not None:
+                reply.set_result(message)
+        for reply in self._replies.values():
+            reply.set_exception(ConnectionError("The connection was closed"))
+
+    async def _request(self, message):
+        reply = asyncio.get_running_loop().create_future()
+        self._replies[message.header["msgid"]] = reply
+        await message.send(self._connection)
+        return await reply
+
+    def _document_patched(self, event: DocumentPatchedEvent):
+        if event.setter is not self:
+            self._pending.append(event)
+
+    async def change(self, model, attribute: str, value: Any):
+        """Changes the attribute of the model and sends the change to the server"""
+        setattr(model, attribute, value)
+        events, self._pending = self._pending, []
+        if events:
+            await self._request(self._protocol.create("PATCH-DOC", events))
+
+    async def send_event(self, event: _Event):
+        """Sends the event to the server"""
+        message = MessageSentEvent(self.document, "bokeh_event", event)
+        await self._request(self._protocol.create("PATCH-DOC", [message]))
+
+    async def wait_until(self, predicate: Callable[[], bool], timeout: float):
+        """Waits until the changes of the server make the predicate True"""
+        deadline = time.monotonic() + timeout
+        while True:
+            self._changed.clear()
+            if predicate():
+                return
+            await asyncio.wait_for(self._changed.wait(), deadline - time.monotonic())
+
+    def select_one(self, type_: type, **attributes) -> Any:
+        """Returns the only model of the type with the attributes"""
+        models = [
+            model
+            for model in self.document.models
+            if isinstance(model, type_)
+            and all(getattr(model, key) == value for key, value in attributes.items())
+        ]
+        if len(models) != 1:
+            raise LookupError(f"Found {len(models)} {type_.__name__} with {attributes}")
+        return models[0]
+
+
+@dataclass
+class _Report:  # pylint: disable=too-many-instance-attributes
+    opens: List[float] = field(default_factory=list)
+    runs: List[float] = field(default_factory=list)
+    failures: List[str] = field(default_factory=list)
+    sent: int = 0
+    received: int = 0
+    duration: float = 0.0
+    server_cpu: float = 0.0
+    client_cpu: float = 0.0
+    rss_before: int = 0
+    rss_after: int = 0
+    peak_rss: int = 0
+
+
+async def _run_examples(session: _Session, index: int, args, report: _Report):
+    """Selects the examples one after the other and runs them"""
+    examples = get_examples_map()
+    example_input = session.select_one(Select, title="Example")
+    task_input = session.select_one(TextAreaInput, title="Task")
+    submit_input = session.select_one(Button, label="RUN")
+    # The RUN button is enabled again once the output is shown
+    finished: List[float] = []
+    submit_input.on_change(
+        "disabled", lambda attr, old, new: finished.append(time.perf_counter()) if not new else None
+    )
+    try:
+        for run in range(args.runs):
+            name = list(examples)[(index + run) % len(examples)]
+            task = examples[name].task
+            await session.change(example_input, "value", name)
+            await session.wait_until(lambda task=task: task_input.value == task, args.timeout)
+            if args.unique_tasks:
+                await session.change(task_input, "value", f"{task} ({index}.{run})")
+            count = len(finished)
+            start = time.perf_counter()
+            await session.send_event(_Event(ButtonClick.event_name, submit_input))
+            await session.wait_until(lambda count=count: len(finished) > count, args.timeout)
+            report.runs.append(finished[-1] - start)
+    except (asyncio.TimeoutError, ConnectionError) as exc:
+        report.failures.append(
+            f"Session {index}: {exc!r} with the task {task_input.value!r} and "
+            f"{'a disabled' if submit_input.disabled else 'an enabled'} RUN button"
+        )
+
+
+async def _simulate(url: str, index: int, args, report: _Report):
+    """Opens a session, runs the examples and closes it"""
+    await asyncio.sleep(index * args.ramp_up / max(args.sessions, 1))
+    session = _Session(url)
+    start = time.perf_counter()
+    try:
+        await session.open()
+        report.opens.append(time.perf_counter() - start)
+        await _run_examples(session, index, args, report)
+    finally:
+        await session.close()
+        report.sent += session.sent
+        report.received += session.received
+
+
+def _get_process_stats(pid: int) -> Tuple[float, int, int]:
+    """Returns the CPU seconds, the RSS and the peak RSS in bytes of the process. Linux only"""
+    stat = Path(f"/proc/{pid}/stat").read_text(encoding="utf8")
+    # The fields after the command, which may contain spaces
+    fields = stat.rsplit(")", maxsplit=1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    memory = {}
+    for line in Path(f"/proc/{pid}/status").read_text(encoding="utf8").splitlines():
+        if line.startswith(("VmRSS:", "VmHWM:")):
+            memory[line.split(":")[0]] = int(line.split()[1]) * 1024
+    return cpu, memory["VmRSS"], memory["VmHWM"]
+
+
+def _reset_peak_rss(pid: int):
+    try:
+        Path(f"/proc/{pid}/clear_refs").write_text("5", encoding="utf8")
+    except OSError:
+        pass
+
+
+def _start_server(path: Path, args) -> Tuple[subprocess.Popen, int]:
+    agents = path / "agents.json"
+    agents.write_text(
+        json.dumps(
+            {
+                AGENT: {
+                    "provider": "fixture",
+                    "default": MODEL,
+                    "models": {MODEL: {"path": None, "delay": args.delay}},
+                }
+            }
+        ),
+        encoding="utf8",
+    )
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    for socket in sockets:
+        socket.close()
+    env = {
+        **os.environ,
+        "TRANSFORMERS_AGENT_UI_AGENTS": str(agents),
+        "TRANSFORMERS_AGENT_UI_STORE": str(path / "store"),
+    }
+    command = [sys.executable, "-m", "panel", "serve", str(APP_PATH), "--port", str(port)]
+    with (path / "server.log").open("wb") as log:
+        # The log is kept open by the server
+        server = subprocess.Popen(  # pylint: disable=consider-using-with
+            command + ["--address", "127.0.0.1"], env=env, stdout=log, stderr=log
+        )  # nosec
+    return server, port
+
+
+async def _wait_for_server(server: subprocess.Popen, port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited. See its log")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def _benchmark(url: str, args, report: _Report):
+    await asyncio.gather(*[_simulate(url, index, args, report) for index in range(args.sessions)])
+
+
+def _get_client_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(path: Path, args) -> _Report:
+    """Serves the app, runs the sessions and returns the report"""
+    report = _Report()
+    server, port = _start_server(path, args)
+    try:
+        asyncio.run(_wait_for_server(server, port))
+        _reset_peak_rss(server.pid)
+        cpu, report.rss_before, _ = _get_process_stats(server.pid)
+        client_cpu = _get_client_cpu()
+        start = time.perf_counter()
+        asyncio.run(_benchmark(f"ws://127.0.0.1:{port}/app/ws", args, report))
+        report.duration = time.perf_counter() - start
+        report.client_cpu = _get_client_cpu() - client_cpu
+        report.server_cpu, report.rss_after, report.peak_rss = _get_process_stats(server.pid)
+        report.server_cpu -= cpu
+    except Exception:
+        _print_log_tail(path)
+        raise
+    finally:
+        server.terminate()
+        server.wait()
+    if report.failures:
+        _print_log_tail(path)
+    return report
+
+
+def _print_latencies(name: str, latencies: List[float]):
+    if not latencies:
+        print(f"{name:<8} {0:6}")
+        return
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:<8} {len(latencies):6} {statistics.median(latencies) * 1000:9.1f} "
+        f"{p95 * 1000:9.1f}"
+    )
+
+
+def _print_log_tail(path: Path):
+    print((path / "server.log").read_text(encoding="utf8")[-5000:], file=sys.stderr)
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--sessions", type=int, default=20, help="The concurrent sessions")
+    parser.add_argument("--runs", type=int, default=3, help="The runs per session")
+    parser.add_argument("--delay", type=float, default=0.5, help="The latency of the stub LLM")
+    parser.add_argument(
+        "--unique-tasks", action="store_true", help="Make every task unique to bypass the cache"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=0.0, help="The seconds over which the sessions are opened"
+    )
+    parser.add_argument("--timeout", type=float, default=60.0, help="The seconds to wait per run")
+    args = parser.parse_args()
+
+    _import_panel_models()
+    with tempfile.TemporaryDirectory() as directory:
+        report = _run(Path(directory), args)
+
+    print(f"{'':<8} {'Count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    _print_latencies("Open", report.opens)
+    _print_latencies("Run", report.runs)
+    sessions = max(args.sessions, 1)
+    print(
+        f"WebSocket: {report.sent / sessions / 1024:.1f} KiB sent and "
+        f"{report.received / sessions / 1024:.1f} KiB received per session"
+    )
+    print(
+        f"Server CPU: {report.server_cpu:.1f} s in {report.duration:.1f} s "
+        f"({report.server_cpu / report.duration:.0%} of a core). "
+        f"Client CPU: {report.client_cpu:.1f} s"
+    )
+    print(
+        f"Server RSS: {report.rss_before / 2**20:.1f} MB before, "
+        f"{report.rss_after / 2**20:.1f} MB after, {report.peak_rss / 2**20:.1f} MB peak"
+    )
+    for failure in report.failures:
+        print(failure)
+    if report.failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
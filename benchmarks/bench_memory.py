@@ -0,0 +1,171 @@
+"""Benchmarks the peak memory used to store and show the large values of the audio and image runs
+
+Compares the previous value handling, i.e. pickled tensors, full loads from the cache and a new
+conversion on every update of the view, to the ValueHandle and the memory-mapped Store formats.
+
+Each scenario runs in a process of its own. The peak RSS is reported above the RSS once the value
+was created or, for the cache reads, once the modules were imported.
+
+Run it via
+
+```bash
+python benchmarks/bench_memory.py --seconds 600 --size 2048 --updates 3
+```
+"""
+import argparse
+import pickle  # nosec
+import resource
+import subprocess  # nosec
+import sys
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from transformers_agent_ui.domain.store import dump_value, get_suffix, load_value
+from transformers_agent_ui.domain.values import ValueHandle
+
+SAMPLE_RATE = 16000
+SCENARIOS = ["audio", "audio-cache", "image", "image-cache"]
+MODES = ["legacy", "handle"]
+
+
+def _get_peak_rss() -> int:
+    """Returns the peak resident set size in bytes. Since the last reset if supported"""
+    status = Path("/proc/self/status")
+    if status.exists():
+        for line in status.read_text(encoding="utf8").splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _get_rss() -> int:
+    with open("/proc/self/statm", encoding="utf8") as file:
+        return int(file.read().split()[1]) * resource.getpagesize()
+
+
+def _reset_peak_rss():
+    """Resets the peak RSS to the current RSS if the kernel supports it"""
+    try:
+        Path("/proc/self/clear_refs").write_text("5", encoding="utf8")
+    except OSError:
+        pass
+
+
+def _create_value(scenario: str, args):
+    if scenario.startswith("audio"):
+        return torch.rand(args.seconds * SAMPLE_RATE, dtype=torch.float32) * 2 - 1
+    pixels = np.random.default_rng(0).integers(0, 255, (args.size, args.size, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _get_path(directory: Path, scenario: str, mode: str) -> Path:
+    suffix = ".pickle" if mode == "legacy" and scenario.startswith("audio") else ".png"
+    if mode == "handle" and scenario.startswith("audio"):
+        suffix = ".pt"
+    return directory / f"{scenario}-{mode}{suffix}"
+
+
+def _write(value, path: Path, mode: str):
+    with path.open("wb") as file:
+        if mode == "legacy" and path.suffix == ".pickle":
+            pickle.dump(value, file)
+        else:
+            assert get_suffix(value) == path.suffix  # nosec
+            dump_value(value, file)
+
+
+def _read(path: Path, mode: str):
+    if mode == "legacy":
+        with path.open("rb") as file:
+            if path.suffix == ".pickle":
+                return pickle.load(file)  # nosec
+            image = Image.open(file)
+            image.load()
+            return image
+    return load_value(path, path.suffix)
+
+
+def _show_legacy(value):
+    """The conversion previously done by `get_value_pane` on every update of the view"""
+    if isinstance(value, torch.Tensor):
+        return (value.numpy() * 32768.0).astype(np.int16)
+    # Panel shows PIL images as JPG
+    file = BytesIO()
+    value.convert("RGB").save(file, format="JPEG")
+    return file.getvalue()
+
+
+def _show_handle(handle: ValueHandle):
+    """The conversion done by `get_value_pane` via the ValueHandle. Cached across the updates"""
+    if isinstance(handle.value, Image.Image):
+        return handle.to_png()
+    return handle.to_pcm16()
+
+
+def _run_scenario(scenario: str, mode: str, directory: Path, args) -> int:
+    """Runs the scenario and returns the peak RSS above the baseline in bytes"""
+    path = _get_path(directory, scenario, mode)
+    is_cache_read = scenario.endswith("-cache")
+    value = None if is_cache_read else _create_value(scenario, args)
+    _reset_peak_rss()
+    baseline = _get_rss()
+    if is_cache_read:
+        value = _read(path, mode)
+    else:
+        _write(value, path, mode)
+    handle = ValueHandle.from_value(value)
+    for _ in range(args.updates):
+        shown = _show_legacy(value) if mode == "legacy" else _show_handle(handle)
+        del shown
+    return _get_peak_rss() - baseline
+
+
+def _prepare(directory: Path, args):
+    """Writes the values read by the cache scenarios"""
+    for scenario in SCENARIOS:
+        if scenario.endswith("-cache"):
+            value = _create_value(scenario, args)
+            for mode in MODES:
+                _write(value, _get_path(directory, scenario, mode), mode)
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--seconds", type=int, default=600, help="The length of the audio")
+    parser.add_argument("--size", type=int, default=2048, help="The width and height of the image")
+    parser.add_argument("--updates", type=int, default=3, help="The updates of the view per run")
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(_run_scenario(args.scenario, args.mode, Path(args.directory), args))
+        return
+
+    options = ["--seconds", str(args.seconds), "--size", str(args.size)]
+    options += ["--updates", str(args.updates)]
+    print(f"{'Scenario':<12} {'Legacy MB':>10} {'Handle MB':>10} {'Saved':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        _prepare(Path(directory), args)
+        for scenario in SCENARIOS:
+            peaks = {}
+            for mode in MODES:
+                command = [sys.executable, __file__, *options, "--directory", directory]
+                command += ["--scenario", scenario, "--mode", mode]
+                output = subprocess.run(
+                    command, check=True, capture_output=True, text=True
+                )  # nosec
+                peaks[mode] = int(output.stdout.split()[-1]) / 2**20
+            saved = 1 - peaks["handle"] / peaks["legacy"] if peaks["legacy"] else 0.0
+            print(f"{scenario:<12} {peaks['legacy']:10.1f} {peaks['handle']:10.1f} {saved:7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Benchmarks the size of the prompts with and without pruning the tools
+
+Formats the prompts of the example tasks describing all the tools and only the tools relevant to
+the task via the PromptBuilder. Reports the number of tokens and the time to format a prompt.
+
+The tokens are counted as words and punctuation unless a `--tokenizer` like `bigcode/starcoder` is
+given. The prompt template defaults to a copy of the structure of the default run prompt of the
+transformers agents. Use `--template` to benchmark another one, for example the downloaded
+`run_prompt_template.txt`.
+
+Run it via
+
+```bash
+python benchmarks/bench_prompts.py --max-tools 4
+```
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import transformers.tools
+from transformers.tools.agents import TASK_MAPPING
+
+from transformers_agent_ui.domain.examples import EXAMPLES
+from transformers_agent_ui.domain.prompts import PromptBuilder, count_tokens
+
+RUN_PROMPT_TEMPLATE = """I will ask you to perform a task, your job is to come up with a series \
+of simple commands in Python that will perform the task.
+To help you, I will give you access to a set of tools that you can use. Each tool is a Python \
+function and has a description explaining the task it performs, the inputs it expects and the \
+outputs it returns.
+You should first explain which tool you will use to perform the task and for what reason, then \
+write the code in Python.
+Each instruction in Python should be a simple assignment. You can print intermediate results if \
+it makes sense to do so.
+
+Tools:
+<<all_tools>>
+
+
+Task: "Answer the question in the variable `question` about the image stored in the variable \
+`image`. The question is in French."
+
+I will use the following tools: `translator` to translate the question into English and then \
+`image_qa` to answer the question on the input image.
+
+Answer:
+```py
+translated_question = translator(question=question, src_lang="French", tgt_lang="English")
+print(f"The translated question is {translated_question}.")
+answer = image_qa(image=image, question=translated_question)
+print(f"The answer is {answer}")
+```
+
+Task: "Identify the oldest person in the `document` and create an image showcasing the result."
+
+I will use the following tools: `document_qa` to find the oldest person in the document, then \
+`image_generator` to generate an image according to the answer.
+
+Answer:
+```py
+answer = document_qa(document, question="What is the oldest person?")
+print(f"The answer is {answer}.")
+image = image_generator(answer)
+```
+
+Task: "Generate an image using the text given in the variable `caption`."
+
+I will use the following tools: `image_generator` to generate an image.
+
+Answer:
+```py
+image = image_generator(prompt=caption)
+```
+
+Task: "Summarize the text given in the variable `text` and read it out loud."
+
+I will use the following tools: `summarizer` to create a summary of the input text, then \
+`text_reader` to read it out loud.
+
+Answer:
+```py
+summarized_text = summarizer(text)
+print(f"Summary: {summarized_text}")
+audio_summary = text_reader(summarized_text)
+```
+
+Task: "Answer the question in the variable `question` about the text in the variable `text`. \
+Use the answer to generate an image."
+
+I will use the following tools: `text_qa` to create the answer, then `image_generator` to \
+generate an image according to the answer.
+
+Answer:
+```py
+answer = text_qa(text=text, question=question)
+print(f"The answer is {answer}.")
+image = image_generator(answer)
+```
+
+Task: "Caption the following `image`."
+
+I will use the following tools: `image_captioner` to generate a caption for the image.
+
+Answer:
+```py
+caption = image_captioner(image)
+```
+
+Task: "<<prompt>>"
+
+I will use the following tools:"""
+# The tools of the Hub are described in their spaces. So they are copied here to run offline
+HUB_TOOLS = {
+    "image_generator": "This is a tool that creates an image according to a prompt, which is a "
+    "text description. It takes an input named `prompt` which contains the image description "
+    "and outputs an image.",
+    "image_transformer": "This is a tool that transforms an image according to a prompt. It "
+    "takes two inputs: `image`, which should be the image to transform, and `prompt`, which "
+    "should be the prompt to use to change it. It returns the modified image.",
+    "text_downloader": "This is a tool that downloads a file from a `url`. It takes the `url` as "
+    "input, and returns the text contained in the file.",
+    "video_generator": "This is a tool that creates a video according to a text description. It "
+    "takes an input named `prompt` which contains the image description, as well as an optional "
+    "input `seconds` which will be the duration of the video. It outputs a video object.",
+}
+
+
+class DescribedAgent:  # pylint: disable=too-few-public-methods
+    """An agent with the default tools described offline and a run prompt template"""
+
+    def __init__(self, template: str):
+        self.run_prompt_template = template
+        self.toolbox = {}
+        for tool_class_name in TASK_MAPPING.values():
+            tool_class = getattr(transformers.tools, tool_class_name)
+            self.toolbox[tool_class.name] = SimpleNamespace(description=tool_class.description)
+        for name, description in HUB_TOOLS.items():
+            self.toolbox[name] = SimpleNamespace(description=description)
+
+    def format_prompt(self, task: str) -> str:
+        """Returns the prompt describing all tools as done by the transformers agents"""
+        description = "\n".join(
+            f"- {name}: {tool.description}" for name, tool in self.toolbox.items()
+        )
+        prompt = self.run_prompt_template.replace("<<all_tools>>", description)
+        return prompt.replace("<<prompt>>", task)
+
+
+def _get_counter(tokenizer: str):
+    if not tokenizer:
+        return count_tokens
+    # pylint: disable=import-outside-toplevel
+    from transformers import AutoTokenizer
+
+    loaded = AutoTokenizer.from_pretrained(tokenizer)
+    return lambda text: len(loaded(text)["input_ids"])
+
+
+def _time(format_prompt, task: str, repeat: int = 200) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        format_prompt(task)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--max-tools", type=int, default=4)
+    parser.add_argument("--max-examples", type=int, default=3)
+    parser.add_argument("--template", type=Path, default=None)
+    parser.add_argument("--tokenizer", default="")
+    args = parser.parse_args()
+
+    template = args.template.read_text(encoding="utf8") if args.template else RUN_PROMPT_TEMPLATE
+    agent = DescribedAgent(template)
+    builder = PromptBuilder(max_tools=args.max_tools, max_examples=args.max_examples)
+    count = _get_counter(args.tokenizer)
+
+    print(f"{'Task':50} {'Full':>7} {'Pruned':>7} {'Saved':>6} {'Full us':>8} {'Pruned us':>10}")
+    savings = []
+    for example in EXAMPLES:
+        full = count(agent.format_prompt(example.task))
+        pruned = count(builder.format_prompt(agent, example.task))
+        savings.append(1 - pruned / full)
+        full_time = _time(agent.format_prompt, example.task)
+        pruned_time = _time(lambda task: builder.format_prompt(agent, task), example.task)
+        print(
+            f"{example.task[:50]:50} {full:7} {pruned:7} {savings[-1]:6.0%} "
+            f"{full_time * 1e6:8.1f} {pruned_time * 1e6:10.1f}"
+        )
+        print(f"{'':50} {', '.join(builder.select_tools(example.task, agent.toolbox))}")
+    print(f"Median tokens saved: {statistics.median(savings):.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmarks the providers of the configured agents side by side
+
+Runs the same tasks via each agent and model with a token, or not requiring one, concurrently up
+to the `max_concurrency` of its provider and reports the latency and throughput. The cache is
+not used.
+
+Run it via
+
+```bash
+python benchmarks/bench_providers.py --runs 20 --concurrency 4
+```
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.providers import get_capabilities
+from transformers_agent_ui.domain.token import TokenManager
+
+TASKS = ["Say hello", "Return the text", "Summarize the text"]
+KWARGS = {"text": "Panel is a powerful data exploration and data app framework for Python"}
+
+
+def _run(agent: str, model: str, task: str) -> float:
+    start = time.perf_counter()
+    TransformersAgent(
+        agent=agent, model=model, task=task, kwargs=KWARGS, use_cache=False, cache=InMemoryStore()
+    ).run()
+    return time.perf_counter() - start
+
+
+def _benchmark(agent: str, model: str, runs: int, concurrency: int):
+    capabilities = get_capabilities(agent)
+    max_workers = min(concurrency, capabilities.max_concurrency)
+    tasks = [TASKS[index % len(TASKS)] for index in range(runs)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        durations = sorted(executor.map(lambda task: _run(agent, model, task), tasks))
+    duration = time.perf_counter() - start
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(
+        f"{agent + '/' + model:40} {max_workers:11} {statistics.median(durations) * 1000:9.1f} "
+        f"{p95 * 1000:9.1f} {runs / duration:9.1f}"
+    )
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    token_manager = TokenManager()
+    print(f"{'Agent/Model':40} {'Concurrency':>11} {'p50 ms':>9} {'p95 ms':>9} {'Runs/s':>9}")
+    for agent, configuration in AGENT_CONFIGURATION.items():
+        if get_capabilities(agent).requires_token and not token_manager.get(agent):
+            print(f"{agent:40} skipped. No token")
+            continue
+        for model in configuration["models"]:
+            _benchmark(agent, model, runs=args.runs, concurrency=args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
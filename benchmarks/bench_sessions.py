@@ -0,0 +1,81 @@
+"""Benchmarks the memory used by opening and closing many sessions of the TransformersAgentUI
+
+The RSS should stay flat once the first sessions have warmed up the caches.
+
+Run it via
+
+```bash
+python benchmarks/bench_sessions.py --sessions 1000
+```
+"""
+import argparse
+import gc
+import resource
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import panel as pn
+from bokeh.document import Document
+from panel.io.state import set_curdoc
+
+from transformers_agent_ui import TransformersAgentUI
+from transformers_agent_ui.domain.examples import image_to_image
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+
+
+def _get_rss() -> int:
+    """Returns the current resident set size in bytes"""
+    statm = Path("/proc/self/statm")
+    if statm.exists():
+        return int(statm.read_text(encoding="utf8").split()[1]) * resource.getpagesize()
+    # The peak RSS is the best we can do on other platforms
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _open_and_close_session(store: InMemoryStore, index: int):
+    doc = Document()
+    with set_curdoc(doc):
+        agent = TransformersAgentUI(cache=store)
+        # Registers the cleanup of the view when the session is destroyed like `panel serve`
+        agent.__panel__().server_doc(doc)
+    agent.kwargs = image_to_image.kwargs
+    agent.value = image_to_image.kwargs["image"].copy()
+    for line in range(100):
+        agent.write_log(f"Session {index}: log line {line}")
+
+    # What the server does when the browser tab is closed
+    session_context = SimpleNamespace(id=f"session-{index}", _document=doc)
+    for callback in list(doc.session_destroyed_callbacks):
+        callback(session_context)
+    pn.state._destroy_session(session_context)  # pylint: disable=protected-access
+    doc.clear()
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    args = parser.parse_args()
+
+    pn.extension("terminal")
+    pn.config.browser_info = False
+    store = InMemoryStore()
+    report_every = max(args.sessions // 10, 1)
+    start = time.perf_counter()
+    baseline = None
+    for index in range(1, args.sessions + 1):
+        _open_and_close_session(store, index)
+        if index % report_every == 0:
+            gc.collect()
+            rss = _get_rss()
+            baseline = baseline or rss
+            print(
+                f"{index:6} sessions: RSS {rss / 1024**2:8.1f} MB "
+                f"({(rss - baseline) / 1024**2:+6.1f} MB), "
+                f"{(time.perf_counter() - start) / index * 1000:6.1f} ms per session"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmarks finding similar tasks in a TaskIndex with many tasks
+
+Run it via
+
+```bash
+python benchmarks/bench_similarity.py --tasks 100000
+```
+"""
+import argparse
+import random
+import time
+
+from transformers_agent_ui.domain.similarity import TaskIndex
+
+WORDS = ["boat", "water", "river", "lake", "capybara", "snow", "image", "audio", "summary", "read"]
+AGENT = "HuggingFace"
+MODEL = "StarcoderBase"
+
+
+def _time(name: str, function, repeat: int = 20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    duration = (time.perf_counter() - start) / repeat
+    print(f"{name:40} {duration * 1000:8.2f} ms")
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--tasks", type=int, default=100_000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    tasks = [f"{' '.join(random.choices(WORDS, k=6))} {index}" for index in range(args.tasks)]
+    index = TaskIndex()
+    start = time.perf_counter()
+    for task in tasks:
+        index.add(AGENT, MODEL, task)
+    duration = time.perf_counter() - start
+    print(
+        f"Indexed {args.tasks} tasks in {duration:.1f}s ({duration / args.tasks * 1e6:.0f} us each)"
+    )
+
+    similar_task = tasks[len(tasks) // 2].upper() + "."
+    _time("Signature", lambda: index.get_signature(similar_task))
+    _time("Search exact task", lambda: index.search(AGENT, MODEL, tasks[0]))
+    _time("Search similar task", lambda: index.search(AGENT, MODEL, similar_task))
+    _time("Search new task", lambda: index.search(AGENT, MODEL, "Read the summary out loud"))
+    print("Most similar:", index.search(AGENT, MODEL, similar_task))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmarks the read and write latency and throughput of the Store backends
+
+Run it via
+
+```bash
+python benchmarks/bench_store.py --runs 200
+```
+
+The S3Store is benchmarked against a local MinIO server if `--s3-endpoint-url` is provided and
+otherwise against an in process `moto` mock if installed.
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Callable, Dict, List
+
+from transformers_agent_ui.assets import get_boat_in_water_image
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.s3_store import S3Store
+from transformers_agent_ui.domain.store import BaseStore, Store
+
+BUCKET = "transformers-agent-benchmark"
+AGENT = "HuggingFace"
+MODEL = "StarcoderBase"
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+def _measure(function: Callable, arguments: List) -> Dict[str, float]:
+    latencies = []
+    start = time.perf_counter()
+    for argument in arguments:
+        operation_start = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - operation_start)
+    duration = time.perf_counter() - start
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "ops_per_s": len(arguments) / duration,
+    }
+
+
+def benchmark(store: BaseStore, runs: int, value) -> Dict[str, Dict[str, float]]:
+    """Returns the write and read latencies and throughput of the store"""
+    tasks = [f"Task {index}" for index in range(runs)]
+
+    def write(task):
+        store.write(AGENT, MODEL, task, {}, "prompt", "explanation", "code", value)
+
+    def read(task):
+        store.read(AGENT, MODEL, task, {})
+
+    return {"write": _measure(write, tasks), "read": _measure(read, tasks)}
+
+
+def _create_s3_store(stack: ExitStack, endpoint_url: str | None) -> S3Store | None:
+    try:
+        import boto3  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    if not endpoint_url:
+        try:
+            import moto  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            return None
+        stack.enter_context(moto.mock_aws())
+    client = boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint_url)
+    client.create_bucket(Bucket=BUCKET)
+    return S3Store(bucket=BUCKET, client=client)
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--s3-endpoint-url", default=None)
+    args = parser.parse_args()
+
+    values = {"text": "A boat in the water. " * 10, "image": get_boat_in_water_image().copy()}
+    with ExitStack() as stack:
+        stores: Dict[str, BaseStore | None] = {
+            "memory": InMemoryStore(),
+            "local": Store(path=stack.enter_context(tempfile.TemporaryDirectory())),
+            "s3": _create_s3_store(stack, args.s3_endpoint_url),
+        }
+        print(f"{'store':8} {'value':6} {'op':6} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9}")
+        for name, store in stores.items():
+            if store is None:
+                print(f"{name:8} skipped. Install boto3 and moto or provide --s3-endpoint-url")
+                continue
+            for value_name, value in values.items():
+                for operation, result in benchmark(store, args.runs, value).items():
+                    print(
+                        f"{name:8} {value_name:6} {operation:6} {result['p50_ms']:9.2f} "
+                        f"{result['p95_ms']:9.2f} {result['ops_per_s']:9.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
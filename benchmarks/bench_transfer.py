@@ -0,0 +1,78 @@
+"""Benchmarks the export and import of the runs of a Store
+
+Run it via
+
+```bash
+python benchmarks/bench_transfer.py --runs 5000
+```
+"""
+import argparse
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from pickle import dump
+
+from transformers_agent_ui.domain.store import DB_NAME, Store
+from transformers_agent_ui.domain.transfer import export_runs, import_runs
+
+
+def _populate(store: Store, path: Path, runs: int, assets: int):
+    """Writes the assets and inserts the runs referring to them directly via SQL"""
+    names = []
+    for index in range(assets):
+        name = f"asset-{index}.pickle"
+        with (store.asset_path / name).open("wb") as file:
+            dump(f"A boat in the water {index}. " * 100, file)
+        names.append(name)
+    rows = [
+        (
+            "2023-05-20 00:00:00",
+            "HuggingFace",
+            "StarcoderBase",
+            f"Task {index}",
+            "prompt " * 500,
+            "explanation",
+            "code",
+            names[index % assets],
+        )
+        for index in range(runs)
+    ]
+    with sqlite3.connect(path / DB_NAME) as conn:
+        conn.executemany("INSERT INTO RESULTS VALUES(?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def main():
+    """Runs the benchmark and prints a report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--runs", type=int, default=5000)
+    parser.add_argument("--assets", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+        source = Store(path=path / "source")
+        _populate(source, path / "source", args.runs, args.assets)
+        archive = path / "cache.tar"
+
+        for name, function, store in [
+            ("Export", export_runs, source),
+            ("Import", import_runs, Store(path=path / "target")),
+        ]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            count = function(store, archive, chunk_size=args.chunk_size)
+            duration = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{name} of {count} runs: {duration:.2f}s ({count / duration:.0f} runs/s, "
+                f"peak memory {peak / 1024 / 1024:.1f} MiB)"
+            )
+        print(f"Archive size: {archive.stat().st_size / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
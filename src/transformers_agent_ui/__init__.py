@@ -2,7 +2,21 @@
 
 A component you can use in the notebook or your (Panel) web app.
 """
-from transformers_agent_ui.ui.transformers_agent_ui import TransformersAgentUI
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from transformers_agent_ui.ui.transformers_agent_ui import TransformersAgentUI
 
 VERSION = "0.4.1"
 __all__ = ["TransformersAgentUI"]
+
+
+def __getattr__(name: str):
+    # Imported on first use. So importing a module of the package, e.g. by the `panel.io.rest`
+    # providers, does not import transformers and torch
+    if name == "TransformersAgentUI":
+        # pylint: disable=import-outside-toplevel, redefined-outer-name
+        from transformers_agent_ui.ui.transformers_agent_ui import TransformersAgentUI
+
+        return TransformersAgentUI
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,36 +4,167 @@ A wrapper of the Hugging Face transformers agent. See
 https://huggingface.co/docs/transformers/transformers_agents
 """
 import logging
-from datetime import datetime
+import os
+import time
+from contextlib import nullcontext
+from functools import cache
+from typing import Any, Dict, List, Optional
 
 import param
+import requests
 from transformers import HfAgent, OpenAiAgent
+from transformers.tools import Agent
 
-from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.cancellation import (
+    Cancellation,
+    CancelledError,
+    StageTimeoutError,
+    get_timeouts,
+)
 from transformers_agent_ui.domain.custom_run import run
+from transformers_agent_ui.domain.local_tools import get_local_tool_pool
+from transformers_agent_ui.domain.logs import SessionLogHandler, ValueSummary, capture_logs
+from transformers_agent_ui.domain.metrics import RATE_LIMITED, RUN_ERRORS, RUN_SECONDS, RUNS
+from transformers_agent_ui.domain.prompts import PromptBuilder
+from transformers_agent_ui.domain.providers import (
+    Capabilities,
+    Provider,
+    create_agent,
+    get_capabilities,
+    register_provider,
+)
+from transformers_agent_ui.domain.routing import RoutedAgent
 from transformers_agent_ui.domain.run import Run
-from transformers_agent_ui.domain.store import Store
-from transformers_agent_ui.domain.token import TokenManager
+from transformers_agent_ui.domain.sandbox import ProcessSandbox, get_default_sandbox
+from transformers_agent_ui.domain.sessions import SESSION_POOL
+from transformers_agent_ui.domain.similarity import TaskIndex
+from transformers_agent_ui.domain.store import BaseStore
+from transformers_agent_ui.domain.store_factory import get_default_store
+from transformers_agent_ui.domain.token import TokenManager, get_request_token, use_token
 
 log = logging.getLogger(__name__)
 
+SIMILARITY_THRESHOLD_ENV_VALUE = "TRANSFORMERS_AGENT_UI_SIMILARITY_THRESHOLD"
+MAX_PROMPT_TOOLS_ENV_VALUE = "TRANSFORMERS_AGENT_UI_MAX_PROMPT_TOOLS"
 
-def _get_agent(agent, model, token):
-    """Returns the agent"""
-    # pylint: disable=line-too-long
-    params = AGENT_CONFIGURATION[agent]["models"][model]
-    if agent == "HuggingFace":
-        return HfAgent(
-            **params,
-            token=token,
-        )
-    if agent == "OpenAI":
-        return OpenAiAgent(
-            **params,
-            api_key=token,
-        )
 
-    raise ValueError(f"The agent {agent} and model {model} is not supported")
+# Source: transformers/tools/agents.py
+def generate_one(
+    session: requests.Session, url_endpoint: str, token: str, prompt: str, stop: List[str]
+) -> str:
+    """Generates a completion of the prompt using the Hugging Face inference endpoint"""
+    headers = {"Authorization": token}
+    inputs: Dict[str, Any] = {
+        "inputs": prompt,
+        "parameters": {"max_new_tokens": 200, "return_full_text": False, "stop": stop},
+    }
+
+    response = session.post(url_endpoint, json=inputs, headers=headers)
+    if response.status_code == 429:
+        RATE_LIMITED.inc(endpoint=url_endpoint)
+        log.info("Getting rate-limited, waiting a tiny bit before trying again.")
+        time.sleep(1)
+        return generate_one(session, url_endpoint, token, prompt, stop)
+    if response.status_code != 200:
+        raise ValueError(f"Error {response.status_code}: {response.json()}")
+
+    result = response.json()[0]["generated_text"]
+    # Inference API returns the stop sequence
+    for stop_seq in stop:
+        if result.endswith(stop_seq):
+            return result[: -len(stop_seq)]
+    return result
+
+
+def get_authorization(token: str) -> str:
+    """Returns the value of the Authorization header for the token"""
+    if token.startswith("Bearer") or token.startswith("Basic"):
+        return token
+    return f"Bearer {token}"
+
+
+class PooledHfAgent(HfAgent):
+    """A HfAgent sending its requests via the shared, keep-alive session of the endpoint
+
+    The agent is shared by the sessions. Its requests use the token set via `use_token`.
+    """
+
+    def generate_one(self, prompt, stop):
+        token = get_request_token()
+        authorization = get_authorization(token) if token else self.token
+        session = SESSION_POOL.get(self.url_endpoint)
+        return generate_one(session, self.url_endpoint, authorization, prompt, stop)
+
+
+class PooledOpenAiAgent(OpenAiAgent):
+    """An OpenAiAgent sending its requests via the shared, keep-alive session of the OpenAI API
+
+    The agent is shared by the sessions. Its requests use the token set via `use_token` instead of
+    the global `openai.api_key`.
+    """
+
+    def __init__(self, model="text-davinci-003", endpoint="https://api.openai.com", **kwargs):
+        # pylint: disable=non-parent-init-called, super-init-not-called
+        # OpenAiAgent.__init__ sets the global `openai.api_key` shared by all sessions
+        Agent.__init__(self, **kwargs)
+        self.model = model
+        self.endpoint = endpoint
+
+    def _post(self, path: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.endpoint}/v1/{path}"
+        headers = {"Authorization": get_authorization(get_request_token())}
+        response = SESSION_POOL.get(self.endpoint).post(url, json=data, headers=headers)
+        if response.status_code == 429:
+            RATE_LIMITED.inc(endpoint=url)
+        if response.status_code != 200:
+            raise ValueError(f"Error {response.status_code}: {response.json()}")
+        return response.json()
+
+    def _chat_generate(self, prompt, stop):
+        data = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0,
+            "stop": stop,
+        }
+        return self._post("chat/completions", data)["choices"][0]["message"]["content"]
+
+    def _completion_generate(self, prompts, stop):
+        data = {
+            "model": self.model,
+            "prompt": prompts,
+            "temperature": 0,
+            "stop": stop,
+            "max_tokens": 200,
+        }
+        return [answer["text"] for answer in self._post("completions", data)["choices"]]
+
+
+@cache
+def get_default_task_index() -> TaskIndex:
+    """Returns the index of the tasks of the default store shared by all sessions"""
+    return TaskIndex().update(get_default_store())
+
+
+def _create_hf_agent(model: Dict[str, Any], configuration: Dict[str, Any]) -> PooledHfAgent:
+    # pylint: disable=unused-argument
+    return PooledHfAgent(**model, token="")
+
+
+def _create_open_ai_agent(
+    model: Dict[str, Any], configuration: Dict[str, Any]
+) -> PooledOpenAiAgent:
+    return PooledOpenAiAgent(**model, endpoint=configuration["http"]["endpoint"])
+
+
+register_provider(Provider("huggingface", _create_hf_agent, Capabilities(max_concurrency=8)))
+register_provider(Provider("openai", _create_open_ai_agent, Capabilities(batch=True)))
+
+
+@cache
+def _get_agent(agent, model):
+    """Returns the agent shared by the sessions. The token is set per request via `use_token`"""
+    return create_agent(agent, model)
 
 
 class TransformersAgent(Run):
@@ -43,27 +174,87 @@ class TransformersAgent(Run):
     remote = param.Boolean(default=True, readonly=True)
 
     is_running = param.Boolean()
+    cancel = param.Event(doc="Click to cancel the current run")
 
     use_cache: bool = param.Boolean(
         default=True, doc="If True a Cache is used to speed up run and to bring the the costs."
     )
-    cache: Store = param.ClassSelector(class_=Store, precedence=-1)
+    cache: BaseStore = param.ClassSelector(class_=BaseStore, precedence=-1)
+    similarity_threshold = param.Number(
+        default=None,
+        bounds=(0.0, 1.0),
+        allow_None=True,
+        doc="""If provided the run of a cached, similar task is used if its match score is at least
+        the threshold. For example 0.9.""",
+    )
+    task_index: TaskIndex = param.ClassSelector(class_=TaskIndex, precedence=-1)
+    match_score = param.Number(
+        default=None,
+        allow_None=True,
+        constant=True,
+        doc="""The similarity between the task and the task of the cached run used. 1.0 for an exact
+        match. None if the agent was run.""",
+    )
+    matched_task = param.String(constant=True, doc="The task of the cached run used")
+    error = param.String(doc="The reason the last run failed. Empty if it did not fail")
+    asset = param.String(
+        precedence=-1,
+        doc="""The path of the value written by the last run relative to the `asset_path` of the
+        cache. Empty if it was read from the cache or the values are not stored as files""",
+    )
+    max_prompt_tools = param.Integer(
+        default=None,
+        bounds=(1, None),
+        allow_None=True,
+        doc="""If provided the prompt only describes up to this number of tools relevant to the
+        task instead of all the tools. Makes the prompt smaller and the generation faster.""",
+    )
     token_manager: TokenManager = param.ClassSelector(class_=TokenManager, precedence=-1)
+    sandbox: ProcessSandbox = param.ClassSelector(
+        class_=ProcessSandbox,
+        precedence=-1,
+        doc="If provided the generated code is evaluated in the worker processes of the sandbox",
+    )
+    log_handler: SessionLogHandler = param.ClassSelector(
+        class_=SessionLogHandler,
+        precedence=-1,
+        doc="""If provided the logs of the runs are also kept by this handler. For example to show
+        them in the UI""",
+    )
 
     def __init__(self, **params):
         if "cache" not in params:
-            params["cache"] = Store()
+            params["cache"] = get_default_store()
+        if "similarity_threshold" not in params and os.getenv(SIMILARITY_THRESHOLD_ENV_VALUE):
+            params["similarity_threshold"] = float(os.environ[SIMILARITY_THRESHOLD_ENV_VALUE])
+        if "max_prompt_tools" not in params and os.getenv(MAX_PROMPT_TOOLS_ENV_VALUE):
+            params["max_prompt_tools"] = int(os.environ[MAX_PROMPT_TOOLS_ENV_VALUE])
         if "token_manager" not in params:
             params["token_manager"] = TokenManager()
+        if "sandbox" not in params:
+            params["sandbox"] = get_default_sandbox()
         super().__init__(**params)
+        self._cancellation = Cancellation()
 
     def get_token(self) -> str:
         """Returns the token"""
         return self.token_manager.get(self.agent)
 
-    def get_agent(self, token: str):
-        """Returns the Agent"""
-        return _get_agent(agent=self.agent, model=self.model, token=token)
+    def get_agent(self):
+        """Returns the Agent. It is shared by the sessions and used with the token of the session
+        set via `use_token`"""
+        return _get_agent(agent=self.agent, model=self.model)
+
+    def get_routed_agent(self) -> RoutedAgent:
+        """Returns a RoutedAgent generating via the model or the other models of the agent as
+        routed by their recent latency and errors"""
+        return RoutedAgent(agent=self.agent, model=self.model, get_agent=_get_agent)
+
+    def get_prompt_builder(self) -> Optional[PromptBuilder]:
+        """Returns the PromptBuilder pruning the tools of the prompt if `max_prompt_tools` is set"""
+        if self.max_prompt_tools is None:
+            return None
+        return PromptBuilder(max_tools=self.max_prompt_tools)
 
     def _get_run_kwargs(self):
         """Returns the kwargs with the 'output' added"""
@@ -75,76 +266,205 @@ class TransformersAgent(Run):
             kwargs["value"] = self.value
         return kwargs
 
+    def _single_flight(self):
+        """Returns a context manager ensuring the same run is only computed once at a time"""
+        if self.use_cache:
+            return self.cache.single_flight(agent=self.agent, model=self.model, task=self.task)
+        return nullcontext()
+
+    def get_task_index(self) -> TaskIndex:
+        """Returns the index of the tasks of the cache. Creates it the first time"""
+        if self.task_index is None:
+            if self.cache is get_default_store():
+                self.task_index = get_default_task_index()
+            else:
+                self.task_index = TaskIndex().update(self.cache)
+        return self.task_index
+
+    def _find_cached_task(self) -> str:
+        """Returns the task of the cached run to use or "" if none. Sets the match score"""
+        match_score, matched_task = None, ""
+        if not self.use_cache:
+            pass
+        elif self.cache.exists(
+            agent=self.agent, model=self.model, task=self.task, kwargs=self.kwargs
+        ):
+            match_score, matched_task = 1.0, self.task
+        elif self.similarity_threshold is not None:
+            match = self.get_task_index().search(agent=self.agent, model=self.model, task=self.task)
+            if (
+                match
+                and match[1] >= self.similarity_threshold
+                and self.cache.exists(
+                    agent=self.agent, model=self.model, task=match[0], kwargs=self.kwargs
+                )
+            ):
+                matched_task, match_score = match
+        with param.edit_constant(self):
+            self.param.update(match_score=match_score, matched_task=matched_task)
+        return matched_task
+
+    @param.depends("cancel", watch=True)
+    def _handle_cancel(self):
+        # A click just after the run finished must not cancel the next run
+        if self.is_running:
+            self.cancel_run()
+
+    def cancel_run(self):
+        """Cancels the current run, or the next one if none is running. It stops at its next
+        cancellation point, i.e. right away if it waits for the LLM, after the resolution of the
+        tools and between the statements"""
+        log.info("Cancelling the run", extra=self._get_log_extra())
+        self._cancellation.cancel()
+
+    def _run_or_read_from_cache(self, kwargs) -> bool:
+        """Sets the output from the cache or by running the agent. Returns True if an exception was
+        raised"""
+        cached_task = self._find_cached_task()
+        if cached_task:
+            row = self.cache.read(
+                agent=self.agent, model=self.model, task=cached_task, kwargs=self.kwargs
+            )
+            self.param.update(**row)
+
+            log.info(
+                "Cache hit for agent='%s', model='%s' and task='%s' with match score %.2f",
+                self.agent,
+                self.model,
+                self.task,
+                self.match_score,
+                extra=self._get_log_extra(),
+            )
+            return False
+
+        token = self.get_token()
+        if not token and get_capabilities(self.agent).requires_token:
+            self._handle_no_token(self.agent)
+            return True
+
+        agent = self.get_routed_agent()
+        try:
+            with use_token(token):
+                run(
+                    agent=agent,
+                    task=self.task,
+                    remote=self.remote,
+                    run_output=self,
+                    tool_cache=self.cache if self.use_cache else None,
+                    sandbox=self.sandbox,
+                    local_tools=None if self.remote else get_local_tool_pool(),
+                    metric_labels=self._get_metric_labels(),
+                    prompt_builder=self.get_prompt_builder(),
+                    cancellation=self._cancellation,
+                    **kwargs,
+                )
+            self.model_used = agent.model_used
+            # self.value = agent.run(task=self.task, remote=self.remote, **kwargs)
+        except CancelledError as exc:
+            self._handle_cancelled(exc)
+            self.value = None
+            return True
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self._handle_run_exception(exc)
+            self.value = None
+            return True
+        return False
+
+    def _get_metric_labels(self) -> Dict[str, str]:
+        """Returns the labels of the metrics of the run"""
+        return {"agent": self.agent, "model": self.model}
+
+    def _get_log_extra(self) -> Dict[str, Any]:
+        """Returns the fields added to the structured logs of the run"""
+        return {
+            "agent": self.agent,
+            "model": self.model,
+            "model_used": self.model_used,
+            "task": self.task,
+        }
+
     def run(self):
         """Runs the agent, model on the `value`"""
-        exception_raised = False
+        with capture_logs(self.log_handler):
+            return self._run()
 
+    def _run(self):
+        start = time.perf_counter()
         kwargs = self._get_run_kwargs()
 
         self.value = None
         self.prompt = "Coming up ..."
         self.code = "Coming up ..."
         self.explanation = "Coming up ..."
+        self.model_used = ""
+        self.error = ""
+        self.asset = ""
+        self._cancellation.timeouts = get_timeouts(self.agent)
         self.is_running = True
 
-        if self.use_cache and self.cache.exists(
-            agent=self.agent, model=self.model, task=self.task, kwargs=self.kwargs
-        ):
-            row = self.cache.read(
-                agent=self.agent, model=self.model, task=self.task, kwargs=self.kwargs
-            )
-            self.param.update(**row)
+        # Concurrent runs of the same task, also in other processes sharing the cache, wait for
+        # the first one and then read its result from the cache
+        with self._single_flight():
+            exception_raised = self._run_or_read_from_cache(kwargs)
 
-            print(
-                f"{datetime.now()} Cache hit for agent='{self.agent}', model='{self.model}' "
-                f"and task='{self.task}'"
-            )
-        else:
-            token = self.get_token()
-            if not token:
-                self._handle_no_token(self.agent)
-                exception_raised = True
-            else:
-                agent = self.get_agent(token=token)
-                try:
-                    run(agent=agent, task=self.task, remote=self.remote, run_output=self, **kwargs)
-                    # self.value = agent.run(task=self.task, remote=self.remote, **kwargs)
-                except Exception as exc:  # pylint: disable=broad-exception-caught
-                    self._handle_run_exception(exc)
-                    self.value = None
-                    exception_raised = True
+            # The runs read from the cache, also of similar tasks, are not written again
+            if not self.value is None and self.match_score is None:
+                self.asset = self.cache.write(
+                    agent=self.agent,
+                    model=self.model,
+                    task=self.task,
+                    kwargs=self.kwargs,
+                    prompt=self.prompt,
+                    explanation=self.explanation,
+                    code=self.code,
+                    value=self.value,
+                    model_used=self.model_used,
+                )
+                # The index of the default store is shared with the sessions using a threshold
+                if self.task_index is not None or self.cache is get_default_store():
+                    self.get_task_index().add(agent=self.agent, model=self.model, task=self.task)
 
+        labels = self._get_metric_labels()
+        source = "agent" if self.match_score is None else "cache"
+        RUN_SECONDS.observe(time.perf_counter() - start, source=source, **labels)
         if not self.value is None:
-            self.cache.write(
-                agent=self.agent,
-                model=self.model,
-                task=self.task,
-                kwargs=self.kwargs,
-                prompt=self.prompt,
-                explanation=self.explanation,
-                code=self.code,
-                value=self.value,
-            )
-            print(self.value)
+            RUNS.inc(outcome="run" if source == "agent" else "cache_hit", **labels)
+            # The value is only converted to a short summary if the record is shown
+            log.info("Result: %s", ValueSummary(self.value), extra=self._get_log_extra())
         elif not exception_raised:
             self._handle_no_result()
 
         if self.value is None or self.value == "":
             self.value = "No output generated"
 
+        self._cancellation = Cancellation()
         self.is_running = False
         return self.value
 
     def _handle_no_result(self):
-        print("No result returned")
+        RUNS.inc(outcome="no_result", **self._get_metric_labels())
+        log.warning("No result returned", extra=self._get_log_extra())
+        self.error = "No result returned"
 
     def _handle_no_token(self, agent):
-        print(f"No token found for agent '{agent}'")
+        RUNS.inc(outcome="no_token", **self._get_metric_labels())
+        log.warning("No token found for agent '%s'", agent, extra=self._get_log_extra())
+        self.error = f"No token found for agent '{agent}'"
+
+    def _handle_cancelled(self, exc: CancelledError):
+        outcome = "timeout" if isinstance(exc, StageTimeoutError) else "cancelled"
+        RUNS.inc(1, outcome=outcome, **self._get_metric_labels())
+        log.warning("%s", exc, extra=self._get_log_extra())
+        self.error = str(exc)
 
     def _handle_run_exception(self, exc: Exception):
         # openai.error.RateLimitError: You exceeded your current quota, please check your plan
         # and billing details.
-        print(exc)
+        labels = self._get_metric_labels()
+        RUNS.inc(1, outcome="error", **labels)
+        RUN_ERRORS.inc(1, error=type(exc).__name__, **labels)
+        log.error("The run failed: %s", exc, exc_info=exc, extra=self._get_log_extra())
+        self.error = f"The run failed: {exc}"
 
     def __str__(self):
         return self.__class__.__name__
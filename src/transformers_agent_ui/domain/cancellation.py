@@ -0,0 +1,131 @@
+"""Cooperative cancellation and per-stage timeouts of the runs
+
+A run checks its Cancellation at the cancellation points between its stages, i.e. the generation of
+the code, the resolution of the tools and the evaluation of each statement. The blocking calls of a
+stage, for example the request to the LLM, are waited for in short slices. So a cancelled or timed
+out run returns right away. The abandoned call completes in the background and its result is
+dropped. The evaluations in a sandbox are stopped by replacing the worker process.
+
+The timeouts of the stages are configured via the TIMEOUT_CONFIGURATION and the `timeouts` of the
+agents.
+"""
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION, TIMEOUT_CONFIGURATION
+
+GENERATE = "generate"
+RESOLVE = "resolve"
+EVALUATE = "evaluate"
+# The seconds between the checks for cancellation while waiting for a blocking call
+POLL_INTERVAL = 0.1
+
+
+class CancelledError(Exception):
+    """Raised at a cancellation point of a cancelled run"""
+
+
+class StageTimeoutError(CancelledError, TimeoutError):
+    """Raised at a cancellation point of a stage that exceeded its timeout"""
+
+
+def get_timeouts(agent: str) -> Dict[str, Optional[float]]:
+    """Returns the timeouts in seconds of the stages of the runs of the agent"""
+    return {**TIMEOUT_CONFIGURATION, **AGENT_CONFIGURATION[agent].get("timeouts", {})}
+
+
+def _run_in_thread(function: Callable, *args, **kwargs) -> Future:
+    """Runs the function in a new daemon thread with the current context"""
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(function, *args, **kwargs))
+        except BaseException as exc:  # pylint: disable=broad-exception-caught
+            future.set_exception(exc)
+
+    threading.Thread(target=target, daemon=True, name="transformers-agent-call").start()
+    return future
+
+
+class Cancellation:
+    """Cancels a run and times out its stages
+
+    Args:
+        timeouts: The timeout in seconds by stage. None or missing for no timeout
+    """
+
+    def __init__(self, timeouts: Dict[str, Optional[float]] | None = None):
+        self.timeouts = timeouts or {}
+        self._cancelled = threading.Event()
+        self._stage = ""
+        self._deadline: Optional[float] = None
+
+    def cancel(self):
+        """Cancels the run. It stops at its next cancellation point"""
+        self._cancelled.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        """True if the run was cancelled"""
+        return self._cancelled.is_set()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Times out the stage after its timeout"""
+        self.check()
+        timeout = self.timeouts.get(name)
+        previous = self._stage, self._deadline
+        self._stage = name
+        self._deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            yield
+        finally:
+            self._stage, self._deadline = previous
+
+    def get_remaining_time(self) -> Optional[float]:
+        """Returns the seconds until the current stage times out. None if it has no timeout"""
+        if self._deadline is None:
+            return None
+        return self._deadline - time.monotonic()
+
+    def check(self):
+        """A cancellation point. Raises a CancelledError if the run was cancelled or a
+        StageTimeoutError if the current stage exceeded its timeout"""
+        if self._cancelled.is_set():
+            raise CancelledError("The run was cancelled")
+        remaining_time = self.get_remaining_time()
+        if remaining_time is not None and remaining_time <= 0:
+            raise StageTimeoutError(
+                f"The {self._stage} stage exceeded its timeout of {self.timeouts[self._stage]}s"
+            )
+
+    def wait(self, future: Future) -> Any:
+        """Returns the result of the future. Checks for cancellation while waiting"""
+        while True:
+            self.check()
+            timeout = POLL_INTERVAL
+            remaining_time = self.get_remaining_time()
+            if remaining_time is not None:
+                timeout = max(min(timeout, remaining_time), 0)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # The function itself may raise a TimeoutError
+                if future.done():
+                    raise
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        """Calls the function in a thread and returns its result. Checks for cancellation while
+        waiting. The function is abandoned, not stopped, if the run is cancelled"""
+        return self.wait(_run_in_thread(function, *args, **kwargs))
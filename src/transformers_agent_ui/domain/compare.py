@@ -0,0 +1,128 @@
+"""Compares the runs of one task by several agents and models
+
+The task is run by each agent and model concurrently. Each run reads from and writes to the cache
+of its own agent and model. The digests of the images and arrays of the arguments are computed
+once and shared by the runs, for example to look up the cached tool results.
+
+The latency, the source and the estimated cost of each run are reported. So the fastest adequate
+model can be chosen for a kind of task.
+"""
+from __future__ import annotations
+
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, List, Sequence, Tuple
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.hashing import share_hashes
+from transformers_agent_ui.domain.prompts import count_tokens
+
+
+@dataclass
+class ModelRun:  # pylint: disable=too-many-instance-attributes
+    """The result of the run of a task by an agent and model
+
+    Args:
+        agent: The name of the agent
+        model: The requested model
+        value: The value returned. None if the run failed
+        code: The code generated
+        model_used: The model that generated the code
+        seconds: The duration of the run
+        source: `cache` or `agent`
+        tokens: The approximate number of tokens of the prompt and the completion. 0 if cached
+        cost: The estimated cost in USD. 0.0 if cached
+        error: The reason the run failed if it did
+    """
+
+    agent: str
+    model: str
+    value: Any = None
+    code: str = ""
+    model_used: str = ""
+    seconds: float = 0.0
+    source: str = ""
+    tokens: int = 0
+    cost: float = 0.0
+    error: str = ""
+
+
+def get_price(agent: str, model: str) -> float:
+    """Returns the price in USD per 1000 tokens of the model. 0.0 if free"""
+    return AGENT_CONFIGURATION[agent].get("pricing", {}).get(model, 0.0)
+
+
+def get_all_models() -> List[Tuple[str, str]]:
+    """Returns the agent and model of every configured model"""
+    return [
+        (agent, model)
+        for agent, configuration in AGENT_CONFIGURATION.items()
+        for model in configuration["models"]
+    ]
+
+
+def _run(agent: TransformersAgent) -> ModelRun:
+    start = time.perf_counter()
+    agent.run()
+    seconds = time.perf_counter() - start
+    source = "agent" if agent.match_score is None else "cache"
+    result = ModelRun(
+        agent=agent.agent,
+        model=agent.model,
+        code=agent.code,
+        model_used=agent.model_used,
+        seconds=seconds,
+        source=source,
+        error=agent.error,
+    )
+    if not agent.error:
+        result.value = agent.value
+    if source == "agent" and not agent.error:
+        result.tokens = count_tokens(agent.prompt) + count_tokens(
+            agent.explanation + "\n" + agent.code
+        )
+        result.cost = result.tokens / 1000 * get_price(agent.agent, agent.model_used or agent.model)
+    return result
+
+
+def compare(
+    source: TransformersAgent, models: Sequence[Tuple[str, str]], max_workers: int | None = None
+) -> List[ModelRun]:
+    """Runs the task of the source by each agent and model concurrently
+
+    The runs use the task, kwargs, cache and settings of the source. Returns the results in the
+    order of the models.
+
+    Args:
+        source: The agent whose task and settings are used
+        models: The agent and model of each run
+        max_workers: The maximum number of concurrent runs. Defaults to one per model. The
+            generations are also limited by the `max_concurrency` of the providers.
+    """
+    agents = [
+        TransformersAgent(
+            agent=agent,
+            model=model,
+            task=source.task,
+            kwargs=source.kwargs,
+            cache=source.cache,
+            use_cache=source.use_cache,
+            similarity_threshold=source.similarity_threshold,
+            task_index=source.task_index,
+            token_manager=source.token_manager,
+            sandbox=source.sandbox,
+            log_handler=source.log_handler,
+            max_prompt_tools=source.max_prompt_tools,
+        )
+        for agent, model in models
+    ]
+    if not agents:
+        return []
+    with share_hashes(source.kwargs), ThreadPoolExecutor(
+        max_workers=max_workers or len(agents)
+    ) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _run, agent) for agent in agents]
+        return [future.result() for future in futures]
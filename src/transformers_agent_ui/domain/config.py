@@ -1,8 +1,46 @@
 """Configuration for the domain models"""
 # pylint: disable=line-too-long
+import json
+import os
+from typing import Any, Dict
+
 DEFAULT_AGENT = "HuggingFace"
-AGENT_CONFIGURATION = {
+AGENTS_ENV_VALUE = "TRANSFORMERS_AGENT_UI_AGENTS"
+# The default settings of the pooled, keep-alive HTTP sessions. Can be overridden per agent
+HTTP_CONFIGURATION: Dict[str, Any] = {"pool_connections": 10, "pool_maxsize": 10, "max_retries": 2}
+# The routing of the generations between the models of an agent, see `routing.py`. Can be
+# overridden per agent via its `routing`. `fallback` retries a failed generation via the other
+# models of the agent. `hedge_after` also sends the request to the next model if the generation has
+# not completed after that many seconds. A model is skipped while more than `max_error_rate` of its
+# last `window` generations failed, once there are at least `min_samples` of them.
+ROUTING_CONFIGURATION: Dict[str, Any] = {
+    "fallback": True,
+    "hedge_after": None,
+    "window": 20,
+    "min_samples": 5,
+    "max_error_rate": 0.5,
+}
+# The timeouts in seconds of the stages of a run, see `cancellation.py`. None for no timeout. Can be
+# overridden per agent via its `timeouts`. `generate` is the generation of the code by the LLM,
+# `resolve` the loading of the tools and `evaluate` the evaluation of the code.
+TIMEOUT_CONFIGURATION: Dict[str, Any] = {"generate": None, "resolve": None, "evaluate": None}
+# The local tools used by `remote=False` runs. `preload` lists the tasks or repo ids of the tools to
+# load at startup. For example `["image-captioning", "text-to-speech"]`. `max_memory` is the budget
+# in bytes of the weights of the loaded tools. `num_threads` sets the number of torch threads.
+LOCAL_TOOLS_CONFIGURATION: Dict[str, Any] = {
+    "preload": [],
+    "max_memory": 4 * 1024**3,
+    "num_threads": None,
+    "quantize": False,
+}
+# The agents by name. The `provider` creates the agents of the `models`, see `providers.py`. The
+# `capabilities` of the provider can be overridden per agent. For example `{"max_concurrency": 8}`.
+# The `pricing` is the cost in USD per 1000 tokens by model. Models without a price are free.
+# Agents can be added or replaced via a JSON file set by the `TRANSFORMERS_AGENT_UI_AGENTS`
+# environment variable
+AGENT_CONFIGURATION: Dict[str, Dict[str, Any]] = {
     "HuggingFace": {
+        "provider": "huggingface",
         "default": "StarcoderBase",
         "models": {
             "OpenAssistant": {
@@ -17,7 +55,13 @@ AGENT_CONFIGURATION = {
         },
     },
     "OpenAI": {
+        "provider": "openai",
         "default": "text-davinci-003",
+        "http": {"endpoint": "https://api.openai.com"},
         "models": {"text-davinci-003": {"model": "text-davinci-003"}},
+        "pricing": {"text-davinci-003": 0.02},
     },
 }
+if os.getenv(AGENTS_ENV_VALUE):
+    with open(os.environ[AGENTS_ENV_VALUE], encoding="utf8") as file:
+        AGENT_CONFIGURATION.update(json.load(file))
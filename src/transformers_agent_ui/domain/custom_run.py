@@ -4,7 +4,12 @@
 from __future__ import annotations
 
 import ast
-from typing import Callable, Dict
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Dict, List, Optional, Set
 
 from transformers.tools.agents import (
     clean_code_for_run,
@@ -13,16 +18,190 @@ from transformers.tools.agents import (
 )
 from transformers.tools.python_interpreter import InterpretorError, evaluate_ast
 
+from transformers_agent_ui.domain.cancellation import (
+    EVALUATE,
+    GENERATE,
+    RESOLVE,
+    Cancellation,
+    CancelledError,
+)
+from transformers_agent_ui.domain.metrics import LLM_SECONDS, time_tools
 from transformers_agent_ui.domain.run import RunOutput
+from transformers_agent_ui.domain.sessions import use_pooled_sessions
+from transformers_agent_ui.domain.store import BaseStore
+from transformers_agent_ui.domain.tool_cache import cache_tools
+
+if TYPE_CHECKING:
+    from transformers_agent_ui.domain.local_tools import LocalToolPool
+    from transformers_agent_ui.domain.prompts import PromptBuilder
+    from transformers_agent_ui.domain.sandbox import ProcessSandbox
+
+log = logging.getLogger(__name__)
+
+# The maximum number of statements evaluated concurrently. 1 evaluates sequentially.
+DEFAULT_MAX_WORKERS = 4
+# Guards the `cached_tools` of the agents shared by the sessions
+_cached_tools_lock = threading.Lock()
+
+
+def _get_names_read(node: ast.AST) -> Set[str]:
+    """Returns the names of the variables read by the node. The names of the called functions are
+    excluded as they are looked up in the tools and not in the state"""
+    function_names = {id(child.func) for child in ast.walk(node) if isinstance(child, ast.Call)}
+    return {
+        child.id
+        for child in ast.walk(node)
+        if isinstance(child, ast.Name)
+        and isinstance(child.ctx, ast.Load)
+        and id(child) not in function_names
+    }
+
+
+def _get_names_written(node: ast.AST) -> Optional[Set[str]]:
+    """Returns the names of the variables written by the node if it is a simple assignment like
+    `caption = image_captioner(image)`. Otherwise None is returned"""
+    if not isinstance(node, ast.Assign):
+        return None
+    if not all(isinstance(target, ast.Name) for target in node.targets):
+        return None
+    return {target.id for target in node.targets}  # type: ignore[attr-defined]
+
+
+def get_execution_levels(code_or_tree: str | ast.Module, state: Dict[str, Any]) -> List[List[int]]:
+    """Returns the indices of the statements of the code grouped into levels that can be evaluated
+    concurrently.
+
+    A statement is placed in a level after all the statements it depends on. A statement depends
+    on an earlier statement if it reads a variable the earlier statement writes, writes a variable
+    the earlier statement reads or writes or if one of them is not a simple assignment. Statements
+    reading unknown variables are never evaluated concurrently as `evaluate_ast` might resolve
+    them to a similar name in the `state`.
+    """
+    if isinstance(code_or_tree, str):
+        code_or_tree = ast.parse(code_or_tree)
+    known_names = set(state)
+    last_write: Dict[str, int] = {}
+    last_reads: Dict[str, int] = {}
+    barrier = -1
+    levels: List[int] = []
+    for node in code_or_tree.body:
+        written = _get_names_written(node)
+        read = _get_names_read(node)
+        if written is None or not read.issubset(known_names):
+            level = max(levels, default=-1) + 1
+            barrier = level
+        else:
+            level = barrier + 1
+            for name in read:
+                level = max(level, last_write.get(name, -1) + 1)
+            for name in written:
+                level = max(level, last_write.get(name, -1) + 1, last_reads.get(name, -1) + 1)
+        levels.append(level)
+        for name in read:
+            last_reads[name] = max(last_reads.get(name, -1), level)
+        for name in written or ():
+            last_write[name] = level
+            known_names.add(name)
+    grouped: List[List[int]] = [[] for _ in range(max(levels, default=-1) + 1)]
+    for idx, level in enumerate(levels):
+        grouped[level].append(idx)
+    return grouped
+
+
+def _stage(cancellation: Cancellation | None, name: str) -> ContextManager:
+    """Returns a context manager timing out the stage if a cancellation is provided"""
+    if cancellation is None:
+        return nullcontext()
+    return cancellation.stage(name)
+
+
+def _call(cancellation: Cancellation | None, function: Callable, *args, **kwargs):
+    """Calls the function. If a cancellation is provided it is checked while waiting"""
+    if cancellation is None:
+        return function(*args, **kwargs)
+    return cancellation.call(function, *args, **kwargs)
+
+
+def _resolve_cached_tools(
+    agent, code: str, remote: bool, cancellation: Cancellation | None = None
+) -> Dict[str, Callable]:
+    """Returns the tools of the code. The tools are added to the `cached_tools` of the agent
+
+    resolve_tools adds to the dict it is given. So it is given a copy, as the agent may be shared.
+    The tools are loaded outside of the lock and the first one loaded of a tool is kept.
+    """
+    with _cached_tools_lock:
+        cached_tools = None if agent.cached_tools is None else dict(agent.cached_tools)
+    tools = _call(
+        cancellation, resolve_tools, code, agent.toolbox, remote=remote, cached_tools=cached_tools
+    )
+    tools = use_pooled_sessions(tools)
+    with _cached_tools_lock:
+        if agent.cached_tools is None:
+            agent.cached_tools = {}
+        for name, tool in tools.items():
+            tools[name] = agent.cached_tools.setdefault(name, tool)
+    return tools
+
+
+def _evaluate_level(  # pylint: disable=too-many-arguments
+    expression: ast.Module,
+    level: List[int],
+    state: Dict[str, Any],
+    tools: Dict[str, Callable],
+    executor: ThreadPoolExecutor | None,
+    cancellation: Cancellation | None = None,
+) -> Dict[int, Any]:
+    """Evaluates the independent statements of the level and returns their results by index
+
+    If a cancellation is provided the statements are evaluated in the executor and waited for at
+    cancellation points. The executor is required then or if the level has several statements"""
+    line_results: Dict[int, Any] = {}
+    futures: Dict[int, Future] = {}
+    if len(level) > 1 or cancellation is not None:
+        assert executor is not None  # nosec
+        for idx in level:
+            # The tools are called with the token, log handler and shared hashes of the run
+            context = contextvars.copy_context()
+            futures[idx] = executor.submit(
+                context.run, evaluate_ast, expression.body[idx], state, tools
+            )
+    for idx in level:
+        try:
+            if cancellation is not None:
+                line_results[idx] = cancellation.wait(futures[idx])
+            elif idx in futures:
+                line_results[idx] = futures[idx].result()
+            else:
+                line_results[idx] = evaluate_ast(expression.body[idx], state, tools)
+        except CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except InterpretorError as exc:
+            for future in futures.values():
+                future.cancel()
+            msg = f"Evaluation of the code stopped at line {idx} before the end because of the following error:\n{exc}"
+
+            raise InterpretorError(msg) from exc
+    return line_results
 
 
 # Source: transformers/tools/python_interpreter.py
-def evaluate(code: str, tools: Dict[str, Callable], state=None):
+def evaluate(
+    code: str,
+    tools: Dict[str, Callable],
+    state=None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    cancellation: Cancellation | None = None,
+):
     """
     Evaluate a python expression using the content of the variables stored in a state and only
     evaluating a given set of functions.
 
-    This function will recurse through the nodes of the tree provided.
+    This function will recurse through the nodes of the tree provided. Independent assignments
+    like `caption = image_captioner(image)` and `translation = translator(text)` are evaluated
+    concurrently in a thread pool.
 
     Args:
         code (`str`):
@@ -34,27 +213,67 @@ def evaluate(code: str, tools: Dict[str, Callable], state=None):
             A dictionary mapping variable names to values. The `state` should contain the initial
             inputs but will be updated by this function to contain all variables as they are
             evaluated.
+        max_workers (`int`, *optional*, defaults to `DEFAULT_MAX_WORKERS`):
+            The maximum number of statements to evaluate concurrently. If 1 the statements are
+            evaluated sequentially.
+        cancellation (`Cancellation`, *optional*):
+            If provided it is checked before and while evaluating each statement. A cancelled
+            evaluation raises a `CancelledError` without waiting for the statements in progress.
     """
     expression = ast.parse(code)
     if state is None:
         state = {}
-    result = None
-    for idx, node in enumerate(expression.body):
-        try:
-            line_result = evaluate_ast(node, state, tools)
-        except InterpretorError as exc:
-            msg = f"Evaluation of the code stopped at line {idx} before the end because of the following error:\n{exc}"
 
-            raise InterpretorError(msg) from exc
+    if max_workers > 1:
+        levels = get_execution_levels(expression, state)
+    else:
+        levels = [[idx] for idx in range(len(expression.body))]
 
-        if line_result is not None:
-            result = line_result
+    line_results: Dict[int, Any] = {}
+    # Only needed to evaluate statements concurrently or to wait for them at cancellation points
+    executor = None
+    if cancellation is not None or any(len(level) > 1 for level in levels):
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    is_cancelled = False
+    try:
+        for level in levels:
+            if cancellation is not None:
+                cancellation.check()
+            line_results.update(
+                _evaluate_level(expression, level, state, tools, executor, cancellation)
+            )
+    except CancelledError:
+        # The statements in progress are abandoned
+        is_cancelled = True
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=not is_cancelled, cancel_futures=is_cancelled)
+
+    result = None
+    for idx in sorted(line_results):
+        if line_results[idx] is not None:
+            result = line_results[idx]
 
     return result
 
 
 # Source: transformers/tools/agents.py
-def run(agent, task, *, remote=False, run_output: RunOutput | None = None, **kwargs) -> RunOutput:
+def run(  # pylint: disable=too-many-arguments
+    agent,
+    task,
+    *,
+    remote=False,
+    run_output: RunOutput | None = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    tool_cache: BaseStore | None = None,
+    sandbox: ProcessSandbox | None = None,
+    local_tools: LocalToolPool | None = None,
+    metric_labels: Dict[str, str] | None = None,
+    prompt_builder: PromptBuilder | None = None,
+    cancellation: Cancellation | None = None,
+    **kwargs,
+) -> RunOutput:
     """
     Sends a request to the agent.
 
@@ -62,6 +281,25 @@ def run(agent, task, *, remote=False, run_output: RunOutput | None = None, **kwa
         task (`str`): The task to perform
         remote (`bool`, *optional*, defaults to `False`):
             Whether or not to use remote tools (inference endpoints) instead of local ones.
+        max_workers (`int`, *optional*, defaults to `DEFAULT_MAX_WORKERS`):
+            The maximum number of independent tool calls to evaluate concurrently.
+        tool_cache (`BaseStore`, *optional*):
+            If provided the results of the tool calls are cached in and reused from this store.
+            Not supported when evaluating in a `sandbox`.
+        sandbox (`ProcessSandbox`, *optional*):
+            If provided the code is evaluated in a worker process of this sandbox.
+        local_tools (`LocalToolPool`, *optional*):
+            If provided and not `remote` the local tools are shared via this pool instead of being
+            loaded per agent.
+        metric_labels (`Dict[str, str]`, *optional*):
+            The `agent` and `model` labels of the metrics. Defaults to the class of the agent.
+        prompt_builder (`PromptBuilder`, *optional*):
+            If provided the prompt only describes the tools relevant to the task. The code is still
+            resolved via the full toolbox.
+        cancellation (`Cancellation`, *optional*):
+            If provided the run raises a `CancelledError` at the next cancellation point once
+            cancelled and a `StageTimeoutError` once a stage exceeds its timeout. The cancellation
+            points are between the generation, the resolution of the tools and each statement.
         kwargs:
             Any keyword argument to send to the agent when evaluating the code.
     """
@@ -75,21 +313,49 @@ def run(agent, task, *, remote=False, run_output: RunOutput | None = None, **kwa
             code="...",
         )
 
-    run_output.prompt = agent.format_prompt(task)
-    result = agent.generate_one(run_output.prompt, stop=["Task:"])
+    if prompt_builder is not None:
+        run_output.prompt = prompt_builder.format_prompt(agent, task)
+    else:
+        run_output.prompt = agent.format_prompt(task)
+    if metric_labels is None:
+        metric_labels = {"agent": type(agent).__name__, "model": ""}
+    with _stage(cancellation, GENERATE), LLM_SECONDS.time(**metric_labels):
+        result = _call(cancellation, agent.generate_one, run_output.prompt, stop=["Task:"])
 
     run_output.explanation, code = clean_code_for_run(result)
-    print(f"==Explanation from the agent==\n{run_output.explanation}")
+    log.info("Explanation from the agent:\n%s", run_output.explanation)
     if code is not None:
         run_output.code = (
             get_tool_creation_code(code, agent.toolbox, remote=remote)
             + "# Exception line count starts below\n\n"
             + code
         )
-        print(f"\n\n==Code generated by the agent==\n{code}")
-        print("\n\n==Result==")
-        agent.cached_tools = resolve_tools(
-            code, agent.toolbox, remote=remote, cached_tools=agent.cached_tools
-        )
-        run_output.value = evaluate(code, agent.cached_tools, state=kwargs.copy())
+        log.info("Code generated by the agent:\n%s", code)
+        if sandbox is not None:
+            with _stage(cancellation, EVALUATE):
+                run_output.value = sandbox.evaluate(
+                    code,
+                    agent.toolbox,
+                    state=kwargs.copy(),
+                    remote=remote,
+                    max_workers=max_workers,
+                    cancellation=cancellation,
+                )
+            return run_output
+        with _stage(cancellation, RESOLVE):
+            if not remote and local_tools is not None:
+                tools = _call(cancellation, local_tools.resolve_tools, code, agent.toolbox)
+            else:
+                tools = _resolve_cached_tools(agent, code, remote, cancellation)
+        tools = time_tools(tools, metric_labels)
+        if tool_cache is not None:
+            tools = cache_tools(tools, store=tool_cache, metric_labels=metric_labels)
+        with _stage(cancellation, EVALUATE):
+            run_output.value = evaluate(
+                code,
+                tools,
+                state=kwargs.copy(),
+                max_workers=max_workers,
+                cancellation=cancellation,
+            )
     return run_output
@@ -0,0 +1,61 @@
+"""Provides the executor shared by the background work of the process and a RateLimiter"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+
+MAX_WORKERS_ENV_VALUE = "TRANSFORMERS_AGENT_UI_MAX_WORKERS"
+MAX_WORKERS = 4
+
+
+@cache
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the executor shared by the background work of the process
+
+    The number of workers can be set via the `TRANSFORMERS_AGENT_UI_MAX_WORKERS` environment
+    variable.
+    """
+    max_workers = int(os.getenv(MAX_WORKERS_ENV_VALUE, "") or MAX_WORKERS)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transformers-agent")
+
+
+class RateLimiter:
+    """A token bucket limiting the rate of calls, for example to an inference endpoint
+
+    Args:
+        rate: The number of calls per second
+        burst: The number of calls that may be made at once
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _wait_time(self) -> float:
+        """Takes a token and returns 0 if available. Otherwise returns the time to wait"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a call may be made"""
+        while wait_time := self._wait_time():
+            time.sleep(wait_time)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        pass
@@ -0,0 +1,273 @@
+"""Checks the integrity of a Store and repairs it
+
+A crash, a full disk or an asset removed by hand can leave a Store inconsistent. The check
+
+- drops the runs and tool results whose asset is missing or empty or, with `verify`, cannot be
+read.
+- removes the assets not referred to by any run or tool result and the temporary files of
+interrupted writes. Only once they are older than the `grace` period, so the files of the writes in
+progress are kept.
+- rebuilds the full text search index of the tasks if it is inconsistent.
+
+The rows and the files are processed in chunks via a connection of its own and short transactions.
+So the live reads and writes of the Store are not blocked for long. The files of a chunk are checked
+in parallel.
+
+Usage:
+
+```bash
+python -m transformers_agent_ui.domain.fsck .store
+python -m transformers_agent_ui.domain.fsck .store --dry-run --verify
+```
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Iterator, List
+
+from PIL.Image import open as open_pil_image
+
+from transformers_agent_ui.domain.metrics import STORE_RUNS
+from transformers_agent_ui.domain.store import ASSET_ERRORS, TMP_SUFFIX, Store, load_value
+
+log = logging.getLogger(__name__)
+
+# The seconds after which an unreferenced asset or a temporary file is considered left behind
+GRACE = 600.0
+CHUNK_SIZE = 1000
+WORKERS = 8
+# The tables referring to assets via their `value` and their key
+_TABLES = {"RESULTS": "rowid", "TOOL_RESULTS": "key"}
+
+
+@dataclass
+class FsckReport:
+    """The result of a check of a Store
+
+    Args:
+        rows: The number of runs and tool results checked
+        files: The number of files in the asset directory checked
+        dropped_rows: The number of runs and tool results with a missing or unreadable asset
+        removed_files: The number of unreferenced assets and temporary files left behind
+        rebuilt_index: True if the full text search index was inconsistent
+        repaired: False if the inconsistencies were only reported
+    """
+
+    rows: int = 0
+    files: int = 0
+    dropped_rows: int = 0
+    removed_files: int = 0
+    rebuilt_index: bool = False
+    repaired: bool = True
+
+
+def is_readable(path: Path, verify: bool = False) -> bool:
+    """Returns True if the asset exists and is not empty. If verify also if it can be loaded"""
+    try:
+        if path.stat().st_size == 0:
+            return False
+        if verify and path.suffix == ".png":
+            with open_pil_image(path) as image:
+                image.verify()
+        elif verify:
+            load_value(path, path.suffix)
+    except (*ASSET_ERRORS, NotImplementedError, SyntaxError):
+        # Pillow raises a SyntaxError for some corrupt images
+        return False
+    return True
+
+
+def _connect(store: Store) -> sqlite3.Connection:
+    return sqlite3.connect(store.db_path, timeout=30)
+
+
+def _iter_row_chunks(
+    conn: sqlite3.Connection, table: str, key: str, chunk_size: int
+) -> Iterator[List]:
+    """Yields the key and value of the rows of the table in chunks. Each chunk is queried on its
+    own, so no read transaction is held between the chunks"""
+    last = 0 if key == "rowid" else ""
+    while rows := conn.execute(
+        f"SELECT {key}, value FROM {table} WHERE {key}>? ORDER BY {key} LIMIT ?",  # nosec
+        [last, chunk_size],
+    ).fetchall():
+        yield rows
+        last = rows[-1][0]
+
+
+def _drop_rows(store: Store, conn: sqlite3.Connection, table: str, rows: List):
+    for row_key, value in rows:
+        log.warning("Dropped the %s row %s with the unreadable asset %s", table, row_key, value)
+    # The row may have been replaced since. Then it refers to another asset
+    with conn:
+        deleted = conn.executemany(
+            f"DELETE FROM {table} WHERE {_TABLES[table]}=? AND value=?", rows  # nosec
+        ).rowcount
+    if table == "RESULTS":
+        STORE_RUNS.inc(-deleted, path=str(store.path))
+
+
+def _check_rows(  # pylint: disable=too-many-arguments
+    store: Store,
+    conn: sqlite3.Connection,
+    executor: Executor,
+    report: FsckReport,
+    chunk_size: int,
+    verify: bool,
+    pause: float,
+):
+    check = partial(is_readable, verify=verify)
+    for table, key in _TABLES.items():
+        for rows in _iter_row_chunks(conn, table, key, chunk_size):
+            readable = executor.map(check, [store.asset_path / value for _, value in rows])
+            dropped = [row for row, is_ok in zip(rows, readable) if not is_ok]
+            report.rows += len(rows)
+            report.dropped_rows += len(dropped)
+            if dropped and report.repaired:
+                _drop_rows(store, conn, table, dropped)
+            time.sleep(pause)
+
+
+def _iter_file_chunks(path: Path, chunk_size: int) -> Iterator[List[Path]]:
+    with os.scandir(path) as entries:
+        chunk = []
+        for entry in entries:
+            if entry.is_file():
+                chunk.append(Path(entry.path))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _get_referenced(conn: sqlite3.Connection, names: List[str]) -> set:
+    placeholders = ", ".join("?" * len(names))
+    return {
+        row[0]
+        for row in conn.execute(
+            f"""SELECT value FROM RESULTS WHERE value IN ({placeholders}) UNION \
+                SELECT value FROM TOOL_RESULTS WHERE value IN ({placeholders})""",  # nosec
+            names + names,
+        )
+    }
+
+
+def _remove_if_stale(path: Path, before: float, repair: bool) -> bool:
+    """Removes the file if last modified before the time. Returns True if it is stale"""
+    try:
+        if path.stat().st_mtime >= before:
+            return False
+        if repair:
+            path.unlink()
+            log.warning("Removed the unreferenced file %s", path)
+    except FileNotFoundError:
+        # Removed concurrently, for example by the eviction of a tool result
+        return False
+    return True
+
+
+def _check_files(  # pylint: disable=too-many-arguments
+    store: Store,
+    conn: sqlite3.Connection,
+    executor: Executor,
+    report: FsckReport,
+    chunk_size: int,
+    grace: float,
+    pause: float,
+):
+    remove = partial(_remove_if_stale, before=time.time() - grace, repair=report.repaired)
+    for paths in _iter_file_chunks(store.asset_path, chunk_size):
+        names = [path.name for path in paths if path.suffix != TMP_SUFFIX]
+        referenced = _get_referenced(conn, names) if names else set()
+        candidates = [path for path in paths if path.name not in referenced]
+        report.files += len(paths)
+        report.removed_files += sum(executor.map(remove, candidates))
+        time.sleep(pause)
+
+
+def _check_full_text_search(conn: sqlite3.Connection, report: FsckReport):
+    res = conn.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE name='RESULTS_FTS')")
+    if not res.fetchone()[0]:
+        return
+    try:
+        conn.execute("INSERT INTO RESULTS_FTS(RESULTS_FTS) VALUES('integrity-check')")
+    except sqlite3.DatabaseError as exc:
+        log.warning("The full text search index is inconsistent: %s", exc)
+        report.rebuilt_index = True
+        if report.repaired:
+            with conn:
+                conn.execute("INSERT INTO RESULTS_FTS(RESULTS_FTS) VALUES('rebuild')")
+    finally:
+        conn.rollback()
+
+
+def check_store(  # pylint: disable=too-many-arguments
+    store: Store,
+    repair: bool = True,
+    verify: bool = False,
+    grace: float = GRACE,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = WORKERS,
+    pause: float = 0.0,
+) -> FsckReport:
+    """Checks the integrity of the store and repairs it. See the module docstring
+
+    Args:
+        store: The store to check. It may be used by live sessions during the check
+        repair: If False the inconsistencies are only reported
+        verify: If True the assets are loaded to check that they are not corrupt. Slower
+        grace: The seconds after which an unreferenced file is considered left behind
+        chunk_size: The number of rows and files processed at once
+        workers: The number of files checked in parallel
+        pause: The seconds to pause between the chunks. Leaves the disk to the live sessions
+    """
+    report = FsckReport(repaired=repair)
+    conn = _connect(store)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            _check_rows(store, conn, executor, report, chunk_size, verify, pause)
+            # After dropping rows, so their assets are removed
+            _check_files(store, conn, executor, report, chunk_size, grace, pause)
+        _check_full_text_search(conn, report)
+    finally:
+        conn.close()
+    log.info("Checked the store %s: %s", store.path, report)
+    return report
+
+
+def main():
+    """Runs the check from the command line"""
+    parser = argparse.ArgumentParser(description="Check the integrity of a Store and repair it")
+    parser.add_argument("store")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the inconsistencies")
+    parser.add_argument("--verify", action="store_true", help="Load the assets to verify them")
+    parser.add_argument("--grace", type=float, default=GRACE)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--pause", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = check_store(
+        Store(path=args.store),
+        repair=not args.dry_run,
+        verify=args.verify,
+        grace=args.grace,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        pause=args.pause,
+    )
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
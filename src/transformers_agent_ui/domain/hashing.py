@@ -0,0 +1,109 @@
+"""Provides content hashes of the values passed to the agent and its tools
+
+Large values like images and arrays are hashed via the digest of their content. Within
+`share_hashes` the digests of the given values are computed once and reused. For example when
+the same arguments are passed to the runs of several models.
+"""
+from __future__ import annotations
+
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pickle import dumps
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+from PIL.Image import Image as PIL_Image
+from torch import Tensor
+
+# The digests of the shared values by their id. The values are kept so their ids are not reused
+_shared_digests: ContextVar[Dict[int, Tuple[Any, bytes]] | None] = ContextVar(
+    "shared_digests", default=None
+)
+
+
+def _compute_content_digest(value: Any) -> bytes:
+    if isinstance(value, PIL_Image):
+        return hashlib.sha256(value.tobytes()).digest()
+    return hashlib.sha256(np.ascontiguousarray(value).tobytes()).digest()
+
+
+def _get_content_digest(value: Any) -> bytes:
+    """Returns the digest of the content of the image or array. Shared if computed by
+    `share_hashes`"""
+    shared = _shared_digests.get()
+    if shared is not None and id(value) in shared:
+        return shared[id(value)][1]
+    return _compute_content_digest(value)
+
+
+def _update(hasher, value: Any):
+    """Updates the hasher with the type and content of the value"""
+    if isinstance(value, PIL_Image):
+        # The subclass depends on the file the image was loaded from
+        hasher.update(f"Image{value.mode}{value.size}".encode())
+        hasher.update(_get_content_digest(value))
+        return
+    hasher.update(type(value).__qualname__.encode())
+    if isinstance(value, str):
+        hasher.update(value.encode())
+    elif isinstance(value, bytes):
+        hasher.update(value)
+    elif value is None or isinstance(value, (bool, int, float, complex)):
+        hasher.update(repr(value).encode())
+    elif isinstance(value, Tensor):
+        _update(hasher, value.detach().cpu().numpy())
+    elif isinstance(value, np.ndarray):
+        hasher.update(f"{value.dtype}{value.shape}".encode())
+        hasher.update(_get_content_digest(value))
+    elif isinstance(value, (list, tuple)):
+        hasher.update(str(len(value)).encode())
+        for item in value:
+            _update(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(str(len(value)).encode())
+        for key in sorted(value, key=str):
+            _update(hasher, key)
+            _update(hasher, value[key])
+    else:
+        hasher.update(dumps(value))
+
+
+def get_hash(value: Any) -> str:
+    """Returns a hash of the content of the value
+
+    Images, arrays and tensors are hashed by their content, so that equal values loaded from
+    different files have the same hash.
+    """
+    hasher = hashlib.sha256()
+    _update(hasher, value)
+    return hasher.hexdigest()
+
+
+def _iter_large_values(value: Any) -> Iterator[Any]:
+    if isinstance(value, (PIL_Image, np.ndarray)):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _iter_large_values(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_large_values(item)
+
+
+@contextmanager
+def share_hashes(*values: Any) -> Iterator[None]:
+    """Computes the digests of the images and arrays of the values once and reuses them while
+    hashing in the current context
+
+    The values must not be modified within the block.
+    """
+    shared: Dict[int, Tuple[Any, bytes]] = dict(_shared_digests.get() or {})
+    token = _shared_digests.set(shared)
+    try:
+        for value in _iter_large_values(values):
+            if id(value) not in shared:
+                shared[id(value)] = (value, _compute_content_digest(value))
+        yield
+    finally:
+        _shared_digests.reset(token)
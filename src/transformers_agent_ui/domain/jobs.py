@@ -0,0 +1,540 @@
+"""Provides the JobQueue running tasks in the background, for example for the REST API
+
+The jobs are persisted in the SQLite DB of the Store. So their status survives reloads of the page
+and restarts of the server. A pool of workers runs the pending jobs, interactive jobs ahead of batch
+jobs, up to a maximum concurrency. New jobs are rejected via a QueueFullError once too many are
+pending, so the server sheds load instead of queueing work it cannot do in time.
+
+A running job holds a lease that its process renews. The jobs of a crashed process are run again
+once their lease has expired. The processes sharing the DB share the queue.
+
+A pending job can be cancelled by any process sharing the queue, a running job only by its
+process. It stops at the next cancellation point of its run.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import pickle  # nosec
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.logs import SessionLogHandler
+from transformers_agent_ui.domain.store import DB_NAME, BaseStore
+from transformers_agent_ui.domain.store_factory import DEFAULT_STORE, get_default_store
+from transformers_agent_ui.domain.token import TOKEN_PARAMETERS, TokenManager
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+# Jobs with a lower priority are run first
+PRIORITIES = {"interactive": 0, "batch": 10}
+INTERACTIVE = PRIORITIES["interactive"]
+BATCH = PRIORITIES["batch"]
+
+MAX_CONCURRENCY_ENV_VALUE = "TRANSFORMERS_AGENT_UI_JOB_CONCURRENCY"
+MAX_PENDING_ENV_VALUE = "TRANSFORMERS_AGENT_UI_MAX_PENDING_JOBS"
+MAX_CONCURRENCY = 4
+MAX_PENDING = 100
+# The maximum number of finished jobs kept. The oldest are forgotten first
+MAX_JOBS = 1000
+# The seconds a running job is owned by its process without renewing its lease
+LEASE = 30.0
+
+QUERY_CREATE_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS JOBS (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    created REAL NOT NULL,
+    status TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    model TEXT NOT NULL,
+    task TEXT NOT NULL,
+    kwargs BLOB NOT NULL,
+    use_cache INTEGER NOT NULL,
+    similarity_threshold REAL,
+    started REAL,
+    finished REAL,
+    lease REAL,
+    prompt TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    code TEXT NOT NULL,
+    model_used TEXT NOT NULL,
+    match_score REAL,
+    matched_task TEXT NOT NULL,
+    error TEXT NOT NULL,
+    asset TEXT NOT NULL
+)
+"""
+QUERY_CREATE_JOBS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS JOBS_STATUS_PRIORITY ON JOBS(status, priority, created)"
+)
+# The columns persisted in the order of the JOBS table. The `kwargs` are pickled
+JOB_COLUMNS = [
+    "id",
+    "priority",
+    "created",
+    "status",
+    "agent",
+    "model",
+    "task",
+    "kwargs",
+    "use_cache",
+    "similarity_threshold",
+    "started",
+    "finished",
+    "lease",
+    "prompt",
+    "explanation",
+    "code",
+    "model_used",
+    "match_score",
+    "matched_task",
+    "error",
+    "asset",
+]
+RESULT_COLUMNS = [
+    "status",
+    "started",
+    "finished",
+    "prompt",
+    "explanation",
+    "code",
+    "model_used",
+    "match_score",
+    "matched_task",
+    "error",
+    "asset",
+]
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the maximum number of jobs are pending"""
+
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """A run of a task in the background
+
+    Args:
+        agent: The name of the agent
+        model: The name of the model
+        task: The task to run
+        kwargs: The arguments of the task
+        use_cache: If True the run may be read from the cache
+        similarity_threshold: If provided the run of a similar task may be read from the cache
+        priority: Jobs with a lower priority are run first. See PRIORITIES
+        token: The token of the agent. Defaults to the token provided to the process. It is not
+            persisted
+        log_handler: If provided the logs of the run are also kept by this handler
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        agent: str,
+        model: str,
+        task: str,
+        kwargs: Dict | None = None,
+        use_cache: bool = True,
+        similarity_threshold: float | None = None,
+        priority: int = BATCH,
+        token: str = "",
+        log_handler: SessionLogHandler | None = None,
+    ):
+        self.id = uuid4().hex  # pylint: disable=invalid-name
+        self.priority = priority
+        self.created = time.time()
+        self.agent = agent
+        self.model = model
+        self.task = task
+        self.kwargs = kwargs or {}
+        self.use_cache = use_cache
+        self.similarity_threshold = similarity_threshold
+        self._token = token
+        self._log_handler = log_handler
+
+        self.status = PENDING
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.lease: Optional[float] = None
+        self.prompt = ""
+        self.explanation = ""
+        self.code = ""
+        self.model_used = ""
+        self.match_score: Optional[float] = None
+        self.matched_task = ""
+        self.error = ""
+        self.value: Any = None
+        self.asset = ""
+
+        self._lock = threading.Lock()
+        self._watchers: List[Callable[[Job], None]] = []
+        self._agent: Optional[TransformersAgent] = None
+        self._cancelled = False
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> Job:
+        """Returns the job persisted as the row of the JOBS table"""
+        job = cls(agent=row["agent"], model=row["model"], task=row["task"])
+        for column in JOB_COLUMNS:
+            setattr(job, column, row[column])
+        job.kwargs = pickle.loads(row["kwargs"])  # nosec
+        job.use_cache = bool(row["use_cache"])
+        return job
+
+    def to_row(self) -> List:
+        """Returns the values of the row of the JOBS table"""
+        with self._lock:
+            row = [getattr(self, column) for column in JOB_COLUMNS]
+        row[JOB_COLUMNS.index("kwargs")] = pickle.dumps(self.kwargs)
+        return row
+
+    @property
+    def is_finished(self) -> bool:
+        """True if the job is done, failed or was cancelled"""
+        return self.status in FINISHED
+
+    def watch(self, callback: Callable[[Job], None]):
+        """Calls the callback with the job every time its status changes. The callback is called
+        from the thread running the job"""
+        with self._lock:
+            self._watchers.append(callback)
+
+    def unwatch(self, callback: Callable[[Job], None]):
+        """Stops calling the callback"""
+        with self._lock:
+            if callback in self._watchers:
+                self._watchers.remove(callback)
+
+    def update(self, **fields):
+        """Sets the fields and notifies the watchers"""
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            watchers = list(self._watchers)
+        for watcher in watchers:
+            watcher(self)
+
+    def _get_token_manager(self) -> TokenManager:
+        token_manager = TokenManager()
+        if self._token and self.agent in TOKEN_PARAMETERS:
+            setattr(token_manager, TOKEN_PARAMETERS[self.agent], self._token)
+        return token_manager
+
+    def cancel(self):
+        """Cancels the run of the job. It stops at its next cancellation point"""
+        with self._lock:
+            self._cancelled = True
+            agent = self._agent
+        if agent is not None:
+            agent.cancel_run()
+
+    def run(self, store: BaseStore):
+        """Runs the task and sets the result"""
+        if self.status != RUNNING:
+            self.update(status=RUNNING, started=time.time())
+        agent = TransformersAgent(
+            agent=self.agent,
+            model=self.model,
+            task=self.task,
+            kwargs=self.kwargs,
+            cache=store,
+            use_cache=self.use_cache,
+            similarity_threshold=self.similarity_threshold,
+            token_manager=self._get_token_manager(),
+            log_handler=self._log_handler,
+        )
+        with self._lock:
+            self._agent = agent
+            if self._cancelled:
+                # Cancelled before the run started
+                agent.cancel_run()
+        try:
+            agent.run()
+            asset = agent.asset
+            if not agent.error and agent.match_score is not None:
+                # Read from the cache. So the value was written by an earlier run
+                asset = store.get_asset(self.agent, self.model, agent.matched_task)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self.update(status=FAILED, finished=time.time(), error=f"The run failed: {exc}")
+            return
+        finally:
+            with self._lock:
+                self._agent = None
+        status = DONE
+        if agent.error:
+            status = CANCELLED if self._cancelled else FAILED
+        self.update(
+            status=status,
+            finished=time.time(),
+            prompt=agent.prompt,
+            explanation=agent.explanation,
+            code=agent.code,
+            model_used=agent.model_used,
+            match_score=agent.match_score,
+            matched_task=agent.matched_task,
+            error=agent.error,
+            value=None if agent.error else agent.value,
+            asset=asset,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the status and result of the job. The value is only included if it is text.
+        Other values are available via the `asset`"""
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "priority": self.priority,
+                "agent": self.agent,
+                "model": self.model,
+                "task": self.task,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "explanation": self.explanation,
+                "code": self.code,
+                "model_used": self.model_used,
+                "match_score": self.match_score,
+                "error": self.error,
+                "value": self.value if isinstance(self.value, str) else None,
+                "asset": self.asset,
+            }
+
+
+class JobQueue:  # pylint: disable=too-many-instance-attributes
+    """A persistent queue of jobs run by a pool of workers
+
+    Args:
+        store: The store used as cache by the jobs. Defaults to the store shared by the sessions
+        db_path: The SQLite DB persisting the jobs. Defaults to the DB of the store if local
+        max_concurrency: The number of workers, i.e. the maximum number of jobs run at once
+        max_pending: The maximum number of pending jobs. More jobs are rejected
+        max_jobs: The maximum number of finished jobs kept
+        lease: The seconds a running job is owned by its process without renewing its lease
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        store: BaseStore | None = None,
+        db_path: str | Path | None = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_pending: int = MAX_PENDING,
+        max_jobs: int = MAX_JOBS,
+        lease: float = LEASE,
+    ):
+        self.store = store or get_default_store()
+        if db_path is None:
+            asset_path = self.store.asset_path
+            db_path = (asset_path.parent if asset_path else Path(DEFAULT_STORE)) / DB_NAME
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.lease = lease
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(QUERY_CREATE_JOBS_TABLE)
+            self._conn.execute(QUERY_CREATE_JOBS_INDEX)
+        self._lock = threading.RLock()
+        # The jobs of this process by id. Keeps their tokens, values and watchers
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._running: Dict[str, Job] = {}
+        self._wake_up = threading.Condition()
+        self._stopped = threading.Event()
+        self._workers: List[threading.Thread] = []
+
+    def start(self) -> JobQueue:
+        """Starts the workers and the renewal of the leases. Returns the queue"""
+        with self._lock:
+            if self._workers:
+                return self
+            self._stopped.clear()
+            for index in range(self.max_concurrency):
+                self._workers.append(
+                    threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                )
+            self._workers.append(
+                threading.Thread(target=self._renew_leases, name="job-leases", daemon=True)
+            )
+            for worker in self._workers:
+                worker.start()
+        return self
+
+    def stop(self, timeout: float | None = None):
+        """Stops the workers once their current jobs are finished"""
+        self._stopped.set()
+        with self._wake_up:
+            self._wake_up.notify_all()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join(timeout)
+
+    def count_pending(self) -> int:
+        """Returns the number of pending jobs"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM JOBS WHERE status=?", [PENDING]
+            ).fetchone()[0]
+
+    def submit(self, job: Job) -> Job:
+        """Queues the job and returns it. Raises a QueueFullError if too many jobs are pending"""
+        with self._lock:
+            if self.count_pending() >= self.max_pending:
+                raise QueueFullError(f"{self.max_pending} jobs are pending. Try again later")
+            with self._conn:
+                self._conn.execute(
+                    f"INSERT INTO JOBS VALUES({', '.join('?' * len(JOB_COLUMNS))})", job.to_row()
+                )
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+        with self._wake_up:
+            self._wake_up.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns the job or None if not found. Also the jobs of other or earlier processes"""
+        with self._lock:
+            if job_id in self._jobs:
+                return self._jobs[job_id]
+            row = self._conn.execute("SELECT * FROM JOBS WHERE id=?", [job_id]).fetchone()
+        return Job.from_row(dict(row)) if row else None
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancels the job and returns it or None if not found
+
+        A pending job is cancelled right away. A running job of this process stops at its next
+        cancellation point. The running jobs of other processes are not cancelled"""
+        with self._lock:
+            with self._conn:
+                cancelled = self._conn.execute(
+                    "UPDATE JOBS SET status=?, finished=?, error=? WHERE id=? AND status=?",
+                    [CANCELLED, time.time(), "The job was cancelled", job_id, PENDING],
+                ).rowcount
+            running = self._running.get(job_id)
+        if running is not None:
+            running.cancel()
+            return running
+        job = self.get(job_id)
+        if cancelled and job is not None and not job.is_finished:
+            # The job submitted by this process is still in memory
+            job.update(status=CANCELLED, finished=time.time(), error="The job was cancelled")
+        return job
+
+    def read_value(self, job: Job):
+        """Returns the value of the finished job. Reads it from the store if not in memory"""
+        if job.value is None and job.asset:
+            return self.store.read_asset(job.asset)
+        return job.value
+
+    def _claim(self) -> Optional[Job]:
+        """Returns the next pending job, or the job of an expired lease, marked as running"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT * FROM JOBS WHERE status=? OR (status=? AND lease<?) \
+                    ORDER BY priority, created LIMIT 1""",
+                [PENDING, RUNNING, now],
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                # Another process sharing the DB may have claimed the job in the meantime
+                claimed = self._conn.execute(
+                    "UPDATE JOBS SET status=?, started=?, lease=? WHERE id=? AND status=? AND \
+                        IFNULL(lease, 0)=IFNULL(?, 0)",
+                    [RUNNING, now, now + self.lease, row["id"], row["status"], row["lease"]],
+                ).rowcount
+            if not claimed:
+                return self._claim()
+            job = self._jobs.get(row["id"]) or Job.from_row(dict(row))
+            self._running[job.id] = job
+        if row["status"] == RUNNING:
+            log.warning("Resuming the job '%s' of an expired lease", job.id)
+        job.update(status=RUNNING, started=now, lease=now + self.lease)
+        return job
+
+    def _save(self, job: Job):
+        with self._lock:
+            values = job.to_row()
+            with self._conn:
+                self._conn.execute(
+                    f"UPDATE JOBS SET {', '.join(column + '=?' for column in RESULT_COLUMNS)} \
+                        WHERE id=?",  # nosec
+                    [values[JOB_COLUMNS.index(column)] for column in RESULT_COLUMNS] + [job.id],
+                )
+            self._running.pop(job.id, None)
+            self._forget_finished_jobs()
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished]
+        for job_id in finished[: max(len(finished) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
+        statuses = ", ".join("?" * len(FINISHED))
+        with self._conn:
+            self._conn.execute(
+                f"""DELETE FROM JOBS WHERE status IN ({statuses}) AND id NOT IN (SELECT id FROM \
+                    JOBS WHERE status IN ({statuses}) ORDER BY finished DESC LIMIT ?)""",  # nosec
+                [*FINISHED, *FINISHED, self.max_jobs],
+            )
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                # For example if the DB is locked by another process for too long
+                log.exception("Failed to claim a job")
+                job = None
+            if job is None:
+                with self._wake_up:
+                    self._wake_up.wait(self.lease / 3)
+                continue
+            try:
+                job.run(self.store)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                log.exception("The job '%s' failed", job.id)
+                job.update(status=FAILED, finished=time.time(), error=f"The job failed: {exc}")
+            self._save(job)
+            with self._wake_up:
+                self._wake_up.notify()
+
+    def _renew_leases(self):
+        while not self._stopped.wait(self.lease / 3):
+            with self._lock:
+                running = list(self._running)
+                if not running:
+                    continue
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE JOBS SET lease=? WHERE id=? AND status=?",
+                        [(time.time() + self.lease, job_id, RUNNING) for job_id in running],
+                    )
+
+
+@cache
+def get_job_queue() -> JobQueue:
+    """Returns the started JobQueue shared by the process
+
+    The maximum concurrency and number of pending jobs can be set via the
+    `TRANSFORMERS_AGENT_UI_JOB_CONCURRENCY` and `TRANSFORMERS_AGENT_UI_MAX_PENDING_JOBS` environment
+    variables.
+    """
+    return JobQueue(
+        max_concurrency=int(os.getenv(MAX_CONCURRENCY_ENV_VALUE, "") or MAX_CONCURRENCY),
+        max_pending=int(os.getenv(MAX_PENDING_ENV_VALUE, "") or MAX_PENDING),
+    ).start()
@@ -0,0 +1,231 @@
+"""The LocalToolPool shares the local tools used by `remote=False` runs across agents
+
+Loading a local tool means loading a transformers pipeline, which takes many seconds. The agents
+are not reused, so the tools they load are not either. The LocalToolPool loads each tool once per
+process, optionally at startup, and keeps the tools within a memory budget by unloading the least
+recently used ones.
+
+The tools are loaded for the CPU: the weights are loaded lazily (`low_cpu_mem_usage`), the number
+of torch threads can be set and the linear layers can be dynamically quantized to int8.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import cache
+from typing import Any, Callable, Dict, List, Sequence
+
+from transformers.tools import Tool, load_tool
+from transformers.tools.agents import BASE_PYTHON_TOOLS
+from transformers.tools.base import TASK_MAPPING
+
+from transformers_agent_ui.domain.config import LOCAL_TOOLS_CONFIGURATION
+from transformers_agent_ui.domain.executor import get_executor
+
+log = logging.getLogger(__name__)
+
+PRELOAD_ENV_VALUE = "TRANSFORMERS_AGENT_UI_PRELOAD_TOOLS"
+NUM_THREADS_ENV_VALUE = "TRANSFORMERS_AGENT_UI_NUM_THREADS"
+QUANTIZE_ENV_VALUE = "TRANSFORMERS_AGENT_UI_QUANTIZE_TOOLS"
+MAX_MEMORY_ENV_VALUE = "TRANSFORMERS_AGENT_UI_TOOLS_MAX_MEMORY"
+
+
+def get_memory_size(tool) -> int:
+    """Returns the number of bytes of the weights and buffers of the model of the tool"""
+    model = getattr(tool, "model", None)
+    if model is None or not hasattr(model, "parameters"):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def quantize_tool(tool):
+    """Replaces the linear layers of the model of the tool by dynamically quantized int8 layers.
+    Only the models on the CPU are quantized"""
+    import torch  # pylint: disable=import-outside-toplevel
+
+    model = getattr(tool, "model", None)
+    # The PipelineTools set their device to a torch.device. Tools without a device run on the CPU
+    device = getattr(tool, "device", None)
+    is_on_cpu = device is None or torch.device(device).type == "cpu"
+    if isinstance(model, torch.nn.Module) and is_on_cpu:
+        with warnings.catch_warnings():
+            # Newer versions of torch warn that eager mode quantization is deprecated in favor of
+            # torchao
+            warnings.simplefilter("ignore")
+            tool.model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+
+class LocalToolPool:
+    """Loads local tools once and keeps them within a memory budget
+
+    Args:
+        max_memory: The memory in bytes the weights of the loaded tools may use. The least
+            recently used tools are unloaded to stay within the budget. None for no limit.
+        num_threads: If provided the number of threads torch uses for the tools
+        quantize: If True the linear layers of the models are dynamically quantized to int8
+        load: Loads a tool from a task or repo id. Defaults to `transformers.load_tool`.
+    """
+
+    def __init__(
+        self,
+        max_memory: int | None = None,
+        num_threads: int | None = None,
+        quantize: bool = False,
+        load: Callable[..., Any] = load_tool,
+    ):
+        self.max_memory = max_memory
+        self.num_threads = num_threads
+        self.quantize = quantize
+        self._load = load
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._tools: OrderedDict[str, Any] = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        if num_threads:
+            import torch  # pylint: disable=import-outside-toplevel
+
+            torch.set_num_threads(num_threads)
+
+    @property
+    def loaded(self) -> List[str]:
+        """The tasks or repo ids of the loaded tools, least recently used first"""
+        with self._lock:
+            return list(self._tools)
+
+    @property
+    def memory(self) -> int:
+        """The bytes used by the weights of the loaded tools"""
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _get_loaded(self, task_or_repo_id: str):
+        with self._lock:
+            tool = self._tools.get(task_or_repo_id)
+            if tool is not None:
+                self._tools.move_to_end(task_or_repo_id)
+            return tool
+
+    def get(self, task_or_repo_id: str):
+        """Returns the tool, loading it if it is not loaded"""
+        tool = self._get_loaded(task_or_repo_id)
+        if tool is not None:
+            return tool
+        with self._lock:
+            loading = self._loading.setdefault(task_or_repo_id, threading.Lock())
+        # Concurrent calls wait for the first one to load the tool
+        with loading:
+            tool = self._get_loaded(task_or_repo_id)
+            if tool is None:
+                tool = self._load_tool(task_or_repo_id)
+        return tool
+
+    def _load_tool(self, task_or_repo_id: str):
+        start = time.perf_counter()
+        kwargs = {}
+        if task_or_repo_id in TASK_MAPPING:
+            # The tools of the transformers library are PipelineTools accepting model_kwargs
+            kwargs["model_kwargs"] = {"low_cpu_mem_usage": True}
+        tool = self._load(task_or_repo_id, **kwargs)
+        if hasattr(tool, "setup") and not getattr(tool, "is_initialized", True):
+            tool.setup()
+        # Measured before quantizing as the quantized weights are not parameters. An upper bound
+        size = get_memory_size(tool)
+        if self.quantize:
+            quantize_tool(tool)
+        with self._lock:
+            self._tools[task_or_repo_id] = tool
+            self._sizes[task_or_repo_id] = size
+            self._unload_least_recently_used()
+        log.info(
+            "Loaded the local tool '%s' (%.0f MB) in %.1fs",
+            task_or_repo_id,
+            size / 1024**2,
+            time.perf_counter() - start,
+        )
+        return tool
+
+    def _unload_least_recently_used(self):
+        """Unloads tools until within the memory budget. Keeps the most recently used tool"""
+        while (
+            self.max_memory is not None
+            and len(self._tools) > 1
+            and sum(self._sizes.values()) > self.max_memory
+        ):
+            task_or_repo_id, _ = self._tools.popitem(last=False)
+            self._sizes.pop(task_or_repo_id)
+            log.info("Unloaded the local tool '%s'", task_or_repo_id)
+
+    def unload(self, task_or_repo_id: str):
+        """Unloads the tool if loaded"""
+        with self._lock:
+            self._tools.pop(task_or_repo_id, None)
+            self._sizes.pop(task_or_repo_id, None)
+
+    def preload(self, tasks_or_repo_ids: Sequence[str]) -> List[Future]:
+        """Loads the tools in the background. Returns the futures of the tools"""
+        executor = get_executor()
+        return [executor.submit(self.get, task_or_repo_id) for task_or_repo_id in tasks_or_repo_ids]
+
+    def resolve_tools(self, code: str, toolbox: Dict[str, Any]) -> Dict[str, Callable]:
+        """Returns the tools used by the code like `transformers.tools.agents.resolve_tools` but
+        with the local tools shared via the pool"""
+        resolved_tools: Dict[str, Callable] = BASE_PYTHON_TOOLS.copy()
+        for name, tool in toolbox.items():
+            if name not in code:
+                continue
+            if isinstance(tool, Tool):
+                resolved_tools[name] = tool
+            else:
+                task_or_repo_id = tool.task if tool.repo_id is None else tool.repo_id
+                resolved_tools[name] = self.get(task_or_repo_id)
+        return resolved_tools
+
+
+def _get_configuration() -> Dict[str, Any]:
+    """Returns the LOCAL_TOOLS_CONFIGURATION updated from the environment variables"""
+    configuration = dict(LOCAL_TOOLS_CONFIGURATION)
+    if os.getenv(PRELOAD_ENV_VALUE):
+        preload = os.environ[PRELOAD_ENV_VALUE].split(",")
+        configuration["preload"] = [name.strip() for name in preload if name.strip()]
+    if os.getenv(NUM_THREADS_ENV_VALUE):
+        configuration["num_threads"] = int(os.environ[NUM_THREADS_ENV_VALUE])
+    if os.getenv(QUANTIZE_ENV_VALUE):
+        configuration["quantize"] = os.environ[QUANTIZE_ENV_VALUE].lower() in ("1", "true", "yes")
+    if os.getenv(MAX_MEMORY_ENV_VALUE):
+        configuration["max_memory"] = int(os.environ[MAX_MEMORY_ENV_VALUE])
+    return configuration
+
+
+@cache
+def get_local_tool_pool() -> LocalToolPool:
+    """Returns the pool of local tools shared by all sessions of the process
+
+    Configured via LOCAL_TOOLS_CONFIGURATION and the `TRANSFORMERS_AGENT_UI_NUM_THREADS`,
+    `TRANSFORMERS_AGENT_UI_QUANTIZE_TOOLS` and `TRANSFORMERS_AGENT_UI_TOOLS_MAX_MEMORY`
+    environment variables.
+    """
+    configuration = _get_configuration()
+    return LocalToolPool(
+        max_memory=configuration["max_memory"],
+        num_threads=configuration["num_threads"],
+        quantize=configuration["quantize"],
+    )
+
+
+@cache
+def preload_local_tools() -> List[Future]:
+    """Loads the local tools configured via LOCAL_TOOLS_CONFIGURATION or the comma separated
+    tasks or repo ids of the `TRANSFORMERS_AGENT_UI_PRELOAD_TOOLS` environment variable in the
+    background. For example `image-captioning,text-to-speech`.
+
+    Loads the tools once per process. So it is safe to call from every session.
+    """
+    return get_local_tool_pool().preload(_get_configuration()["preload"])
@@ -0,0 +1,197 @@
+"""Structured logging of the runs
+
+The modules of the package log via the `logging` module. This module provides
+
+- `SessionLogHandler`: Keeps the log lines of the runs of one session in a bounded ring buffer. The
+UI flushes the new lines in batches to its Logs tab.
+- `capture_logs`: Routes the records logged by the current thread or task to a `SessionLogHandler`.
+- `JsonFormatter`: Formats the records as one JSON object per line for production.
+- `configure_logging`: Configures the output of the logs of the package from the environment.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import cache
+from typing import Any, Iterator, List
+
+LOGGER_NAME = "transformers_agent_ui"
+LOG_FORMAT_ENV_VALUE = "TRANSFORMERS_AGENT_UI_LOG_FORMAT"
+LOG_LEVEL_ENV_VALUE = "TRANSFORMERS_AGENT_UI_LOG_LEVEL"
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+MAX_VALUE_LENGTH = 200
+# The attributes of every LogRecord. The other attributes are extras like `agent` and `task`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_session_handler: ContextVar[SessionLogHandler | None] = ContextVar("session_handler", default=None)
+
+
+class ValueSummary:  # pylint: disable=too-few-public-methods
+    """Summarizes a value lazily when the record is formatted
+
+    Large values like images, arrays and long texts are summarized by their type and shape instead
+    of being converted to a string.
+    """
+
+    def __init__(self, value: Any, max_length: int = MAX_VALUE_LENGTH):
+        self.value = value
+        self.max_length = max_length
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            text = str(value)
+            if len(text) > self.max_length:
+                return text[: self.max_length] + f"... ({len(text)} characters)"
+            return text
+        shape = getattr(value, "shape", None)
+        if shape is not None:
+            return f"<{type(value).__name__} shape={tuple(shape)} dtype={getattr(value, 'dtype')}>"
+        size = getattr(value, "size", None)
+        mode = getattr(value, "mode", None)
+        if size is not None and mode is not None:
+            return f"<{type(value).__name__} mode={mode} size={size}>"
+        return f"<{type(value).__name__}>"
+
+
+class LogBuffer:
+    """A thread safe ring buffer of the last `max_lines` log lines
+
+    Tracks the lines appended since the last `flush` so they can be streamed in batches.
+    """
+
+    def __init__(self, max_lines: int = 1000):
+        self.max_lines = max_lines
+        self._lines: deque = deque(maxlen=max_lines)
+        self._unflushed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def lines(self) -> List[str]:
+        """The lines kept, oldest first"""
+        with self._lock:
+            return list(self._lines)
+
+    def append(self, message: str):
+        """Appends the lines of the message"""
+        lines = message.splitlines() or [""]
+        with self._lock:
+            self._lines.extend(lines)
+            self._unflushed += len(lines)
+
+    def flush(self) -> List[str]:
+        """Returns the lines appended since the last flush. At most `max_lines` lines"""
+        with self._lock:
+            count = min(self._unflushed, len(self._lines))
+            self._unflushed = 0
+            return list(self._lines)[len(self._lines) - count :]
+
+    def clear(self):
+        """Removes all lines"""
+        with self._lock:
+            self._lines.clear()
+            self._unflushed = 0
+
+
+class SessionLogHandler(logging.Handler):
+    """Keeps the formatted records of one session in a bounded LogBuffer"""
+
+    def __init__(self, max_lines: int = 1000, level: int = logging.INFO):
+        super().__init__(level=level)
+        self.buffer = LogBuffer(max_lines=max_lines)
+        self.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handleError(record)
+
+
+class _ContextHandler(logging.Handler):
+    """Forwards the records to the SessionLogHandler of the current context if any"""
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        handler = _session_handler.get()
+        if handler is None:
+            return False
+        return bool(handler.handle(record))
+
+    def emit(self, record: logging.LogRecord):
+        pass
+
+
+@cache
+def _install_context_handler():
+    """Adds the _ContextHandler to the logger of the package once
+
+    The logger of the package logs INFO records unless a level has been configured. Without
+    handlers they are only shown by handlers of the root logger configured to show them.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    logger.addHandler(_ContextHandler())
+
+
+@contextmanager
+def capture_logs(handler: SessionLogHandler | None) -> Iterator[None]:
+    """Routes the records of the package logged in the current thread or task to the handler"""
+    if handler is None:
+        yield
+        return
+    _install_context_handler()
+    token = _session_handler.set(handler)
+    try:
+        yield
+    finally:
+        _session_handler.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a JSON object including its extras. For example
+
+    {"time": "2023-06-01T12:00:00.000000+00:00", "level": "INFO", "logger": "...", "message": "...",
+    "agent": "HuggingFace"}
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+@cache
+def configure_logging() -> logging.Handler:
+    """Writes the logs of the package to stderr. Once per process, the later calls return the
+    same handler
+
+    The format is `text` or `json` as set by the `TRANSFORMERS_AGENT_UI_LOG_FORMAT` environment
+    variable. The level defaults to INFO and can be set via `TRANSFORMERS_AGENT_UI_LOG_LEVEL`.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    if os.getenv(LOG_FORMAT_ENV_VALUE, "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(os.getenv(LOG_LEVEL_ENV_VALUE, "INFO").upper())
+    logger.addHandler(handler)
+    logger.propagate = False
+    return handler
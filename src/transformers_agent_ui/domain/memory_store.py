@@ -0,0 +1,208 @@
+"""The InMemoryStore keeps the runs and tool results in memory
+
+Useful for testing and for short lived processes. Nothing is persisted.
+
+The CachedStore adds an InMemoryStore as a fast layer in front of another store.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from transformers_agent_ui.domain.store import MAX_TOOL_RESULTS, BaseStore, HistoryCursor
+
+# The default number of tasks kept in the memory layer of a CachedStore
+MAX_RUNS = 32
+
+
+class InMemoryStore(BaseStore):
+    """A store for runs implemented using dictionaries
+
+    Args:
+        max_runs: If provided the runs of the least recently used tasks are evicted when there
+            are runs of more than `max_runs` tasks.
+        max_tool_results: The least recently used tool results are evicted when there are more
+            than `max_tool_results`.
+    """
+
+    supports_iter_tasks = True
+
+    def __init__(self, max_runs: int | None = None, max_tool_results: int = MAX_TOOL_RESULTS):
+        super().__init__()
+        self.max_runs = max_runs
+        self.max_tool_results = max_tool_results
+        self._lock = threading.RLock()
+        self._runs: OrderedDict[Tuple[str, str, str], List[Dict]] = OrderedDict()
+        self._tool_results: OrderedDict[str, object] = OrderedDict()
+
+    def write(
+        self,
+        agent: str,
+        model: str,
+        task: str,
+        kwargs: Dict,
+        prompt: str,
+        explanation: str,
+        code: str,
+        value,
+        model_used: str = "",
+    ) -> str:
+        row = {
+            "time": datetime.utcnow(),
+            "prompt": prompt,
+            "explanation": explanation,
+            "code": code,
+            "value": value,
+            "model_used": model_used,
+        }
+        with self._lock:
+            self._runs.setdefault((agent, model, task), []).append(row)
+            self._runs.move_to_end((agent, model, task))
+            while self.max_runs is not None and len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        return ""
+
+    def read(self, agent: str, model: str, task: str, kwargs: Dict) -> Dict:
+        with self._lock:
+            rows = self._runs.get((agent, model, task))
+            if not rows:
+                return {}
+            self._runs.move_to_end((agent, model, task))
+            row = rows[-1]
+        return {key: value for key, value in row.items() if key != "time"}
+
+    def exists(self, agent: str, model: str, task: str, kwargs: Dict) -> bool:
+        with self._lock:
+            return bool(self._runs.get((agent, model, task)))
+
+    def delete(self, agent: str, model: str, task: str):
+        with self._lock:
+            self._runs.pop((agent, model, task), None)
+
+    def iter_tasks(self) -> Iterator[Tuple[str, str, str]]:
+        with self._lock:
+            keys = [key for key, rows in self._runs.items() if rows]
+        yield from keys
+
+    def read_tool_result(self, key: str):
+        with self._lock:
+            value = self._tool_results[key]
+            self._tool_results.move_to_end(key)
+        return value
+
+    def write_tool_result(self, key: str, tool: str, value):
+        with self._lock:
+            self._tool_results[key] = value
+            self._tool_results.move_to_end(key)
+            while len(self._tool_results) > self.max_tool_results:
+                self._tool_results.popitem(last=False)
+
+
+class CachedStore(BaseStore):
+    """A store keeping the recently used runs and tool results of another store in memory
+
+    Args:
+        store: The store to cache
+        max_runs: The maximum number of tasks whose latest run is kept in memory
+        max_tool_results: The maximum number of tool results kept in memory
+    """
+
+    def __init__(
+        self,
+        store: BaseStore,
+        max_runs: int = MAX_RUNS,
+        max_tool_results: int = MAX_TOOL_RESULTS,
+    ):
+        super().__init__()
+        self.store = store
+        self.memory = InMemoryStore(max_runs=max_runs, max_tool_results=max_tool_results)
+
+    def write(
+        self,
+        agent: str,
+        model: str,
+        task: str,
+        kwargs: Dict,
+        prompt: str,
+        explanation: str,
+        code: str,
+        value,
+        model_used: str = "",
+    ) -> str:
+        path = self.store.write(
+            agent, model, task, kwargs, prompt, explanation, code, value, model_used
+        )
+        self.memory.write(agent, model, task, kwargs, prompt, explanation, code, value, model_used)
+        return path
+
+    def read(self, agent: str, model: str, task: str, kwargs: Dict) -> Dict:
+        row = self.memory.read(agent, model, task, kwargs)
+        if row:
+            return row
+        row = self.store.read(agent, model, task, kwargs)
+        if row:
+            self.memory.write(agent, model, task, kwargs, **row)
+        return row
+
+    def exists(self, agent: str, model: str, task: str, kwargs: Dict) -> bool:
+        return self.memory.exists(agent, model, task, kwargs) or self.store.exists(
+            agent, model, task, kwargs
+        )
+
+    def delete(self, agent: str, model: str, task: str):
+        self.memory.delete(agent, model, task)
+        self.store.delete(agent, model, task)
+
+    @property
+    def supports_query_runs(self) -> bool:  # type: ignore[override]
+        """True if the cached store supports `query_runs` and `read_asset`"""
+        return self.store.supports_query_runs
+
+    @property
+    def supports_iter_tasks(self) -> bool:  # type: ignore[override]
+        """True if the cached store supports `iter_tasks`"""
+        return self.store.supports_iter_tasks
+
+    def read_tool_result(self, key: str):
+        try:
+            return self.memory.read_tool_result(key)
+        except KeyError:
+            pass
+        value = self.store.read_tool_result(key)
+        self.memory.write_tool_result(key, tool="", value=value)
+        return value
+
+    def write_tool_result(self, key: str, tool: str, value):
+        self.store.write_tool_result(key, tool, value)
+        self.memory.write_tool_result(key, tool, value)
+
+    def query_runs(  # pylint: disable=too-many-arguments
+        self,
+        agent: str = "",
+        model: str = "",
+        start: str = "",
+        end: str = "",
+        search: str = "",
+        after: HistoryCursor | None = None,
+        limit: int = 20,
+    ) -> Tuple[List[Dict], Optional[HistoryCursor]]:
+        return self.store.query_runs(agent, model, start, end, search, after, limit)
+
+    def read_asset(self, path: str):
+        return self.store.read_asset(path)
+
+    def get_asset(self, agent: str, model: str, task: str) -> str:
+        return self.store.get_asset(agent, model, task)
+
+    def iter_tasks(self) -> Iterator[Tuple[str, str, str]]:
+        return self.store.iter_tasks()
+
+    @property
+    def asset_path(self) -> Optional[Path]:
+        return self.store.asset_path
+
+    def single_flight(self, agent: str, model: str, task: str) -> ContextManager:
+        return self.store.single_flight(agent, model, task)
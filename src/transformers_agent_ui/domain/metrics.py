@@ -0,0 +1,308 @@
+"""Metrics of the runs, the agents, the tools and the Store in the Prometheus text format
+
+The metrics are collected per process in the REGISTRY and rendered via `REGISTRY.render()`. See
+`transformers_agent_ui.ui.metrics` for the endpoint serving them.
+
+- `transformers_agent_ui_runs_total`: The runs by agent, model and outcome. The outcome is one of
+`cache_hit`, `run`, `error`, `no_token`, `no_result`, `cancelled` or `timeout`.
+- `transformers_agent_ui_run_seconds`: The duration of the runs by agent, model and source.
+- `transformers_agent_ui_llm_seconds`: The duration of the generations by agent and model.
+- `transformers_agent_ui_rate_limited_total`: The 429 responses by endpoint.
+- `transformers_agent_ui_tool_seconds`: The duration of the tool calls by agent, model and tool.
+- `transformers_agent_ui_tool_cache_hits_total`: The tool calls served from the cache by agent,
+model and tool.
+- `transformers_agent_ui_store_seconds`: The duration of the Store operations by agent, model and
+operation. The agent and model are "" for operations not done by a run.
+- `transformers_agent_ui_sessions`: The open sessions of the UI.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from transformers.tools.agents import BASE_PYTHON_TOOLS
+
+PREFIX = "transformers_agent_ui_"
+# Seconds. From a cache read to a slow, local image generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    text = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + text + "}"
+
+
+class _Metric:  # pylint: disable=too-few-public-methods
+    """A metric with a value per combination of the values of its labels"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"The metric {self.name} requires the labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _get_samples(self) -> List[Tuple[str, Sequence[Tuple[str, str]], float]]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        """Returns the metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self._get_samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """A value that only increases. For example the number of runs"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Increases the value of the labels by the amount"""
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        """Returns the value of the labels"""
+        key = self._get_key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def _get_samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [
+            (self.name, list(zip(self.labelnames, key)), value) for key, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    """A value that can go up and down. For example the number of runs in the Store"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        """Sets the value of the labels"""
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Counts the observations, for example durations in seconds, in cumulative buckets"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # The counts per bucket, the sum and the count of the observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        """Adds the observation"""
+        key = self._get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observes the duration in seconds of the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        """Returns the number of observations of the labels"""
+        key = self._get_key(labels)
+        with self._lock:
+            return self._values[key][2] if key in self._values else 0
+
+    def _get_samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            }
+        samples = []
+        for key, (counts, total, count) in values.items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(
+                    (self.name + "_bucket", labels + [("le", _format_value(bucket))], cumulative)
+                )
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """The metrics of the process"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Returns the registered Counter. Creates it the first time"""
+        return self._register(Counter(name, documentation, labelnames))  # type: ignore
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Returns the registered Gauge. Creates it the first time"""
+        return self._register(Gauge(name, documentation, labelnames))  # type: ignore
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Returns the registered Histogram. Creates it the first time"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))  # type: ignore
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = MetricsRegistry()
+
+RUNS = REGISTRY.counter(
+    "runs_total", "The runs by agent, model and outcome", ["agent", "model", "outcome"]
+)
+RUN_SECONDS = REGISTRY.histogram(
+    "run_seconds",
+    "The duration of the runs. The source is cache or agent",
+    ["agent", "model", "source"],
+)
+RUN_ERRORS = REGISTRY.counter(
+    "run_errors_total", "The failed runs by agent, model and error", ["agent", "model", "error"]
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "llm_seconds", "The duration of the generations of the code", ["agent", "model"]
+)
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limited_total", "The rate-limited (429) requests by endpoint", ["endpoint"]
+)
+TOOL_SECONDS = REGISTRY.histogram(
+    "tool_seconds", "The duration of the tool calls", ["agent", "model", "tool"]
+)
+TOOL_CACHE_HITS = REGISTRY.counter(
+    "tool_cache_hits_total", "The tool calls served from the cache", ["agent", "model", "tool"]
+)
+STORE_SECONDS = REGISTRY.histogram(
+    "store_seconds",
+    "The duration of the Store operations",
+    ["agent", "model", "operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+STORE_RUNS = REGISTRY.gauge("store_runs", "The runs in the Store", ["path"])
+STORE_WRITTEN_BYTES = REGISTRY.counter(
+    "store_written_bytes_total", "The bytes of the assets written to the Store", ["path"]
+)
+
+SESSIONS = REGISTRY.gauge("sessions", "The open sessions of the UI")
+
+
+class ToolWrapper:
+    """The base of the wrappers of the tools of the agent. Their metrics are labelled by the agent
+    and model of the run
+
+    Args:
+        name: The name of the tool
+        tool: The tool
+        metric_labels: The `agent` and `model` labels of the metrics. Default to ""
+    """
+
+    def __init__(self, name: str, tool: Callable, metric_labels: Dict[str, str] | None = None):
+        self.name = name
+        self.tool = tool
+        self.metric_labels = metric_labels or {"agent": "", "model": ""}
+
+    def __call__(self, *args, **kwargs):
+        return self.tool(*args, **kwargs)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name})"
+
+    @classmethod
+    def wrap_tools(
+        cls, tools: Dict[str, Callable], metric_labels: Dict[str, str] | None = None, **kwargs
+    ) -> Dict[str, Callable]:
+        """Returns a copy of the tools where the tools of the agent are wrapped
+
+        The basic python tools like `print` are not wrapped. The kwargs are passed to the wrappers.
+        """
+        return {
+            name: (
+                tool
+                if name in BASE_PYTHON_TOOLS
+                else cls(name=name, tool=tool, metric_labels=metric_labels, **kwargs)
+            )
+            for name, tool in tools.items()
+        }
+
+
+class TimedTool(ToolWrapper):
+    """A wrapper of a tool observing the duration of its calls"""
+
+    def __call__(self, *args, **kwargs):
+        with TOOL_SECONDS.time(tool=self.name, **self.metric_labels):
+            return self.tool(*args, **kwargs)
+
+
+def time_tools(
+    tools: Dict[str, Callable], metric_labels: Dict[str, str] | None = None
+) -> Dict[str, Callable]:
+    """Returns a copy of the tools where the tools of the agent are wrapped in a TimedTool
+
+    The basic python tools like `print` are not wrapped.
+    """
+    return TimedTool.wrap_tools(tools, metric_labels)
@@ -0,0 +1,183 @@
+"""The PromptBuilder formats smaller prompts by only describing the tools relevant to the task
+
+The run prompt of an agent describes all the tools of its toolbox and gives examples of their use.
+So every generation sends thousands of tokens. The PromptBuilder scores the tools by the keywords
+their name and description share with the task and only keeps the best tools and the examples
+using them. Everything is computed locally.
+
+The code generated is still resolved via the full toolbox. So a tool missing in the prompt can
+still be used.
+
+The formatted part of the prompt before and after the task is cached per template and selection of
+tools.
+"""
+from __future__ import annotations
+
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+from transformers_agent_ui.domain.similarity import normalize_task
+
+TOOLS_PLACEHOLDER = "<<all_tools>>"
+TASK_PLACEHOLDER = "<<prompt>>"
+# The number of characters of the stem of a word. So that "translate" and "translator" match
+STEM_LENGTH = 6
+# Words of the tasks and descriptions not telling the tools apart
+STOP_WORDS = frozenset(
+    "a an and are as be by for from in into is it its named of on or out should that the this "
+    "to tool using what where which while with".split()
+)
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_EXAMPLE = re.compile(r"^Task: ", flags=re.MULTILINE)
+_CODE = re.compile(r"```(?:py|python)?\n(.*?)```", flags=re.DOTALL)
+# The descriptions of tools are keyed by their name and description
+ToolsKey = Tuple[Tuple[str, str], ...]
+
+
+def count_tokens(text: str) -> int:
+    """Returns the approximate number of tokens of the text. Its words and punctuation"""
+    return len(_TOKEN.findall(text))
+
+
+@lru_cache(maxsize=1024)
+def get_stems(text: str) -> FrozenSet[str]:
+    """Returns the stems of the words of the text. The words of names like `text_reader` too"""
+    words = normalize_task(text.replace("_", " ")).split()
+    return frozenset(word[:STEM_LENGTH] for word in words if word not in STOP_WORDS)
+
+
+@lru_cache(maxsize=64)
+def _get_tool_weights(tools: ToolsKey) -> Tuple[Dict[str, FrozenSet[str]], Dict[str, float]]:
+    """Returns the stems of each tool and the weight of each stem. Stems shared by many tools,
+    like `text`, weigh less"""
+    stems = {name: get_stems(name) | get_stems(description) for name, description in tools}
+    counts: Dict[str, int] = {}
+    for tool_stems in stems.values():
+        for stem in tool_stems:
+            counts[stem] = counts.get(stem, 0) + 1
+    weights = {stem: math.log(1 + len(tools) / count) for stem, count in counts.items()}
+    return stems, weights
+
+
+@lru_cache(maxsize=16)
+def _split_template(template: str) -> Tuple[str, List[str], str] | None:
+    """Returns the introduction with the tools, the examples and the end with the task of the
+    template. None if the template has no placeholders for the tools and the task"""
+    if TOOLS_PLACEHOLDER not in template or TASK_PLACEHOLDER not in template:
+        return None
+    introduction, rest = template.split(TOOLS_PLACEHOLDER, 1)
+    separator, *examples = _EXAMPLE.split(rest)
+    if not examples or TASK_PLACEHOLDER not in examples[-1]:
+        return None
+    examples = ["Task: " + example for example in examples]
+    return introduction + TOOLS_PLACEHOLDER + separator, examples[:-1], examples[-1]
+
+
+def _get_tools_key(toolbox: Dict[str, Any]) -> ToolsKey:
+    return tuple((name, tool.description) for name, tool in toolbox.items())
+
+
+def _get_tools_used(example: str, names: FrozenSet[str]) -> FrozenSet[str]:
+    code = "\n".join(_CODE.findall(example))
+    return frozenset(name for name in names if name in code)
+
+
+def _select_examples(
+    examples: List[str], names: FrozenSet[str], selected: FrozenSet[str], max_examples: int
+) -> List[int]:
+    """Returns the indices of the examples using the selected tools. The first if none does"""
+    used = [_get_tools_used(example, names) for example in examples]
+    # Examples only using the selected tools first, then by the number of selected tools used
+    ranked = sorted(
+        range(len(examples)),
+        key=lambda index: (not used[index] <= selected, -len(used[index] & selected), index),
+    )
+    kept = sorted(index for index in ranked[:max_examples] if used[index] & selected)
+    if not kept and examples:
+        # One example shows the format of the answer
+        kept = [0]
+    return kept
+
+
+@lru_cache(maxsize=256)
+def _format_prefix_and_suffix(
+    template: str, tools: ToolsKey, selected: FrozenSet[str], max_examples: int
+) -> Tuple[str, str]:
+    """Returns the parts of the prompt before and after the task"""
+    parts = _split_template(template)
+    if parts is None:
+        raise ValueError("The template has no placeholders for the tools and the task")
+    introduction, examples, end = parts
+    description = "\n".join(f"- {name}: {text}" for name, text in tools if name in selected)
+    kept = _select_examples(examples, frozenset(name for name, _ in tools), selected, max_examples)
+
+    prefix, suffix = end.split(TASK_PLACEHOLDER, 1)
+    prompt = introduction.replace(TOOLS_PLACEHOLDER, description)
+    prompt += "".join(examples[index] for index in kept) + prefix
+    return prompt, suffix
+
+
+class PromptBuilder:
+    """Formats the run prompt of an agent describing only the tools relevant to the task
+
+    Args:
+        max_tools: The maximum number of tools described
+        max_examples: The maximum number of examples kept
+        min_relative_score: The tools scoring less than this share of the best score are not
+            described
+    """
+
+    def __init__(self, max_tools: int = 4, max_examples: int = 3, min_relative_score: float = 0.5):
+        self.max_tools = max_tools
+        self.max_examples = max_examples
+        self.min_relative_score = min_relative_score
+
+    def score_tools(self, task: str, toolbox: Dict[str, Any]) -> Dict[str, float]:
+        """Returns the score of each tool. The sum of the weights of the stems shared with the
+        task. Stems of the name of the tool count twice. Tools named in the task score infinity"""
+        stems, weights = _get_tool_weights(_get_tools_key(toolbox))
+        task_stems = get_stems(task)
+        scores = {}
+        for name, tool_stems in stems.items():
+            if name in task:
+                scores[name] = math.inf
+                continue
+            score = sum(weights[stem] for stem in task_stems & tool_stems)
+            scores[name] = score + sum(weights[stem] for stem in task_stems & get_stems(name))
+        return scores
+
+    def select_tools(self, task: str, toolbox: Dict[str, Any]) -> List[str]:
+        """Returns the names of the tools to describe, best first. All tools if none shares a
+        keyword with the task"""
+        scores = self.score_tools(task, toolbox)
+        best = max(scores.values(), default=0.0)
+        if not best:
+            return list(toolbox)
+        if best == math.inf:
+            # The tools named in the task and the best of the others
+            best = max((score for score in scores.values() if score < math.inf), default=0.0)
+            best = best or math.inf
+        min_score = best * self.min_relative_score
+        selected = sorted(
+            (name for name, score in scores.items() if score and score >= min_score),
+            key=lambda name: -scores[name],
+        )
+        return selected[: self.max_tools]
+
+    def format_prompt(self, agent, task: str) -> str:
+        """Returns the run prompt of the task for the agent
+
+        Falls back to `agent.format_prompt` if the agent has no run prompt template with
+        placeholders for the tools and the task.
+        """
+        template = getattr(agent, "run_prompt_template", None)
+        if not isinstance(template, str) or _split_template(template) is None:
+            return agent.format_prompt(task)
+        toolbox = agent.toolbox
+        selected = frozenset(self.select_tools(task, toolbox))
+        prefix, suffix = _format_prefix_and_suffix(
+            template, _get_tools_key(toolbox), selected, self.max_examples
+        )
+        return prefix + task + suffix
@@ -0,0 +1,180 @@
+"""The registry of the providers creating the agents
+
+Each agent of the AGENT_CONFIGURATION names its `provider`. A Provider creates the agent of a model
+from the configuration of the model and declares its Capabilities. The capabilities can be
+overridden per agent via the `capabilities` of its configuration.
+
+Providers are registered via `register_provider` or by other packages via the
+`transformers_agent_ui.providers` entry point group. For example in the `pyproject.toml`
+
+```toml
+[project.entry-points."transformers_agent_ui.providers"]
+my-provider = "my_package:MY_PROVIDER"
+```
+
+The `fixture` provider serves the completions of a fixture file offline. For testing, demos and
+benchmarks.
+"""
+from __future__ import annotations
+
+import dataclasses
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import cache
+from importlib.metadata import entry_points
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from transformers_agent_ui.assets import ROOT_PATH
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+
+ENTRY_POINT_GROUP = "transformers_agent_ui.providers"
+FIXTURES_PATH = ROOT_PATH / "fixtures.json"
+# Replaced by the task in the default completion of a fixture file
+TASK_PLACEHOLDER = "<<task>>"
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    """The capabilities of a provider
+
+    Args:
+        streaming: True if the agent can stream the completion
+        batch: True if the agent can generate the completions of several prompts in one request
+            via `generate_many`
+        max_concurrency: The maximum number of concurrent requests to the provider per process
+        requires_token: False if the agent can be run without a token
+    """
+
+    streaming: bool = False
+    batch: bool = False
+    max_concurrency: int = 4
+    requires_token: bool = True
+
+
+@dataclass(frozen=True)
+class Provider:
+    """Creates the agents of a model from the configuration of the model and the agent"""
+
+    name: str
+    create_agent: Callable[[Dict[str, Any], Dict[str, Any]], Any] = field(compare=False)
+    capabilities: Capabilities = Capabilities()
+
+
+PROVIDERS: Dict[str, Provider] = {}
+
+
+def register_provider(provider: Provider):
+    """Registers the provider by its name. Replaces a provider of the same name"""
+    PROVIDERS[provider.name] = provider
+
+
+@cache
+def _load_entry_points():
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        register_provider(entry_point.load())
+
+
+def get_provider(agent: str) -> Provider:
+    """Returns the provider of the agent"""
+    _load_entry_points()
+    name = AGENT_CONFIGURATION[agent]["provider"]
+    if name not in PROVIDERS:
+        raise ValueError(f"The provider '{name}' of the agent '{agent}' is not registered")
+    return PROVIDERS[name]
+
+
+def get_capabilities(agent: str) -> Capabilities:
+    """Returns the capabilities of the provider of the agent updated from its configuration"""
+    capabilities = get_provider(agent).capabilities
+    return dataclasses.replace(capabilities, **AGENT_CONFIGURATION[agent].get("capabilities", {}))
+
+
+@cache
+def get_concurrency_limit(agent: str) -> threading.BoundedSemaphore:
+    """Returns the semaphore limiting the concurrent requests to the agent"""
+    return threading.BoundedSemaphore(get_capabilities(agent).max_concurrency)
+
+
+def create_agent(agent: str, model: str):
+    """Returns a new agent of the model. Its generations are limited to the `max_concurrency`"""
+    configuration = AGENT_CONFIGURATION[agent]
+    created = get_provider(agent).create_agent(configuration["models"][model], configuration)
+    generate_one = created.generate_one
+    limit = get_concurrency_limit(agent)
+
+    def limited_generate_one(prompt, stop):
+        with limit:
+            return generate_one(prompt, stop)
+
+    created.generate_one = limited_generate_one
+    return created
+
+
+class FixtureAgent:
+    """An offline agent serving the completions of a fixture file
+
+    The fixture file is a JSON object with the `completions` by task and a `default` completion.
+    The `<<task>>` placeholder of the default completion is replaced by the task as a Python
+    string.
+
+    Args:
+        path: The path of the fixture file. Defaults to the fixtures of the package
+        delay: The seconds to wait before returning a completion. For simulating the latency of
+            a remote provider
+        toolbox: The tools the code of the completions may use
+    """
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        delay: float = 0.0,
+        toolbox: Dict[str, Any] | None = None,
+    ):
+        fixtures = json.loads(Path(path or FIXTURES_PATH).read_text(encoding="utf8"))
+        self.completions: Dict[str, str] = fixtures.get("completions", {})
+        self.default: str = fixtures["default"]
+        self.delay = delay
+        self.toolbox = {} if toolbox is None else toolbox
+        self.cached_tools = None
+
+    def format_prompt(self, task: str) -> str:
+        """Returns the prompt of the task"""
+        return f"Task: {task}"
+
+    def _complete(self, prompt: str) -> str:
+        task = prompt.removeprefix("Task: ")
+        if task in self.completions:
+            return self.completions[task]
+        return self.default.replace(TASK_PLACEHOLDER, repr(task))
+
+    # pylint: disable=unused-argument
+    def generate_one(self, prompt: str, stop: List[str]) -> str:
+        """Returns the completion of the prompt"""
+        if self.delay:
+            time.sleep(self.delay)
+        return self._complete(prompt)
+
+    def generate_many(self, prompts: List[str], stop: List[str]) -> List[str]:
+        """Returns the completions of the prompts in one request"""
+        if self.delay:
+            time.sleep(self.delay)
+        return [self._complete(prompt) for prompt in prompts]
+
+    # pylint: enable=unused-argument
+
+
+def _create_fixture_agent(model: Dict[str, Any], configuration: Dict[str, Any]) -> FixtureAgent:
+    # pylint: disable=unused-argument
+    return FixtureAgent(path=model.get("path"), delay=model.get("delay", 0.0))
+
+
+register_provider(
+    Provider(
+        "fixture",
+        _create_fixture_agent,
+        Capabilities(batch=True, max_concurrency=64, requires_token=False),
+    )
+)
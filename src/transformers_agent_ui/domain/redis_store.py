@@ -0,0 +1,246 @@
+"""The RedisStore shares the runs and tool results across server processes
+
+The keys and small values are kept in Redis and the larger values in an asset directory shared
+by the processes, for example a network file system. Requires `redis`.
+
+The keys are laid out as
+
+- `<prefix>runs:<hash of agent, model and task>`: A list of runs, latest first
+- `<prefix>values:<uuid>`: A small value
+- `<prefix>tools:<key>`: The result of a tool call
+- `<prefix>tools`: A sorted set of the tool call keys by last access
+- `<prefix>lock:<hash of agent, model and task>`: A lock held while computing a run
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+import warnings
+from io import BytesIO
+from pathlib import Path
+from typing import Dict
+from uuid import uuid4
+
+from transformers_agent_ui.domain.hashing import get_hash
+from transformers_agent_ui.domain.store import (
+    ASSET_ERRORS,
+    MAX_TOOL_RESULTS,
+    BaseStore,
+    atomic_write,
+    dump_value,
+    get_suffix,
+    load_value,
+)
+
+log = logging.getLogger(__name__)
+
+# Values up to this size in bytes are kept in Redis. Larger values in the asset directory
+MAX_INLINE_SIZE = 64 * 1024
+# The maximum number of seconds a run may hold its lock. Protects against crashed processes
+LOCK_TIMEOUT = 600
+
+
+class RedisLock:
+    """A lock shared across processes via Redis
+
+    Acquired via `SET NX PX` with a unique token and released only by the owner of the token.
+    """
+
+    def __init__(
+        self, client, name: str, timeout: float = LOCK_TIMEOUT, poll_interval: float = 0.1
+    ):
+        self.client = client
+        self.name = name
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._token = ""
+
+    def acquire(self):
+        """Blocks until the lock is acquired"""
+        token = str(uuid4())
+        while not self.client.set(self.name, token, nx=True, px=int(self.timeout * 1000)):
+            time.sleep(self.poll_interval)
+        self._token = token
+
+    def release(self):
+        """Releases the lock if it is still owned"""
+        with self.client.pipeline() as pipe:
+            pipe.watch(self.name)
+            owner = pipe.get(self.name)
+            if owner is not None and owner.decode() == self._token:
+                pipe.multi()
+                pipe.delete(self.name)
+                pipe.execute()
+            else:
+                pipe.unwatch()
+        self._token = ""
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class RedisStore(BaseStore):
+    """A store for runs implemented using Redis and a shared asset directory
+
+    Args:
+        client: A redis client. If not provided one is created from the url.
+        url: The url of the Redis server. For example `redis://localhost:6379/0`.
+        asset_path: A directory shared by all the processes using the store.
+        prefix: A prefix of all the keys.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = "redis://localhost:6379/0",
+        asset_path: str | Path = ".store/assets",
+        prefix: str = "transformers-agent:",
+        max_tool_results: int = MAX_TOOL_RESULTS,
+        max_inline_size: int = MAX_INLINE_SIZE,
+        lock_timeout: float = LOCK_TIMEOUT,
+    ):
+        super().__init__()
+        if client is None:
+            try:
+                import redis  # pylint: disable=import-outside-toplevel
+            except ImportError as exc:
+                raise ImportError("The RedisStore requires redis: `pip install redis`.") from exc
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.max_tool_results = max_tool_results
+        self.max_inline_size = max_inline_size
+        self.lock_timeout = lock_timeout
+
+        self._asset_path = Path(asset_path)
+        self._asset_path.mkdir(parents=True, exist_ok=True)
+
+    def _get_hash(self, agent: str, model: str, task: str) -> str:
+        return get_hash((agent, model, task))
+
+    def _put_value(self, value) -> Dict:
+        """Writes the value and returns a reference to it"""
+        file = BytesIO()
+        dump_value(value, file)
+        data = file.getvalue()
+        suffix = get_suffix(value)
+        name = str(uuid4())
+        if len(data) <= self.max_inline_size:
+            key = f"{self.prefix}values:{name}"
+            self.client.set(key, data)
+            return {"suffix": suffix, "key": key}
+
+        path = self._asset_path / f"{name}{suffix}"
+        # Other processes never see a partial file
+        with atomic_write(path) as asset:
+            asset.write(data)
+        return {"suffix": suffix, "path": path.name}
+
+    def _get_value(self, reference: Dict):
+        if "key" in reference:
+            data = self.client.get(reference["key"])
+            return load_value(BytesIO(data), reference["suffix"])
+        return load_value(self._asset_path / reference["path"], reference["suffix"])
+
+    def _delete_value(self, reference: Dict):
+        if "key" in reference:
+            self.client.delete(reference["key"])
+        else:
+            (self._asset_path / reference["path"]).unlink(missing_ok=True)
+
+    def write(
+        self,
+        agent: str,
+        model: str,
+        task: str,
+        kwargs: Dict,
+        prompt: str,
+        explanation: str,
+        code: str,
+        value,
+        model_used: str = "",
+    ) -> str:
+        reference = self._put_value(value)
+        if reference["suffix"] == ".pickle":
+            warnings.warn(f"Saved type {type(value)} as pickle to {reference}")
+        row = {
+            "prompt": prompt,
+            "explanation": explanation,
+            "code": code,
+            "value": reference,
+            "model_used": model_used,
+        }
+        key = f"{self.prefix}runs:{self._get_hash(agent, model, task)}"
+        self.client.lpush(key, json.dumps(row))
+        # The values are not served from the `asset_path` by their path
+        return ""
+
+    def read(self, agent: str, model: str, task: str, kwargs: Dict) -> Dict:
+        data = self.client.lindex(f"{self.prefix}runs:{self._get_hash(agent, model, task)}", 0)
+        if data is None:
+            return {}
+        row = json.loads(data)
+        row["value"] = self._get_value(row["value"])
+        # Runs written by earlier versions do not have a model_used
+        row.setdefault("model_used", "")
+        return row
+
+    def exists(self, agent: str, model: str, task: str, kwargs: Dict) -> bool:
+        key = f"{self.prefix}runs:{self._get_hash(agent, model, task)}"
+        return bool(self.client.exists(key))
+
+    def delete(self, agent: str, model: str, task: str):
+        key = f"{self.prefix}runs:{self._get_hash(agent, model, task)}"
+        for data in self.client.lrange(key, 0, -1):
+            self._delete_value(json.loads(data)["value"])
+        self.client.delete(key)
+
+    def single_flight(self, agent: str, model: str, task: str) -> RedisLock:
+        """Returns a lock shared by all processes using the Redis server"""
+        name = f"{self.prefix}lock:{self._get_hash(agent, model, task)}"
+        return RedisLock(self.client, name, timeout=self.lock_timeout)
+
+    def _touch_tool_result(self, key: str):
+        clock = self.client.incr(f"{self.prefix}tools:clock")
+        self.client.zadd(f"{self.prefix}tools", {key: clock})
+
+    def read_tool_result(self, key: str):
+        data = self.client.get(f"{self.prefix}tools:{key}")
+        if data is None:
+            raise KeyError(key)
+        self._touch_tool_result(key)
+        reference = json.loads(data)
+        try:
+            return self._get_value(reference)
+        except (*ASSET_ERRORS, TypeError) as exc:
+            # The value was evicted by another process since. Computed again like a cache miss.
+            # A missing inline value is read as None, which raises a TypeError
+            log.warning("Skipped the unreadable tool result %s: %s", key, exc)
+            raise KeyError(key) from exc
+
+    def write_tool_result(self, key: str, tool: str, value):
+        """Writes the result of the tool call identified by the key to the store
+
+        The least recently used results are evicted when there are more than `max_tool_results`.
+        """
+        reference = self._put_value(value)
+        previous = self.client.getset(f"{self.prefix}tools:{key}", json.dumps(reference))
+        if previous is not None:
+            self._delete_value(json.loads(previous))
+        self._touch_tool_result(key)
+
+        excess = self.client.zcard(f"{self.prefix}tools") - self.max_tool_results
+        if excess <= 0:
+            return
+        for evicted in self.client.zrange(f"{self.prefix}tools", 0, excess - 1):
+            evicted_key = evicted.decode()
+            data = self.client.get(f"{self.prefix}tools:{evicted_key}")
+            if data is not None:
+                self._delete_value(json.loads(data))
+            self.client.delete(f"{self.prefix}tools:{evicted_key}")
+            self.client.zrem(f"{self.prefix}tools", evicted_key)
@@ -0,0 +1,254 @@
+"""Routes the generations of an agent between its models by their recent latency and errors
+
+The latency and the outcome of the last generations of each agent and model are kept in a rolling
+window. A RoutedAgent generates via the requested model unless it is unhealthy, i.e. its recent
+error rate is above the `max_error_rate`, and
+
+- falls back to the other models of the agent, fastest first, if the generation fails.
+- hedges, i.e. also sends the request to the next model, if the generation has not completed after
+`hedge_after` seconds. The first successful generation is used.
+
+The routing is configured via the ROUTING_CONFIGURATION and per agent via its `routing`. The
+model that generated the code is available as `model_used`.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import cache
+from typing import Any, Callable, Dict, List, Tuple
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION, ROUTING_CONFIGURATION
+
+log = logging.getLogger(__name__)
+
+# The maximum number of generations hedged concurrently by all sessions of the process
+MAX_HEDGED_GENERATIONS = 16
+
+
+class ModelStats:
+    """The latency and outcome of the last `window` generations of a model"""
+
+    def __init__(self, window: int = 20):
+        self._observations: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float, ok: bool):
+        """Adds the latency in seconds and the outcome of a generation"""
+        with self._lock:
+            self._observations.append((latency, ok))
+
+    @property
+    def count(self) -> int:
+        """The number of generations observed in the window"""
+        with self._lock:
+            return len(self._observations)
+
+    @property
+    def latency(self) -> float | None:
+        """The median latency of the successful generations or None if there are none"""
+        with self._lock:
+            latencies = [latency for latency, ok in self._observations if ok]
+        return statistics.median(latencies) if latencies else None
+
+    @property
+    def error_rate(self) -> float:
+        """The share of the failed generations. 0.0 if there are none"""
+        with self._lock:
+            if not self._observations:
+                return 0.0
+            return sum(not ok for _, ok in self._observations) / len(self._observations)
+
+
+_stats: Dict[Tuple[str, str], ModelStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_routing_configuration(agent: str) -> Dict[str, Any]:
+    """Returns the ROUTING_CONFIGURATION updated from the `routing` of the agent"""
+    return {**ROUTING_CONFIGURATION, **AGENT_CONFIGURATION[agent].get("routing", {})}
+
+
+def get_stats(agent: str, model: str) -> ModelStats:
+    """Returns the stats of the model of the agent shared by the sessions"""
+    with _stats_lock:
+        if (agent, model) not in _stats:
+            window = get_routing_configuration(agent)["window"]
+            _stats[(agent, model)] = ModelStats(window=window)
+        return _stats[(agent, model)]
+
+
+def clear_stats():
+    """Removes the stats of all models"""
+    with _stats_lock:
+        _stats.clear()
+
+
+def is_healthy(agent: str, model: str) -> bool:
+    """Returns False if the recent error rate of the model is above the `max_error_rate`"""
+    configuration = get_routing_configuration(agent)
+    stats = get_stats(agent, model)
+    if stats.count < configuration["min_samples"]:
+        return True
+    return stats.error_rate <= configuration["max_error_rate"]
+
+
+def get_candidates(agent: str, model: str) -> List[str]:
+    """Returns the models to generate with in order of preference
+
+    The requested model comes first unless it is unhealthy. The other models of the agent follow,
+    if `fallback` is configured, healthy and fastest first. Models without a recent successful
+    generation are tried after the ones with.
+    """
+    models = [model]
+    if get_routing_configuration(agent)["fallback"]:
+        models += [other for other in AGENT_CONFIGURATION[agent]["models"] if other != model]
+
+    def get_key(candidate: str):
+        latency = get_stats(agent, candidate).latency
+        return (
+            not is_healthy(agent, candidate),
+            candidate != model,
+            latency is None,
+            latency or 0.0,
+        )
+
+    return sorted(models, key=get_key)
+
+
+@cache
+def _get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=MAX_HEDGED_GENERATIONS, thread_name_prefix="transformers-agent-ui-hedge"
+    )
+
+
+class RoutedAgent:
+    """An agent generating via the models of an agent as routed by their latency and errors
+
+    The prompt and the tools are those of the agent of the requested model. Create one per run.
+
+    Args:
+        agent: The name of the agent
+        model: The requested model
+        get_agent: Returns the agent of an agent name and model
+    """
+
+    def __init__(self, agent: str, model: str, get_agent: Callable[[str, str], Any]):
+        self.agent = agent
+        self.model = model
+        self.get_agent = get_agent
+        self.model_used = ""
+        self._primary = get_agent(agent, model)
+
+    def format_prompt(self, task: str) -> str:
+        """Returns the prompt of the task"""
+        return self._primary.format_prompt(task)
+
+    @property
+    def run_prompt_template(self) -> str | None:
+        """The template of the run prompt of the agent if any"""
+        return getattr(self._primary, "run_prompt_template", None)
+
+    @property
+    def toolbox(self) -> Dict[str, Any]:
+        """The tools of the agent"""
+        return self._primary.toolbox
+
+    @property
+    def cached_tools(self):
+        """The tools resolved by the previous runs of the primary agent"""
+        return self._primary.cached_tools
+
+    @cached_tools.setter
+    def cached_tools(self, value):
+        self._primary.cached_tools = value
+
+    def _generate(self, model: str, prompt: str, stop: List[str]) -> str:
+        stats = get_stats(self.agent, model)
+        start = time.perf_counter()
+        try:
+            result = self.get_agent(self.agent, model).generate_one(prompt, stop)
+        except Exception:
+            stats.observe(time.perf_counter() - start, ok=False)
+            raise
+        stats.observe(time.perf_counter() - start, ok=True)
+        return result
+
+    def generate_one(self, prompt: str, stop: List[str]) -> str:
+        """Returns the completion of the prompt by the first model to generate it successfully"""
+        candidates = get_candidates(self.agent, self.model)
+        hedge_after = get_routing_configuration(self.agent)["hedge_after"]
+        if hedge_after is None or len(candidates) == 1:
+            return self._generate_sequentially(candidates, prompt, stop)
+        return self._generate_hedged(candidates, prompt, stop, hedge_after)
+
+    def _generate_sequentially(self, candidates: List[str], prompt: str, stop: List[str]) -> str:
+        for index, model in enumerate(candidates):
+            try:
+                result = self._generate(model, prompt, stop)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                if index == len(candidates) - 1:
+                    raise
+                log.warning(
+                    "The generation via model '%s' failed: %s. Falling back to model '%s'",
+                    model,
+                    exc,
+                    candidates[index + 1],
+                )
+                continue
+            self.model_used = model
+            return result
+        raise ValueError(f"The agent '{self.agent}' has no models")
+
+    def _generate_hedged(
+        self, candidates: List[str], prompt: str, stop: List[str], hedge_after: float
+    ) -> str:
+        remaining = list(candidates)
+        pending: Dict[Future, str] = {}
+
+        def submit():
+            model = remaining.pop(0)
+            # The token and the log handler of the run are set via context variables
+            context = contextvars.copy_context()
+            pending[
+                _get_executor().submit(context.run, self._generate, model, prompt, stop)
+            ] = model
+
+        submit()
+        exception: Exception | None = None
+        while pending:
+            done, _ = wait(
+                pending, timeout=hedge_after if remaining else None, return_when=FIRST_COMPLETED
+            )
+            if not done:
+                log.info(
+                    "The generation via model '%s' takes more than %ss. Hedging via model '%s'",
+                    ", ".join(pending.values()),
+                    hedge_after,
+                    remaining[0],
+                )
+                submit()
+                continue
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    log.warning("The generation via model '%s' failed: %s", model, exc)
+                    exception = exc
+                    if remaining and not pending:
+                        submit()
+                    continue
+                # The slower generations complete in the background and are observed
+                for other in pending:
+                    other.cancel()
+                self.model_used = model
+                return result
+        assert exception is not None  # nosec
+        raise exception
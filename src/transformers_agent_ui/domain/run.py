@@ -14,14 +14,14 @@ class AgentInput(param.Parameterized):
     )
 
     def __init__(self, **params):
-        if "agent" in params:
-            agent = params["agent"]
-            self.param.agent.default = agent
-            self.param.model.objects = sorted(AGENT_CONFIGURATION[agent]["models"])
-            self.param.model.default = AGENT_CONFIGURATION[agent]["default"]
-        if "model" in params:
-            self.param.model.default = params["model"]
+        model = params.pop("model", None)
         super().__init__(**params)
+        # Before super().__init__ the parameters of the class, shared by all instances, would be
+        # changed
+        configuration = AGENT_CONFIGURATION[self.agent]
+        self.param.model.objects = sorted(configuration["models"])
+        self.param.model.default = configuration["default"]
+        self.model = configuration["default"] if model is None else model
 
     @param.depends("agent", watch=True)
     def _handle_agent_change(self):
@@ -55,6 +55,10 @@ class RunOutput(param.Parameterized):
     prompt = param.String()
     explanation = param.String()
     code = param.String()
+    model_used = param.String(
+        doc="""The model that generated the code. Differs from the model if the generation fell
+        back to another model. Empty if unknown"""
+    )
 
 
 class Run(RunInput, RunOutput):
@@ -0,0 +1,203 @@
+"""The S3Store keeps the runs and tool results in an S3 compatible object store
+
+For example AWS S3 or MinIO. Requires `boto3`.
+
+The objects are laid out as
+
+- `runs/<hash of agent, model and task>/<time>-<uuid>.json`: The run
+- `assets/<uuid>.<suffix>`: The value of the run
+- `tools/<key>`: The result of a tool call
+"""
+from __future__ import annotations
+
+import json
+import threading
+import warnings
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Dict, Iterator, List
+from uuid import uuid4
+
+from transformers_agent_ui.domain.hashing import get_hash
+from transformers_agent_ui.domain.store import (
+    MAX_TOOL_RESULTS,
+    BaseStore,
+    dump_value,
+    get_suffix,
+    load_value,
+)
+
+TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+# The tool results are only listed to evict the excess every `EVICTION_INTERVAL` writes
+EVICTION_INTERVAL = 100
+# A tool result read is written again if older. So the least recently used ones are evicted
+REFRESH_INTERVAL = timedelta(hours=1)
+
+
+class S3Store(BaseStore):
+    """A store for runs implemented using an S3 compatible object store
+
+    Args:
+        bucket: The name of an existing bucket
+        prefix: A prefix of all the keys. For example `transformers-agent/`
+        client: A boto3 S3 client. If not provided one is created from the client_kwargs. For
+            example `endpoint_url="http://localhost:9000"` for a local MinIO server.
+        max_tool_results: The least recently used tool results are evicted when there are more
+            than `max_tool_results`. Checked every `eviction_interval` writes of a process.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        client=None,
+        max_tool_results: int = MAX_TOOL_RESULTS,
+        eviction_interval: int = EVICTION_INTERVAL,
+        **client_kwargs,
+    ):
+        super().__init__()
+        if client is None:
+            try:
+                import boto3  # pylint: disable=import-outside-toplevel
+            except ImportError as exc:
+                raise ImportError("The S3Store requires boto3: `pip install boto3`.") from exc
+            client = boto3.client("s3", **client_kwargs)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client
+        self.max_tool_results = max_tool_results
+        self.eviction_interval = eviction_interval
+        self._lock = threading.Lock()
+        self._tool_writes = 0
+
+    def _get_runs_prefix(self, agent: str, model: str, task: str) -> str:
+        return f"{self.prefix}runs/{get_hash((agent, model, task))}/"
+
+    def _list(self, prefix: str) -> Iterator[Dict]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from page.get("Contents", [])
+
+    def _put_value(self, key: str, value):
+        file = BytesIO()
+        dump_value(value, file)
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=file.getvalue())
+
+    def _get_value(self, key: str, suffix: str):
+        body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        return load_value(BytesIO(body), suffix)
+
+    def write(
+        self,
+        agent: str,
+        model: str,
+        task: str,
+        kwargs: Dict,
+        prompt: str,
+        explanation: str,
+        code: str,
+        value,
+        model_used: str = "",
+    ) -> str:
+        unique_id = str(uuid4())
+        asset_key = f"{self.prefix}assets/{unique_id}{get_suffix(value)}"
+        self._put_value(asset_key, value)
+        if asset_key.endswith(".pickle"):
+            warnings.warn(f"Saved type {type(value)} as pickle file to {asset_key}")
+
+        row = {
+            "agent": agent,
+            "model": model,
+            "task": task,
+            "prompt": prompt,
+            "explanation": explanation,
+            "code": code,
+            "value": asset_key,
+            "model_used": model_used,
+        }
+        time = datetime.utcnow().strftime(TIME_FORMAT)
+        key = f"{self._get_runs_prefix(agent, model, task)}{time}-{unique_id}.json"
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(row).encode())
+        return ""
+
+    def read(self, agent: str, model: str, task: str, kwargs: Dict) -> Dict:
+        keys = [obj["Key"] for obj in self._list(self._get_runs_prefix(agent, model, task))]
+        if not keys:
+            return {}
+        body = self.client.get_object(Bucket=self.bucket, Key=max(keys))["Body"].read()
+        row = json.loads(body)
+        asset_key = row["value"]
+        return {
+            "prompt": row["prompt"],
+            "explanation": row["explanation"],
+            "code": row["code"],
+            "value": self._get_value(asset_key, "." + asset_key.rsplit(".", 1)[-1]),
+            "model_used": row.get("model_used", ""),
+        }
+
+    def exists(self, agent: str, model: str, task: str, kwargs: Dict) -> bool:
+        response = self.client.list_objects_v2(
+            Bucket=self.bucket, Prefix=self._get_runs_prefix(agent, model, task), MaxKeys=1
+        )
+        return response.get("KeyCount", 0) > 0
+
+    def _delete_keys(self, keys: List[str]):
+        # A delete request is limited to 1000 keys
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": key} for key in keys[start : start + 1000]]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects})
+
+    def delete(self, agent: str, model: str, task: str):
+        keys = []
+        for obj in self._list(self._get_runs_prefix(agent, model, task)):
+            body = self.client.get_object(Bucket=self.bucket, Key=obj["Key"])["Body"].read()
+            keys += [obj["Key"], json.loads(body)["value"]]
+        self._delete_keys(keys)
+
+    def read_tool_result(self, key: str):
+        tool_key = f"{self.prefix}tools/{key}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=tool_key)
+        except self.client.exceptions.NoSuchKey as exc:
+            raise KeyError(key) from exc
+        value = load_value(BytesIO(response["Body"].read()), response["Metadata"]["suffix"])
+        if datetime.now(timezone.utc) - response["LastModified"] >= REFRESH_INTERVAL:
+            # Object stores do not track when objects are read. Copying it updates LastModified
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=tool_key,
+                CopySource={"Bucket": self.bucket, "Key": tool_key},
+                Metadata=response["Metadata"],
+                MetadataDirective="REPLACE",
+            )
+        return value
+
+    def write_tool_result(self, key: str, tool: str, value):
+        """Writes the result of the tool call identified by the key to the store
+
+        Listing the tool results requires a request per 1000 results. So the excess is only
+        evicted every `eviction_interval` writes. The results not read or written for the longest
+        time are evicted.
+        """
+        file = BytesIO()
+        dump_value(value, file)
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}tools/{key}",
+            Body=file.getvalue(),
+            Metadata={"tool": tool, "suffix": get_suffix(value)},
+        )
+
+        with self._lock:
+            self._tool_writes += 1
+            if self._tool_writes < self.eviction_interval:
+                return
+            self._tool_writes = 0
+        self._evict_tool_results()
+
+    def _evict_tool_results(self):
+        objects = list(self._list(f"{self.prefix}tools/"))
+        if len(objects) > self.max_tool_results:
+            objects.sort(key=lambda obj: (obj["LastModified"], obj["Key"]))
+            evicted = objects[: len(objects) - self.max_tool_results]
+            self._delete_keys([obj["Key"] for obj in evicted])
@@ -0,0 +1,403 @@
+"""The ProcessSandbox evaluates the code generated by the agents in worker processes
+
+Evaluating the code in the server process means a CPU heavy local tool holds the GIL and stalls
+every session, and a runaway program cannot be stopped. The ProcessSandbox keeps a pool of
+pre-warmed worker processes with the tools preloaded. Each evaluation is limited in CPU time,
+wall clock time and memory. A worker exceeding its CPU or wall clock time is killed and replaced.
+
+Large arrays, tensors and images are returned via shared memory instead of being pickled through
+the pipe. On Linux the server process maps the shared memory instead of copying it.
+
+The CPU time and memory limits rely on the `resource` module and are not applied on Windows.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from functools import cache
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore[assignment]
+
+from transformers_agent_ui.domain.cancellation import POLL_INTERVAL, Cancellation, CancelledError
+
+log = logging.getLogger(__name__)
+
+SANDBOX_WORKERS_ENV_VALUE = "TRANSFORMERS_AGENT_UI_SANDBOX_WORKERS"
+SANDBOX_PRELOAD_ENV_VALUE = "TRANSFORMERS_AGENT_UI_SANDBOX_PRELOAD"
+# The default limits of an evaluation
+CPU_TIME = 120
+WALL_TIME = 300.0
+MEMORY = 8 * 1024**3
+# Arrays, tensors and images smaller than this are returned through the pipe
+MIN_SHARED_MEMORY_SIZE = 1024**2
+_SHARED_IMAGE_MODES = {"L", "RGB", "RGBA"}
+# The directory of the shared memory blocks on Linux
+SHARED_MEMORY_PATH = "/dev/shm"  # nosec
+
+
+class SandboxError(RuntimeError):
+    """Raised when the evaluation failed in a way that cannot be returned from the worker"""
+
+
+class SandboxTimeoutError(SandboxError, TimeoutError):
+    """Raised when an evaluation exceeds its CPU or wall clock time"""
+
+
+class SandboxLimits:  # pylint: disable=too-few-public-methods
+    """The limits of an evaluation
+
+    Args:
+        cpu_time: The maximum CPU time in seconds. None for no limit.
+        wall_time: The maximum wall clock time in seconds. None for no limit.
+        memory: The maximum memory in bytes the worker may allocate in addition to the memory used
+            before the evaluation. None for no limit.
+    """
+
+    def __init__(
+        self,
+        cpu_time: int | None = CPU_TIME,
+        wall_time: float | None = WALL_TIME,
+        memory: int | None = MEMORY,
+    ):
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+        self.memory = memory
+
+    def __repr__(self):
+        return (
+            f"SandboxLimits(cpu_time={self.cpu_time}, wall_time={self.wall_time}, "
+            f"memory={self.memory})"
+        )
+
+
+def _share(array: np.ndarray) -> Tuple[str, Tuple, str]:
+    """Copies the array to a new shared memory block. Returns its name, the shape and dtype"""
+    shared_memory = SharedMemory(create=True, size=array.nbytes)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory.buf)[...] = array
+    shared_memory.close()
+    return shared_memory.name, array.shape, array.dtype.str
+
+
+def _unshare(name: str, shape: Tuple, dtype: str) -> np.ndarray:
+    """Returns the array in the shared memory block and unlinks the block
+
+    Where the blocks are files, i.e. on Linux, the block is mapped instead of copied. Its memory is
+    freed once the array is garbage collected. Elsewhere the array is copied"""
+    shared_memory = SharedMemory(name=name)
+    try:
+        path = Path(SHARED_MEMORY_PATH, shared_memory.name.lstrip("/"))
+        if path.is_file():
+            return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+        return np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf).copy()
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+def encode_value(value) -> Tuple[str, Any]:
+    """Returns the kind and payload of the value to send from the worker. Large arrays, tensors
+    and images are moved to shared memory"""
+    if isinstance(value, Image.Image) and value.mode in _SHARED_IMAGE_MODES:
+        array = np.asarray(value)
+        if array.nbytes >= MIN_SHARED_MEMORY_SIZE:
+            return "image", _share(array)
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        if value.nbytes >= MIN_SHARED_MEMORY_SIZE:
+            return "array", _share(np.ascontiguousarray(value))
+    elif type(value).__module__ == "torch" and type(value).__name__ == "Tensor":
+        if value.device.type == "cpu" and value.nbytes >= MIN_SHARED_MEMORY_SIZE:
+            return "tensor", _share(value.detach().contiguous().numpy())
+    return "value", value
+
+
+def decode_value(kind: str, payload):
+    """Returns the value encoded by `encode_value`"""
+    if kind == "value":
+        return payload
+    array = _unshare(*payload)
+    if kind == "image":
+        return Image.fromarray(array)
+    if kind == "tensor":
+        import torch  # pylint: disable=import-outside-toplevel
+
+        return torch.from_numpy(array)
+    return array
+
+
+def _get_default_toolbox() -> Dict[str, Any]:
+    # pylint: disable=import-outside-toplevel
+    from transformers.tools import agents
+
+    agents._setup_default_tools()  # pylint: disable=protected-access
+    return agents.HUGGINGFACE_DEFAULT_TOOLS
+
+
+def _set_limits(limits: SandboxLimits):
+    """Limits the CPU time and memory of the rest of the evaluation"""
+    if resource is None:
+        return
+    if limits.cpu_time is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = int(usage.ru_utime + usage.ru_stime) + 1
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        # Exceeding the soft limit sends SIGXCPU, which terminates the worker
+        resource.setrlimit(resource.RLIMIT_CPU, (used + limits.cpu_time, hard))
+    if limits.memory is not None:
+        with open("/proc/self/statm", encoding="utf8") as file:
+            used = int(file.read().split()[0]) * resource.getpagesize()
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (used + limits.memory, hard))
+
+
+def _reset_limits():
+    if resource is None:
+        return
+    for limit in (resource.RLIMIT_CPU, resource.RLIMIT_AS):
+        _, hard = resource.getrlimit(limit)
+        resource.setrlimit(limit, (hard, hard))
+
+
+def _evaluate(request: Tuple, toolbox: Dict[str, Any], cached_tools: Dict[bool, Dict]):
+    """Evaluates the request in the worker. Returns the encoded result"""
+    # pylint: disable=import-outside-toplevel
+    from transformers.tools.agents import resolve_tools
+
+    from transformers_agent_ui.domain.custom_run import evaluate
+    from transformers_agent_ui.domain.sessions import use_pooled_sessions
+
+    code, request_toolbox, state, remote, max_workers, limits = request
+    tools = resolve_tools(
+        code, request_toolbox or toolbox, remote=remote, cached_tools=cached_tools.get(remote)
+    )
+    tools = use_pooled_sessions(tools)
+    cached_tools[remote] = tools
+    _set_limits(limits)
+    try:
+        value = evaluate(code, tools, state=state, max_workers=max_workers)
+    finally:
+        _reset_limits()
+    return encode_value(value)
+
+
+def _serve(connection: Connection, toolbox: Dict[str, Any] | None, preload: Sequence[str], remote):
+    """The main loop of a worker process. Evaluates the code received until None is received"""
+    # pylint: disable=import-outside-toplevel
+    from transformers.tools.agents import resolve_tools
+
+    if toolbox is None:
+        toolbox = _get_default_toolbox() if preload else {}
+    cached_tools = {remote: resolve_tools(" ".join(preload), toolbox, remote=remote)}
+    connection.send(("ready", None))
+
+    while request := connection.recv():
+        response: Tuple[str, Any]
+        try:
+            response = ("ok", _evaluate(request, toolbox, cached_tools))
+        except BaseException as exc:  # pylint: disable=broad-exception-caught
+            response = ("error", exc)
+        try:
+            connection.send(response)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # For example exceptions or values that cannot be pickled
+            connection.send(("error", SandboxError(f"{type(exc).__name__}: {exc}")))
+
+
+class _Worker:
+    """A worker process and the connection to it"""
+
+    def __init__(self, context, toolbox, preload: Sequence[str], remote: bool):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_serve,
+            args=(child_connection, toolbox, tuple(preload), remote),
+            daemon=True,
+            name="transformers-agent-sandbox",
+        )
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+
+    def wait_until_ready(self):
+        """Waits until the tools are preloaded"""
+        if not self.ready:
+            self.receive(timeout=None)
+            self.ready = True
+
+    def receive(self, timeout: float | None, cancellation: Cancellation | None = None):
+        """Returns the next response. Raises a SandboxTimeoutError if it takes too long
+
+        If a cancellation is provided it is checked while waiting"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                poll_timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if cancellation is not None:
+                    cancellation.check()
+                    poll_timeout = (
+                        POLL_INTERVAL if poll_timeout is None else min(poll_timeout, POLL_INTERVAL)
+                    )
+                if self.connection.poll(poll_timeout):
+                    return self.connection.recv()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise SandboxTimeoutError(
+                        f"The evaluation exceeded the wall time of {timeout}s"
+                    )
+        except EOFError as exc:
+            self.process.join(timeout=1)
+            sigxcpu = getattr(signal, "SIGXCPU", None)
+            if sigxcpu is not None and self.process.exitcode == -sigxcpu:
+                raise SandboxTimeoutError("The evaluation exceeded its CPU time") from exc
+            raise SandboxError(
+                f"The sandbox worker stopped with exit code {self.process.exitcode}"
+            ) from exc
+
+    def kill(self):
+        """Stops the worker immediately"""
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def close(self):
+        """Asks the worker to stop"""
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.connection.close()
+
+
+class ProcessSandbox:
+    """Evaluates code in a pool of pre-warmed worker processes
+
+    Args:
+        workers: The number of worker processes, i.e. of concurrent evaluations
+        toolbox: The toolbox to preload the tools from. Defaults to the default tools of the
+            transformers agents.
+        preload: The names of the tools to load when a worker starts. For example
+            `["image_captioner", "text_reader"]`.
+        remote: Whether the preloaded tools are remote tools
+        limits: The default limits of an evaluation
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        workers: int = 2,
+        toolbox: Dict[str, Any] | None = None,
+        preload: Sequence[str] = (),
+        remote: bool = False,
+        limits: SandboxLimits | None = None,
+    ):
+        self.toolbox = toolbox
+        self.preload = tuple(preload)
+        self.remote = remote
+        self.limits = limits or SandboxLimits()
+        # Forking a process with threads, for example of the server or of torch, is not safe
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers: queue.Queue[_Worker] = queue.Queue()
+        for _ in range(workers):
+            self._workers.put(self._start_worker())
+
+    def _start_worker(self) -> _Worker:
+        return _Worker(self._context, self.toolbox, self.preload, self.remote)
+
+    def evaluate(  # pylint: disable=too-many-arguments
+        self,
+        code: str,
+        toolbox: Dict[str, Any] | None = None,
+        state: Dict[str, Any] | None = None,
+        remote: bool = False,
+        max_workers: int = 1,
+        limits: SandboxLimits | None = None,
+        cancellation: Cancellation | None = None,
+    ):
+        """Evaluates the code in a worker process and returns the result
+
+        Args:
+            code: The code to evaluate
+            toolbox: The toolbox to resolve the tools used by the code from. Defaults to the
+                toolbox of the sandbox.
+            state: The variables available to the code. Must be picklable.
+            remote: Whether to use remote tools
+            max_workers: The maximum number of statements to evaluate concurrently in the worker
+            limits: The limits of the evaluation. Defaults to the limits of the sandbox.
+            cancellation: If provided the worker is killed and replaced once the run is cancelled
+                or its stage timed out.
+        """
+        if self._closed:
+            raise SandboxError("The sandbox is closed")
+        limits = limits or self.limits
+        worker = self._workers.get()
+        try:
+            worker.wait_until_ready()
+            worker.connection.send((code, toolbox, state or {}, remote, max_workers, limits))
+            status, payload = worker.receive(timeout=limits.wall_time, cancellation=cancellation)
+        except (SandboxError, CancelledError):
+            log.warning("Replacing the sandbox worker %s", worker.process.pid)
+            worker.kill()
+            worker = self._start_worker()
+            raise
+        finally:
+            self._release(worker)
+
+        if status == "error":
+            raise payload
+        return decode_value(*payload)
+
+    def _release(self, worker: _Worker):
+        with self._lock:
+            if not self._closed:
+                self._workers.put(worker)
+                return
+        worker.close()
+
+    def close(self):
+        """Stops the worker processes"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                worker = self._workers.get_nowait()
+            except queue.Empty:
+                break
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@cache
+def get_default_sandbox() -> Optional[ProcessSandbox]:
+    """Returns the sandbox shared by all sessions of the process if configured
+
+    The number of workers is set via the `TRANSFORMERS_AGENT_UI_SANDBOX_WORKERS` environment
+    variable and the comma separated names of the tools to preload via
+    `TRANSFORMERS_AGENT_UI_SANDBOX_PRELOAD`. Returns None if no workers are configured.
+    """
+    workers = int(os.getenv(SANDBOX_WORKERS_ENV_VALUE, "") or 0)
+    if not workers:
+        return None
+    preload = [name.strip() for name in os.getenv(SANDBOX_PRELOAD_ENV_VALUE, "").split(",")]
+    return ProcessSandbox(workers=workers, preload=[name for name in preload if name])
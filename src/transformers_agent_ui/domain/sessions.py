@@ -0,0 +1,194 @@
+"""Provides pooled, keep-alive HTTP sessions shared across runs and user sessions
+
+Creating a new session per run means a new TCP and TLS handshake for every request to an
+inference endpoint. The SessionPool keeps one `requests.Session` per endpoint and counts the
+requests and the new connections, so that the connection reuse can be monitored.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from transformers.tools.base import EndpointClient, RemoteTool
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION, HTTP_CONFIGURATION
+
+
+class ConnectionMetrics:
+    """Counts the requests and the new connections of a session"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def add_request(self):
+        """Counts a request"""
+        with self._lock:
+            self.requests += 1
+
+    def add_connection(self):
+        """Counts a new connection, i.e. a TCP and possibly a TLS handshake"""
+        with self._lock:
+            self.connections += 1
+
+    @property
+    def reused(self) -> int:
+        """The number of requests sent over an already open connection"""
+        return max(self.requests - self.connections, 0)
+
+    @property
+    def reuse_ratio(self) -> float:
+        """The share of requests sent over an already open connection"""
+        if not self.requests:
+            return 0.0
+        return self.reused / self.requests
+
+    def to_dict(self) -> Dict:
+        """Returns the metrics as a dictionary"""
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": self.reused,
+            "reuse_ratio": self.reuse_ratio,
+        }
+
+    def __repr__(self):
+        return f"ConnectionMetrics({self.to_dict()})"
+
+
+class _MetricsHTTPAdapter(HTTPAdapter):
+    """A HTTPAdapter counting the new connections opened by its connection pools"""
+
+    def __init__(self, metrics: ConnectionMetrics, **kwargs):
+        self.metrics = metrics
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        metrics = self.metrics
+
+        def _new_conn(pool_class):
+            def new_conn(pool):
+                metrics.add_connection()
+                return pool_class._new_conn(pool)  # pylint: disable=protected-access
+
+            return new_conn
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type(
+                "HTTPConnectionPool",
+                (HTTPConnectionPool,),
+                {"_new_conn": _new_conn(HTTPConnectionPool)},
+            ),
+            "https": type(
+                "HTTPSConnectionPool",
+                (HTTPSConnectionPool,),
+                {"_new_conn": _new_conn(HTTPSConnectionPool)},
+            ),
+        }
+
+
+def get_endpoint(url: str) -> str:
+    """Returns the endpoint, i.e. the scheme and host, of the url"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_configured_endpoints() -> Dict[str, Dict]:
+    """Returns the endpoints of the AGENT_CONFIGURATION and their HTTP configuration"""
+    endpoints = {}
+    for configuration in AGENT_CONFIGURATION.values():
+        http = {**HTTP_CONFIGURATION, **configuration.get("http", {})}
+        urls = [http.pop("endpoint", "")] + [
+            model.get("url_endpoint", "") for model in configuration["models"].values()
+        ]
+        for url in urls:
+            if url:
+                endpoints[get_endpoint(url)] = http
+    return endpoints
+
+
+class SessionPool:
+    """A pool of keep-alive HTTP sessions. One per endpoint"""
+
+    def __init__(self, configuration: Dict[str, Dict] | None = None):
+        if configuration is None:
+            configuration = get_configured_endpoints()
+        self.configuration = configuration
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._metrics: Dict[str, ConnectionMetrics] = {}
+
+    def _create_session(self, endpoint: str) -> requests.Session:
+        http = self.configuration.get(endpoint, HTTP_CONFIGURATION)
+        metrics = self._metrics[endpoint] = ConnectionMetrics()
+        adapter = _MetricsHTTPAdapter(
+            metrics=metrics,
+            pool_connections=http["pool_connections"],
+            pool_maxsize=http["pool_maxsize"],
+            max_retries=http["max_retries"],
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.hooks["response"].append(lambda response, *args, **kwargs: metrics.add_request())
+        return session
+
+    def get(self, url: str) -> requests.Session:
+        """Returns the shared session of the endpoint of the url"""
+        endpoint = get_endpoint(url)
+        with self._lock:
+            if endpoint not in self._sessions:
+                self._sessions[endpoint] = self._create_session(endpoint)
+            return self._sessions[endpoint]
+
+    def metrics(self) -> Dict[str, ConnectionMetrics]:
+        """Returns the connection metrics by endpoint"""
+        with self._lock:
+            return dict(self._metrics)
+
+    def close(self):
+        """Closes all sessions and their connections"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._metrics.clear()
+
+
+SESSION_POOL = SessionPool()
+
+
+class PooledEndpointClient(EndpointClient):
+    """An EndpointClient sending the requests of a remote tool via the pooled session of its
+    endpoint. Unlike `huggingface_hub.configure_http_backend` it does not affect other clients"""
+
+    # Source: transformers/tools/base.py
+    def __call__(self, inputs=None, params=None, data=None, output_image=False):
+        payload = {}
+        if inputs:
+            payload["inputs"] = inputs
+        if params:
+            payload["parameters"] = params
+
+        session = SESSION_POOL.get(self.endpoint_url)
+        response = session.post(self.endpoint_url, headers=self.headers, json=payload, data=data)
+
+        if output_image:
+            return self.decode_image(response.content)
+        return response.json()
+
+
+def use_pooled_sessions(tools: Dict[str, Any]) -> Dict[str, Any]:
+    """Makes the remote tools send their requests via the pooled sessions. Returns the tools"""
+    for tool in tools.values():
+        if isinstance(tool, RemoteTool) and not isinstance(tool.client, PooledEndpointClient):
+            client = PooledEndpointClient(tool.client.endpoint_url)
+            client.headers = tool.client.headers
+            tool.client = client
+    return tools
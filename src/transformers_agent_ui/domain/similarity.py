@@ -0,0 +1,123 @@
+"""The TaskIndex finds the cached tasks similar to a new task
+
+So that for example "Generate an image of a boat in the water" and
+"generate an image of a boat in water." can share a run.
+
+The tasks are normalized and represented by the MinHash signatures of their character n-grams.
+The similarity of two signatures estimates the Jaccard similarity of the n-grams. Everything is
+computed locally using NumPy.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from transformers_agent_ui.domain.store import BaseStore
+
+NGRAM = 3
+NUM_PERMUTATIONS = 128
+# Words not changing the meaning of a task
+STOP_WORDS = {"a", "an", "the", "please"}
+# A Mersenne prime. Used to permute the hashes of the n-grams
+_PRIME = np.uint64((1 << 31) - 1)
+# Signatures of 16 bit values halve the memory and time of a search. The chance of two different
+# values colliding is negligible
+_MAX_HASH = np.uint64((1 << 16) - 1)
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_task(task: str) -> str:
+    """Returns the task in lower case without punctuation, stop words and extra whitespace"""
+    words = _PUNCTUATION.sub(" ", task.lower()).split()
+    return " ".join(word for word in words if word not in STOP_WORDS)
+
+
+def get_ngrams(task: str, ngram: int = NGRAM) -> List[str]:
+    """Returns the character n-grams of the normalized task"""
+    text = f" {normalize_task(task)} "
+    return [text[index : index + ngram] for index in range(max(len(text) - ngram + 1, 1))]
+
+
+class TaskIndex:
+    """An index of the tasks of the runs, per agent and model, supporting similarity search
+
+    Args:
+        num_permutations: The length of the MinHash signatures. Longer signatures give more
+            accurate similarities but take more memory and time.
+        ngram: The number of characters of the n-grams
+        seed: The seed of the random permutations
+    """
+
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, ngram: int = NGRAM, seed=42):
+        self.ngram = ngram
+        random = np.random.default_rng(seed)
+        self._a = random.integers(1, _PRIME, size=num_permutations, dtype=np.uint64)
+        self._b = random.integers(0, _PRIME, size=num_permutations, dtype=np.uint64)
+        self._lock = threading.Lock()
+        # Per (agent, model): the tasks, the position of each task and the signatures
+        self._tasks: Dict[Tuple[str, str], List[str]] = {}
+        self._positions: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._signatures: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(tasks) for tasks in self._tasks.values())
+
+    def get_signature(self, task: str) -> np.ndarray:
+        """Returns the MinHash signature of the task"""
+        hashes = np.fromiter(
+            (zlib.crc32(ngram.encode()) for ngram in set(get_ngrams(task, self.ngram))),
+            dtype=np.uint64,
+        )
+        # a*x + b does not overflow as a, b and x are less than 2**31
+        hashes %= _PRIME
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint16)
+
+    def add(self, agent: str, model: str, task: str):
+        """Adds the task to the index"""
+        signature = self.get_signature(task)
+        key = (agent, model)
+        with self._lock:
+            positions = self._positions.setdefault(key, {})
+            if task in positions:
+                return
+            tasks = self._tasks.setdefault(key, [])
+            signatures = self._signatures.get(key)
+            if signatures is None:
+                signatures = np.empty((16, len(signature)), dtype=np.uint16)
+            elif len(tasks) == len(signatures):
+                # Doubling the capacity makes adding amortized O(1)
+                signatures = np.concatenate([signatures, np.empty_like(signatures)])
+            signatures[len(tasks)] = signature
+            self._signatures[key] = signatures
+            positions[task] = len(tasks)
+            tasks.append(task)
+
+    def search(self, agent: str, model: str, task: str) -> Optional[Tuple[str, float]]:
+        """Returns the most similar task of the agent and model and its similarity between 0 and
+        1. Returns None if the index has no tasks of the agent and model"""
+        key = (agent, model)
+        with self._lock:
+            tasks = self._tasks.get(key)
+            if not tasks:
+                return None
+            if task in self._positions[key]:
+                return task, 1.0
+            count = len(tasks)
+            signatures = self._signatures[key][:count]
+        signature = self.get_signature(task)
+        # Summing the booleans as bytes is faster than taking the mean
+        matches = (signatures == signature).view(np.uint8).sum(axis=1, dtype=np.uint16)
+        best = int(matches.argmax())
+        return tasks[best], float(matches[best]) / len(signature)
+
+    def update(self, store: BaseStore) -> "TaskIndex":
+        """Adds the tasks of the store. Does nothing if the store cannot list its tasks"""
+        for agent, model, task in store.iter_tasks():
+            self.add(agent, model, task)
+        return self
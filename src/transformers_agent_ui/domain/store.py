@@ -1,18 +1,32 @@
-"""The Store provides functionality to store the Runs and Assets"""
+"""The Store provides functionality to store the Runs and Assets
+
+The asset of a run is written to a temporary file that is renamed once complete, and only then is
+the row referring to it inserted. So a crash leaves at most an unreferenced file behind, never a
+row referring to a missing or partial file. See `fsck.py` for removing the leftovers.
+"""
 from __future__ import annotations
 
+import logging
+import os
 import sqlite3
+import threading
 import warnings
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from pathlib import Path
-from pickle import dump, load
-from typing import Dict
+from pickle import UnpicklingError, dump, load
+from typing import IO, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple
 from uuid import uuid4
 
+import numpy as np
 from PIL.Image import Image as PIL_Image
 from PIL.Image import open as open_pil_image
 
-# # pylint: disable=unused-argument
-# Remove this when we start supporting kwargs
+from transformers_agent_ui.domain.metrics import STORE_RUNS, STORE_SECONDS, STORE_WRITTEN_BYTES
+
+log = logging.getLogger(__name__)
+
 QUERY_CREATE_TABLE = """
 CREATE TABLE IF NOT EXISTS RESULTS (
 	time TEXT NOT NULL,
@@ -25,48 +39,335 @@ CREATE TABLE IF NOT EXISTS RESULTS (
     value TEXT NOT NULL
 )
 """
+QUERY_CREATE_TOOL_RESULTS_TABLE = """
+CREATE TABLE IF NOT EXISTS TOOL_RESULTS (
+    key TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    time TEXT NOT NULL,
+    accessed INTEGER NOT NULL,
+    value TEXT NOT NULL
+)
+"""
+QUERIES_CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS RESULTS_AGENT_MODEL_TASK ON RESULTS(agent, model, task, time)",
+    "CREATE INDEX IF NOT EXISTS RESULTS_AGENT_MODEL_TIME ON RESULTS(agent, model, time)",
+    "CREATE INDEX IF NOT EXISTS RESULTS_AGENT_TIME ON RESULTS(agent, time)",
+    "CREATE INDEX IF NOT EXISTS RESULTS_TIME ON RESULTS(time)",
+]
+# A full text search index of the tasks kept in sync with the RESULTS table via triggers
+QUERIES_CREATE_FTS = [
+    "CREATE VIRTUAL TABLE RESULTS_FTS USING fts5(task, content='RESULTS', content_rowid='rowid')",
+    """CREATE TRIGGER RESULTS_FTS_INSERT AFTER INSERT ON RESULTS BEGIN
+    INSERT INTO RESULTS_FTS(rowid, task) VALUES (new.rowid, new.task);
+END""",
+    """CREATE TRIGGER RESULTS_FTS_DELETE AFTER DELETE ON RESULTS BEGIN
+    INSERT INTO RESULTS_FTS(RESULTS_FTS, rowid, task) VALUES('delete', old.rowid, old.task);
+END""",
+    "INSERT INTO RESULTS_FTS(RESULTS_FTS) VALUES('rebuild')",
+]
 DB_NAME = "TransformersAgent.db"
+# The suffix of the files being written. They are renamed once complete
+TMP_SUFFIX = ".tmp"
+# The errors raised when reading a missing, partial or corrupt asset. numpy raises ValueErrors and
+# torch RuntimeErrors for corrupt files
+ASSET_ERRORS = (OSError, EOFError, UnpicklingError, ValueError, RuntimeError)
+# The position of the last run of a page of runs. Used to query the next page
+HistoryCursor = Tuple[str, int]
+# The columns added to the RESULTS table after its creation and their definition
+QUERIES_MIGRATE_RESULTS = {
+    "model_used": "ALTER TABLE RESULTS ADD COLUMN model_used TEXT NOT NULL DEFAULT ''",
+}
+RESULTS_COLUMNS = [
+    "time",
+    "agent",
+    "model",
+    "task",
+    "prompt",
+    "explanation",
+    "code",
+    "value",
+    "model_used",
+]
+HISTORY_COLUMNS = ["id"] + RESULTS_COLUMNS
+# The columns identifying a run
+_RUN_KEY_INDEXES = [RESULTS_COLUMNS.index(column) for column in ["time", "agent", "model", "task"]]
+MAX_TOOL_RESULTS = 1000
+# The maximum number of runs of a task tried by `read` if their assets cannot be read
+MAX_READ_ATTEMPTS = 5
+# A counter used to evict the least recently used tool results
+QUERY_NEXT_ACCESSED = "(SELECT IFNULL(MAX(accessed), 0) + 1 FROM TOOL_RESULTS)"
+
+
+def is_tensor(value) -> bool:
+    """Returns True if the value is a torch Tensor. Does not import torch"""
+    return type(value).__module__ == "torch" and type(value).__name__ == "Tensor"
+
+
+def get_suffix(value) -> str:
+    """Returns the file suffix used to store the value
+
+    Tensors and arrays are not pickled. So they are written without an in memory copy and read
+    memory-mapped"""
+    if isinstance(value, PIL_Image):
+        return ".png"
+    if is_tensor(value):
+        return ".pt"
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        return ".npy"
+    return ".pickle"
+
+
+def dump_value(value, file: IO[bytes]):
+    """Writes the value to the file in the format given by `get_suffix`"""
+    suffix = get_suffix(value)
+    if suffix == ".png":
+        value.save(file, format="PNG")
+    elif suffix == ".pt":
+        import torch  # pylint: disable=import-outside-toplevel
+
+        torch.save(value, file)
+    elif suffix == ".npy":
+        np.save(file, value, allow_pickle=False)
+    else:
+        dump(value, file)
+
+
+@contextmanager
+def atomic_write(path: Path) -> Iterator[IO[bytes]]:
+    """Returns a file to write the content of the path to
+
+    The content is written to a temporary file next to the path that replaces the path once
+    written and synced to disk. So the path is either missing or complete, even after a crash.
+    """
+    temporary_path = path.with_name(path.name + TMP_SUFFIX)
+    try:
+        with temporary_path.open("wb") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        temporary_path.replace(path)
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+
+
+def load_value(file: Path | IO[bytes], suffix: str):
+    """Returns the value read from the file
+
+    Images are decoded lazily. Tensors and arrays read from a path are memory-mapped copy-on-write,
+    so their pages are only read when used"""
+    if suffix == ".png":
+        return open_pil_image(file)
+    if suffix == ".pt":
+        import torch  # pylint: disable=import-outside-toplevel
+
+        if isinstance(file, Path):
+            return torch.load(file, map_location="cpu", mmap=True, weights_only=True)
+        return torch.load(file, map_location="cpu", weights_only=True)
+    if suffix == ".npy":
+        return np.load(file, mmap_mode="c" if isinstance(file, Path) else None, allow_pickle=False)
+    if suffix == ".pickle":
+        if isinstance(file, Path):
+            with file.open("rb") as opened_file:
+                return load(opened_file)  # nosec
+        return load(file)  # nosec
+    raise NotImplementedError()
+
+
+class BaseStore(ABC):
+    """The interface of a store for runs and tool results
+
+    The optional capabilities are flagged by `supports_query_runs`, i.e. `query_runs` and
+    `read_asset`, and `supports_iter_tasks`. Without them these methods return no runs.
+    """
+
+    supports_query_runs = False
+    supports_iter_tasks = False
 
+    def __init__(self):
+        self._single_flight_lock = threading.Lock()
+        # A lock is removed once no caller holds or waits for it
+        self._single_flight_locks: weakref.WeakValueDictionary[
+            Tuple[str, str, str], threading.Lock
+        ] = weakref.WeakValueDictionary()
+
+    @abstractmethod
+    def write(
+        self,
+        agent: str,
+        model: str,
+        task: str,
+        kwargs: Dict,
+        prompt: str,
+        explanation: str,
+        code: str,
+        value,
+        model_used: str = "",
+    ) -> str:
+        """Writes the run to the store. `model_used` is the model that generated the code
+
+        Returns the path of the value relative to the `asset_path`. "" if the values are not stored
+        as files.
+        """
+
+    @abstractmethod
+    def read(self, agent: str, model: str, task: str, kwargs: Dict) -> Dict:
+        """Reads the latest run from the store if it exists"""
+
+    @abstractmethod
+    def exists(self, agent: str, model: str, task: str, kwargs: Dict) -> bool:
+        """Returns True if a similar run exists"""
+
+    @abstractmethod
+    def delete(self, agent: str, model: str, task: str):
+        """Deletes all the runs specified"""
+
+    @abstractmethod
+    def read_tool_result(self, key: str):
+        """Returns the cached result of the tool call identified by the key or raises a KeyError"""
+
+    @abstractmethod
+    def write_tool_result(self, key: str, tool: str, value):
+        """Writes the result of the tool call identified by the key to the store"""
+
+    def query_runs(  # pylint: disable=too-many-arguments, unused-argument
+        self,
+        agent: str = "",
+        model: str = "",
+        start: str = "",
+        end: str = "",
+        search: str = "",
+        after: HistoryCursor | None = None,
+        limit: int = 20,
+    ) -> Tuple[List[Dict], Optional[HistoryCursor]]:
+        """Returns a page of runs, latest first, and the cursor of the next page if any
 
-class Store:
-    """A store for runs"""
+        The values are not read. Use `read_asset` to read the value of a run.
 
-    # Implemented as a LocalStore using SQLLite and Files
-    # Could later be implemented for example using S3 or Azure blob Storage
-    def __init__(self, path: str | Path = ".store"):
+        Args:
+            agent: Only runs of this agent if provided
+            model: Only runs of this model if provided
+            start: Only runs at or after this time if provided. For example `2023-05-20`
+            end: Only runs before this time if provided
+            search: Only runs with a task matching all the words if provided
+            after: The cursor returned with the previous page
+            limit: The maximum number of runs of the page
+        """
+        return [], None
+
+    def read_asset(self, path: str):
+        """Returns the value stored at the path as returned by `query_runs`"""
+        raise FileNotFoundError(path)
+
+    def get_asset(self, agent: str, model: str, task: str) -> str:
+        # pylint: disable=unused-argument
+        """Returns the path of the value of the latest run relative to the `asset_path`. "" if not
+        found or the values are not stored as files"""
+        return ""
+
+    def iter_tasks(self) -> Iterator[Tuple[str, str, str]]:
+        """Yields the distinct agent, model and task of the runs"""
+        yield from ()
+
+    @property
+    def asset_path(self) -> Optional[Path]:
+        """The directory of the files of the values returned by `query_runs`. None if the values
+        are not stored as files"""
+        return None
+
+    def single_flight(self, agent: str, model: str, task: str) -> ContextManager:
+        """Returns a lock ensuring that a run is only computed by one caller at a time
+
+        The lock is held while checking the store, running and writing the result. So other
+        callers will find the result in the store once they acquire the lock. The default
+        implementation only locks within the process.
+        """
+        with self._single_flight_lock:
+            lock = self._single_flight_locks.get((agent, model, task))
+            if lock is None:
+                lock = self._single_flight_locks[(agent, model, task)] = threading.Lock()
+            return lock
+
+
+class Store(BaseStore):
+    """A store for runs implemented using SQLite and files"""
+
+    supports_query_runs = True
+    supports_iter_tasks = True
+
+    def __init__(self, path: str | Path = ".store", max_tool_results: int = MAX_TOOL_RESULTS):
+        super().__init__()
         path = Path(path)
         path.mkdir(parents=True, exist_ok=True)
 
+        self._path = path
         self._db_path = path / DB_NAME
-        self._conn = sqlite3.connect(self._db_path)
+        # The tools may be run concurrently in a thread pool
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
         self._cursor = self._conn.cursor()
+        self._lock = threading.RLock()
+        self._full_text_search = False
         self._create_table()
+        self.max_tool_results = max_tool_results
 
         self._asset_path = path / "assets"
         self._asset_path.mkdir(parents=True, exist_ok=True)
+        self._metric_path = str(path)
+        STORE_RUNS.set(self._count_runs(), path=self._metric_path)
+
+    def _count_runs(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM RESULTS").fetchone()[0]
 
     def _create_table(self):
         self._conn.execute(QUERY_CREATE_TABLE)
+        self._migrate_table()
+        self._conn.execute(QUERY_CREATE_TOOL_RESULTS_TABLE)
+        for query in QUERIES_CREATE_INDEXES:
+            self._conn.execute(query)
+        self._create_full_text_search()
+
+    def _migrate_table(self):
+        """Adds the columns missing in a RESULTS table created by an earlier version"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(RESULTS)")}
+        with self._conn:
+            for column, query in QUERIES_MIGRATE_RESULTS.items():
+                if column not in columns:
+                    self._conn.execute(query)
+
+    def _create_full_text_search(self):
+        res = self._conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE name='RESULTS_FTS')"
+        )
+        self._full_text_search = bool(res.fetchone()[0])
+        if self._full_text_search:
+            return
+        try:
+            with self._conn:
+                for query in QUERIES_CREATE_FTS:
+                    self._conn.execute(query)
+        except sqlite3.OperationalError:
+            # SQLite was built without FTS5. We fall back to LIKE queries
+            return
+        self._full_text_search = True
 
     def _get_unique_path(self, value) -> str:
-        prefix = str(uuid4())
-        if isinstance(value, PIL_Image):
-            return prefix + ".png"
-        return prefix + ".pickle"
+        return str(uuid4()) + get_suffix(value)
 
-    def _write_value(self, value, path: str):
+    def _write_value(self, value, path: str, warn: bool = True):
         full_path = self._asset_path / path
-        if isinstance(value, PIL_Image):
-            value.save(full_path)
-        elif path.endswith(".pickle"):
-            with full_path.open("wb") as file:
-                dump(value, file)
+        with atomic_write(full_path) as file:
+            dump_value(value, file)
+            STORE_WRITTEN_BYTES.inc(file.tell(), path=self._metric_path)
+        if warn and path.endswith(".pickle"):
             message = f"Saved type {type(value)} as pickle file to {full_path}"
             warnings.warn(message)
-        else:
-            raise NotImplementedError()
 
-    def _write_to_db(
+    def _read_value(self, path: str):
+        full_path = self._asset_path / path
+        return load_value(full_path, full_path.suffix)
+
+    def _write_to_db(  # pylint: disable=unused-argument
         self,
         agent: str,
         model: str,
@@ -76,14 +377,16 @@ class Store:
         explanation: str,
         code: str,
         value: str,
+        model_used: str = "",
     ):
         parameters = [
-            (agent, model, task, prompt, explanation, code, value),
+            (agent, model, task, prompt, explanation, code, value, model_used),
         ]
-        self._cursor.executemany(
-            "INSERT INTO RESULTS VALUES(datetime('now'), ?, ?, ?, ?, ?, ?, ?)", parameters
-        )
-        self._conn.commit()
+        with self._lock, self._conn:
+            self._cursor.executemany(
+                "INSERT INTO RESULTS VALUES(datetime('now'), ?, ?, ?, ?, ?, ?, ?, ?)", parameters
+            )
+        STORE_RUNS.inc(len(parameters), path=self._metric_path)
 
     def write(
         self,
@@ -95,49 +398,306 @@ class Store:
         explanation: str,
         code: str,
         value,
-    ):
-        """Writes the run to the store"""
-        path = self._get_unique_path(value)
+        model_used: str = "",
+    ) -> str:
+        """Writes the run to the store. Returns the path of the value relative to `asset_path`"""
+        with STORE_SECONDS.time(agent=agent, model=model, operation="write"):
+            path = self._get_unique_path(value)
 
-        self._write_value(value, path)
-        self._write_to_db(agent, model, task, kwargs, prompt, explanation, code, value=path)
+            self._write_value(value, path)
+            try:
+                self._write_to_db(
+                    agent,
+                    model,
+                    task,
+                    kwargs,
+                    prompt,
+                    explanation,
+                    code,
+                    value=path,
+                    model_used=model_used,
+                )
+            except BaseException:
+                (self._asset_path / path).unlink(missing_ok=True)
+                raise
+        return path
 
     def read(self, agent: str, model: str, task: str, kwargs: Dict) -> Dict:
         """Reads the latest run from the store if it exists"""
-        res = self._cursor.execute(
-            """SELECT prompt, explanation, code, value FROM RESULTS where agent=? and model=? and \
-                task=? ORDER BY time DESC LIMIT 1""",
-            [agent, model, task],
-        )
-        result = res.fetchone()
-
-        if result:
-            prompt, explanation, code, path = result
-        else:
-            return {}
-
-        full_path = self._asset_path / path
+        with STORE_SECONDS.time(agent=agent, model=model, operation="read"):
+            return self._read(agent=agent, model=model, task=task)
 
-        if path.endswith(".png"):
-            value = open_pil_image(full_path)
-        elif path.endswith(".pickle"):
-            with full_path.open("rb") as file:
-                value = load(file)  # nosec
-        else:
-            raise NotImplementedError()
+    def _read(self, agent: str, model: str, task: str) -> Dict:
+        with self._lock:
+            res = self._cursor.execute(
+                """SELECT prompt, explanation, code, value, model_used FROM RESULTS where \
+                    agent=? and model=? and task=? ORDER BY time DESC""",
+                [agent, model, task],
+            )
+            results = res.fetchmany(MAX_READ_ATTEMPTS)
 
-        return {"prompt": prompt, "explanation": explanation, "code": code, "value": value}
+        # The asset of the latest run may be missing or corrupt. For example if it was removed by
+        # hand. Then an earlier run is read. `fsck.py` drops such runs
+        for prompt, explanation, code, path, model_used in results:
+            try:
+                value = self._read_value(path)
+            except ASSET_ERRORS as exc:
+                log.warning("Skipped the run with the unreadable asset %s: %s", path, exc)
+                continue
+            return {
+                "prompt": prompt,
+                "explanation": explanation,
+                "code": code,
+                "value": value,
+                "model_used": model_used,
+            }
+        return {}
 
     def exists(self, agent: str, model: str, task: str, kwargs: Dict) -> bool:
         """Returns True if a similar run exists"""
         sql = """SELECT EXISTS(SELECT 1 FROM RESULTS WHERE agent=? and model=? \
             and task=?);"""
-        res = self._cursor.execute(sql, [agent, model, task])
-        value = res.fetchone()[0]
+        with STORE_SECONDS.time(agent=agent, model=model, operation="exists"), self._lock:
+            res = self._cursor.execute(sql, [agent, model, task])
+            value = res.fetchone()[0]
         return bool(value)
 
     def delete(self, agent: str, model: str, task: str):
-        """Deletes all the runs specified"""
-        sql = "DELETE FROM RESULTS WHERE agent=? and model=? and task=?"
-        self._cursor.execute(sql, [agent, model, task])
-        self._conn.commit()
+        """Deletes all the runs specified and their assets"""
+        condition = "agent=? and model=? and task=?"
+        with self._lock:
+            with self._conn:
+                res = self._cursor.execute(
+                    f"SELECT DISTINCT value FROM RESULTS WHERE {condition}",  # nosec
+                    [agent, model, task],
+                )
+                paths = [path for (path,) in res.fetchall()]
+                self._cursor.execute(
+                    f"DELETE FROM RESULTS WHERE {condition}", [agent, model, task]  # nosec
+                )
+                deleted = self._cursor.rowcount
+                # The assets may be shared by runs imported via `transfer.py`
+                res = self._cursor.execute(
+                    f"SELECT DISTINCT value FROM RESULTS WHERE value IN "  # nosec
+                    f"({', '.join('?' * len(paths))})",
+                    paths,
+                )
+                shared = {path for (path,) in res.fetchall()}
+        # Removed once the deletion is committed. A crash in between leaves files `fsck.py` removes
+        for path in paths:
+            if path not in shared:
+                (self._asset_path / path).unlink(missing_ok=True)
+        STORE_RUNS.inc(-deleted, path=self._metric_path)
+
+    def _get_query_conditions(  # pylint: disable=too-many-arguments
+        self,
+        agent: str,
+        model: str,
+        start: str,
+        end: str,
+        search: str,
+        after: HistoryCursor | None,
+    ) -> Tuple[List[str], List]:
+        conditions = []
+        parameters: List = []
+        for condition, parameter in [
+            ("agent=?", agent),
+            ("model=?", model),
+            ("time>=?", start),
+            ("time<?", end),
+        ]:
+            if parameter:
+                conditions.append(condition)
+                parameters.append(parameter)
+        if search:
+            if self._full_text_search:
+                # Quoting the words avoids interpreting them as FTS5 operators
+                words = " ".join(f'"{word}"' for word in search.replace('"', " ").split())
+                conditions.append(
+                    "rowid IN (SELECT rowid FROM RESULTS_FTS WHERE RESULTS_FTS MATCH ?)"
+                )
+                parameters.append(words)
+            else:
+                for word in search.split():
+                    conditions.append("task LIKE ?")
+                    parameters.append(f"%{word}%")
+        if after:
+            conditions.append("(time, rowid) < (?, ?)")
+            parameters.extend(after)
+
+        return conditions, parameters
+
+    def query_runs(  # pylint: disable=too-many-arguments
+        self,
+        agent: str = "",
+        model: str = "",
+        start: str = "",
+        end: str = "",
+        search: str = "",
+        after: HistoryCursor | None = None,
+        limit: int = 20,
+    ) -> Tuple[List[Dict], Optional[HistoryCursor]]:
+        conditions, parameters = self._get_query_conditions(
+            agent=agent, model=model, start=start, end=end, search=search, after=after
+        )
+        where = " AND ".join(conditions) or "1"
+        sql = f"""SELECT rowid, {", ".join(HISTORY_COLUMNS[1:])} FROM RESULTS WHERE {where} \
+            ORDER BY time DESC, rowid DESC LIMIT ?"""  # nosec
+        with self._lock:
+            res = self._cursor.execute(sql, parameters + [limit + 1])
+            rows = res.fetchall()
+
+        runs = [dict(zip(HISTORY_COLUMNS, row)) for row in rows[:limit]]
+        if len(rows) > limit:
+            return runs, (runs[-1]["time"], runs[-1]["id"])
+        return runs, None
+
+    def read_asset(self, path: str):
+        return self._read_value(path)
+
+    def get_asset(self, agent: str, model: str, task: str) -> str:
+        with self._lock:
+            res = self._cursor.execute(
+                """SELECT value FROM RESULTS where agent=? and model=? and task=? \
+                    ORDER BY time DESC LIMIT 1""",
+                [agent, model, task],
+            )
+            row = res.fetchone()
+        return row[0] if row else ""
+
+    def iter_tasks(self) -> Iterator[Tuple[str, str, str]]:
+        conn = sqlite3.connect(self._db_path)
+        try:
+            yield from conn.execute("SELECT DISTINCT agent, model, task FROM RESULTS")
+        finally:
+            conn.close()
+
+    @property
+    def asset_path(self) -> Path:
+        """The directory of the assets, i.e. the values of the runs"""
+        return self._asset_path
+
+    @property
+    def path(self) -> Path:
+        """The directory of the store"""
+        return self._path
+
+    @property
+    def db_path(self) -> Path:
+        """The SQLite DB of the runs and tool results"""
+        return self._db_path
+
+    def iter_rows(self, chunk_size: int = 1000) -> Iterator[List[Tuple]]:
+        """Yields the rows of the RESULTS table, in the order of `RESULTS_COLUMNS`, in chunks
+
+        Uses its own connection, so that writes are not blocked while iterating.
+        """
+        conn = sqlite3.connect(self._db_path)
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(RESULTS_COLUMNS)} FROM RESULTS ORDER BY rowid"  # nosec
+            )
+            while chunk := cursor.fetchmany(chunk_size):
+                yield chunk
+        finally:
+            conn.close()
+
+    def get_new_rows(self, rows: List[Tuple]) -> List[Tuple]:
+        """Returns the rows, in the order of `RESULTS_COLUMNS`, that are not in the store yet
+
+        A run is identified by its time, agent, model and task. The duplicates within the rows are
+        dropped too.
+        """
+        keys = set()
+        new_rows = []
+        with self._lock:
+            for row in rows:
+                key = tuple(row[index] for index in _RUN_KEY_INDEXES)
+                if key in keys:
+                    continue
+                keys.add(key)
+                res = self._cursor.execute(
+                    "SELECT EXISTS(SELECT 1 FROM RESULTS WHERE time=? AND agent=? AND model=? "
+                    "AND task=?)",
+                    key,
+                )
+                if not res.fetchone()[0]:
+                    new_rows.append(row)
+        return new_rows
+
+    def insert_rows(self, chunks: Iterable[List[Tuple]]) -> int:
+        """Inserts the chunks of rows, in the order of `RESULTS_COLUMNS`, in a single transaction
+
+        The runs already in the store are skipped, see `get_new_rows`. So importing the same runs
+        again does not duplicate them. Returns the number of rows inserted. The assets referred to
+        must be in the `asset_path`.
+        """
+        count = 0
+        with self._lock:
+            try:
+                for chunk in chunks:
+                    # Also skips the rows inserted by the previous chunks of the transaction
+                    rows = self.get_new_rows(chunk)
+                    self._cursor.executemany(
+                        "INSERT INTO RESULTS VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                    )
+                    count += len(rows)
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+        STORE_RUNS.inc(count, path=self._metric_path)
+        return count
+
+    def read_tool_result(self, key: str):
+        """Returns the cached result of the tool call identified by the key or raises a KeyError"""
+        with self._lock:
+            res = self._cursor.execute("SELECT value FROM TOOL_RESULTS WHERE key=?", [key])
+            result = res.fetchone()
+            if not result:
+                raise KeyError(key)
+            self._cursor.execute(
+                f"UPDATE TOOL_RESULTS SET accessed={QUERY_NEXT_ACCESSED} WHERE key=?", [key]
+            )
+            self._conn.commit()
+        try:
+            return self._read_value(result[0])
+        except ASSET_ERRORS as exc:
+            # Computed again like a cache miss
+            log.warning("Skipped the tool result with the unreadable asset %s: %s", result[0], exc)
+            raise KeyError(key) from exc
+
+    def write_tool_result(self, key: str, tool: str, value):
+        """Writes the result of the tool call identified by the key to the store
+
+        The least recently used results are evicted when there are more than `max_tool_results`.
+        """
+        path = self._get_unique_path(value)
+        self._write_value(value, path, warn=False)
+        with self._lock, self._conn:
+            res = self._cursor.execute("SELECT value FROM TOOL_RESULTS WHERE key=?", [key])
+            replaced = res.fetchone()
+            self._cursor.execute(
+                f"""INSERT OR REPLACE INTO TOOL_RESULTS VALUES(?, ?, datetime('now'), \
+                    {QUERY_NEXT_ACCESSED}, ?)""",
+                [key, tool, path],
+            )
+        if replaced and replaced[0] != path:
+            (self._asset_path / replaced[0]).unlink(missing_ok=True)
+        self._evict_tool_results()
+
+    def _evict_tool_results(self):
+        with self._lock:
+            res = self._cursor.execute(
+                "SELECT key, value FROM TOOL_RESULTS ORDER BY accessed DESC LIMIT -1 OFFSET ?",
+                [self.max_tool_results],
+            )
+            evicted = res.fetchall()
+            if not evicted:
+                return
+            with self._conn:
+                self._cursor.executemany(
+                    "DELETE FROM TOOL_RESULTS WHERE key=?", [(key,) for key, _ in evicted]
+                )
+        for _, path in evicted:
+            (self._asset_path / path).unlink(missing_ok=True)
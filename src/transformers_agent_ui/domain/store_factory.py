@@ -0,0 +1,59 @@
+"""Creates the Store configured via an url
+
+- `memory://`: An InMemoryStore
+- `redis://localhost:6379/0?assets=/shared/assets`: A RedisStore shared across processes
+- `s3://bucket/prefix/`: An S3Store
+- Any other value is the path of a local Store. Defaults to `.store`.
+
+The url can be provided via the `TRANSFORMERS_AGENT_UI_STORE` environment variable.
+
+The default store is shared by all sessions of the process. It keeps the runs of the most
+recently used tasks in memory. Their number can be set via the
+`TRANSFORMERS_AGENT_UI_MEMORY_CACHE_SIZE` environment variable. 0 disables the memory layer.
+"""
+from __future__ import annotations
+
+import os
+from functools import cache
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+from transformers_agent_ui.domain.memory_store import MAX_RUNS, CachedStore, InMemoryStore
+from transformers_agent_ui.domain.store import BaseStore, Store
+
+STORE_ENV_VALUE = "TRANSFORMERS_AGENT_UI_STORE"
+MEMORY_CACHE_SIZE_ENV_VALUE = "TRANSFORMERS_AGENT_UI_MEMORY_CACHE_SIZE"
+DEFAULT_STORE = ".store"
+
+
+def create_store(url: str | None = None) -> BaseStore:
+    """Returns a new Store created from the url or the `TRANSFORMERS_AGENT_UI_STORE` environment
+    variable"""
+    # pylint: disable=import-outside-toplevel
+    if url is None:
+        url = os.getenv(STORE_ENV_VALUE, "") or DEFAULT_STORE
+    parts = urlsplit(url)
+
+    if parts.scheme == "memory":
+        return InMemoryStore()
+    if parts.scheme in ("redis", "rediss"):
+        from transformers_agent_ui.domain.redis_store import RedisStore
+
+        query = parse_qs(parts.query)
+        asset_path = query.pop("assets", [".store/assets"])[0]
+        redis_url = urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+        return RedisStore(url=redis_url, asset_path=asset_path)
+    if parts.scheme == "s3":
+        from transformers_agent_ui.domain.s3_store import S3Store
+
+        return S3Store(bucket=parts.netloc, prefix=parts.path.lstrip("/"))
+    return Store(path=url)
+
+
+@cache
+def get_default_store() -> BaseStore:
+    """Returns the store shared by all sessions of the process"""
+    store = create_store()
+    max_runs = int(os.getenv(MEMORY_CACHE_SIZE_ENV_VALUE, "") or MAX_RUNS)
+    if max_runs > 0:
+        return CachedStore(store, max_runs=max_runs)
+    return store
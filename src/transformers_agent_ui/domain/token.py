@@ -1,16 +1,159 @@
-"""The TokenManager enables you to manage your API tokens"""
+"""The TokenManager enables you to manage your API tokens
+
+The tokens are resolved per session by the TokenManager and else by a TokenProvider shared by all
+sessions:
+
+- `EnvTokenProvider`: From the `HUGGING_FACE_TOKEN` and `OPEN_AI_TOKEN` environment variables.
+- `FileTokenProvider`: From files named like the environment variables in a directory. For example
+the `/run/secrets` directory of Docker or Kubernetes secrets.
+- `CachedTokenProvider`: Caches the lookups of another provider for some time.
+- `ChainTokenProvider`: Returns the token of the first provider providing one.
+
+The agents are shared by the sessions. The token of a request is set via `use_token`.
+"""
+# pylint: disable=too-few-public-methods
+from __future__ import annotations
+
 import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+from pathlib import Path
+from typing import Dict, Iterator, Sequence, Tuple
 
 import param
 
 HUGGING_FACE_ENV_VALUE = "HUGGING_FACE_TOKEN"
 OPEN_AI_ENV_VALUE = "OPEN_AI_TOKEN"
+TOKEN_DIR_ENV_VALUE = "TRANSFORMERS_AGENT_UI_TOKEN_DIR"
+# The environment variables, and file names, of the tokens of the agents
+TOKEN_ENV_VALUES = {"HuggingFace": HUGGING_FACE_ENV_VALUE, "OpenAI": OPEN_AI_ENV_VALUE}
+# The parameters of the TokenManager holding the tokens of the session
+TOKEN_PARAMETERS = {"HuggingFace": "hugging_face", "OpenAI": "open_ai"}
+# Seconds
+TOKEN_CACHE_TTL = 300
+
+_request_token: ContextVar[str] = ContextVar("request_token", default="")
+
+
+@contextmanager
+def use_token(token: str) -> Iterator[None]:
+    """Sets the token used by the requests of the shared agents in the current thread or task"""
+    reset_token = _request_token.set(token)
+    try:
+        yield
+    finally:
+        _request_token.reset(reset_token)
+
+
+def get_request_token() -> str:
+    """Returns the token set by `use_token` or "" if none"""
+    return _request_token.get()
+
+
+class TokenProvider(ABC):
+    """Provides the tokens of the agents"""
+
+    @abstractmethod
+    def get(self, agent: str) -> str:
+        """Returns the token of the agent or "" if none"""
+
+
+class EnvTokenProvider(TokenProvider):
+    """Provides the tokens from environment variables"""
+
+    def __init__(self, env_values: Dict[str, str] | None = None):
+        self.env_values = TOKEN_ENV_VALUES if env_values is None else env_values
+
+    def get(self, agent: str) -> str:
+        if agent not in self.env_values:
+            return ""
+        return os.getenv(self.env_values[agent], "")
+
+
+class FileTokenProvider(TokenProvider):
+    """Provides the tokens from files in a directory. For example Docker or Kubernetes secrets
+
+    The files are named like the environment variables. For example `HUGGING_FACE_TOKEN`.
+    """
+
+    def __init__(self, path: str | Path, file_names: Dict[str, str] | None = None):
+        self.path = Path(path)
+        self.file_names = TOKEN_ENV_VALUES if file_names is None else file_names
+
+    def get(self, agent: str) -> str:
+        if agent not in self.file_names:
+            return ""
+        try:
+            return (self.path / self.file_names[agent]).read_text(encoding="utf8").strip()
+        except FileNotFoundError:
+            return ""
+
+
+class CachedTokenProvider(TokenProvider):
+    """Caches the tokens of another provider for `ttl` seconds
+
+    Avoids reading the files or secret stores on every run while still picking up rotated tokens.
+    """
+
+    def __init__(self, provider: TokenProvider, ttl: float = TOKEN_CACHE_TTL):
+        self.provider = provider
+        self.ttl = ttl
+        self._tokens: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, agent: str) -> str:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._tokens.get(agent)
+        if cached and now - cached[0] < self.ttl:
+            return cached[1]
+        token = self.provider.get(agent)
+        with self._lock:
+            self._tokens[agent] = (now, token)
+        return token
+
+    def clear(self):
+        """Removes the cached tokens"""
+        with self._lock:
+            self._tokens.clear()
+
+
+class ChainTokenProvider(TokenProvider):
+    """Returns the token of the first provider providing one"""
+
+    def __init__(self, providers: Sequence[TokenProvider]):
+        self.providers = list(providers)
+
+    def get(self, agent: str) -> str:
+        for provider in self.providers:
+            token = provider.get(agent)
+            if token:
+                return token
+        return ""
+
+
+@cache
+def get_default_token_provider() -> TokenProvider:
+    """Returns the provider shared by all sessions
+
+    Provides the tokens from the environment variables and else from the files in the directory of
+    the `TRANSFORMERS_AGENT_UI_TOKEN_DIR` environment variable if set.
+    """
+    providers: list[TokenProvider] = [EnvTokenProvider()]
+    if os.getenv(TOKEN_DIR_ENV_VALUE):
+        providers.append(CachedTokenProvider(FileTokenProvider(os.environ[TOKEN_DIR_ENV_VALUE])))
+    return ChainTokenProvider(providers)
 
 
 class TokenManager(param.Parameterized):
-    """The TokenManager enables you to manage your API tokens
+    """The TokenManager enables you to manage the API tokens of a session
 
-    Either via environment variables or by setting the parameter values
+    Either via the `provider`, by default the environment variables, or by setting the parameter
+    values
     """
 
     hugging_face = param.String(doc="A token for the Hugging Face API", label="Hugging Face")
@@ -34,11 +177,19 @@ class TokenManager(param.Parameterized):
         constant=True, precedence=-1, label=f"{OPEN_AI_ENV_VALUE} is set"
     )
 
+    provider: TokenProvider = param.ClassSelector(
+        class_=TokenProvider,
+        precedence=-1,
+        doc="Provides the tokens not set for the session. Shared by the sessions",
+    )
+
     def __init__(self, **params):
-        params["hugging_face_env_value"] = os.getenv(HUGGING_FACE_ENV_VALUE, "")
+        if "provider" not in params:
+            params["provider"] = get_default_token_provider()
+        params["hugging_face_env_value"] = params["provider"].get("HuggingFace")
         params["hugging_face_env_exists"] = bool(params["hugging_face_env_value"])
 
-        params["open_ai_env_value"] = os.getenv(OPEN_AI_ENV_VALUE, "")
+        params["open_ai_env_value"] = params["provider"].get("OpenAI")
         params["open_ai_env_exists"] = bool(params["open_ai_env_value"])
 
         super().__init__(**params)
@@ -47,17 +198,9 @@ class TokenManager(param.Parameterized):
         """Returns the token of the agent
 
         If a value for the given agent is set then it is returned.
-        If the environment value for the given agent is set then it is returned
+        If the `provider` provides a token for the given agent then it is returned
         Else "" is returned
         """
-        if agent == "HuggingFace":
-            value = self.hugging_face
-            env = self.hugging_face_env_value
-        elif agent == "OpenAI":
-            value = self.open_ai
-            env = self.open_ai_env_value
-        else:
-            value = ""
-            env = ""
-
-        return value or env
+        if agent in TOKEN_PARAMETERS and getattr(self, TOKEN_PARAMETERS[agent]):
+            return getattr(self, TOKEN_PARAMETERS[agent])
+        return self.provider.get(agent)
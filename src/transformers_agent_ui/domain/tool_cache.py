@@ -0,0 +1,66 @@
+"""Provides a cache of the results of the tools used by the agent
+
+The same tool calls, for example captioning the `boat_image`, are often repeated across different
+tasks. By caching the results of the tool calls in the Store we can reuse them.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Callable, Dict
+
+from transformers_agent_ui.domain.hashing import get_hash
+from transformers_agent_ui.domain.metrics import STORE_SECONDS, TOOL_CACHE_HITS, ToolWrapper
+from transformers_agent_ui.domain.store import BaseStore
+
+log = logging.getLogger(__name__)
+
+
+def get_tool_call_key(name: str, args, kwargs) -> str:
+    """Returns a key identifying the tool call by the name and the content of the arguments"""
+    return get_hash((name, args, kwargs))
+
+
+class CachedTool(ToolWrapper):
+    """A memoizing wrapper of a tool backed by a Store
+
+    The durations of the reads and writes of the Store are observed here, as the key of a tool
+    call does not identify the agent and model of the run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        tool: Callable,
+        store: BaseStore,
+        metric_labels: Dict[str, str] | None = None,
+    ):
+        super().__init__(name, tool, metric_labels)
+        self.store = store
+
+    def __call__(self, *args, **kwargs):
+        key = get_tool_call_key(self.name, args, kwargs)
+        try:
+            with STORE_SECONDS.time(operation="read_tool_result", **self.metric_labels):
+                value = self.store.read_tool_result(key)
+        except KeyError:
+            pass
+        else:
+            TOOL_CACHE_HITS.inc(tool=self.name, **self.metric_labels)
+            log.info("Tool cache hit for tool='%s'", self.name)
+            return value
+
+        value = self.tool(*args, **kwargs)
+        if value is not None:
+            with STORE_SECONDS.time(operation="write_tool_result", **self.metric_labels):
+                self.store.write_tool_result(key=key, tool=self.name, value=value)
+        return value
+
+
+def cache_tools(
+    tools: Dict[str, Callable], store: BaseStore, metric_labels: Dict[str, str] | None = None
+) -> Dict[str, Callable]:
+    """Returns a copy of the tools where the tools of the agent are wrapped in a CachedTool
+
+    The basic python tools like `print` are not wrapped.
+    """
+    return CachedTool.wrap_tools(tools, metric_labels, store=store)
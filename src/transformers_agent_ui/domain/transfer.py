@@ -0,0 +1,179 @@
+"""Export and import of the runs of a Store
+
+Enables shipping a pre-warmed cache to new nodes. The archive is a tar file containing
+
+- `results.parquet`: The rows of the RESULTS table
+- `assets/<sha256><suffix>`: The values of the runs. Content addressed, so each is stored once.
+
+The rows are processed in chunks, so memory usage is bounded by the chunk size. Requires
+`pyarrow`.
+
+Usage:
+
+```bash
+python -m transformers_agent_ui.domain.transfer export .store cache.tar
+python -m transformers_agent_ui.domain.transfer import cache.tar .store
+```
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Iterator, List, Set, Tuple
+
+from transformers_agent_ui.domain.store import RESULTS_COLUMNS, Store, atomic_write
+
+log = logging.getLogger(__name__)
+
+RESULTS_NAME = "results.parquet"
+ASSETS_PREFIX = "assets/"
+CHUNK_SIZE = 1000
+
+
+def _import_pyarrow():
+    try:
+        # pylint: disable=import-outside-toplevel
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError(
+            "Export and import of runs requires pyarrow: `pip install pyarrow`."
+        ) from exc
+    return pa, pq
+
+
+def get_content_address(path: Path) -> str:
+    """Returns the name of the asset in the archive: The sha256 of its content and its suffix"""
+    hasher = hashlib.sha256()
+    with path.open("rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest() + path.suffix
+
+
+def _add_assets(
+    archive: tarfile.TarFile, store: Store, chunk: List[Tuple], added: Set[str]
+) -> List[Tuple]:
+    """Adds the assets of the rows to the archive if not already added. Returns the rows with the
+    value referring to the content address of the asset"""
+    value_index = RESULTS_COLUMNS.index("value")
+    rows = []
+    for row in chunk:
+        asset = store.asset_path / row[value_index]
+        if not asset.exists():
+            log.warning("Skipped run with missing asset %s", asset)
+            continue
+        name = get_content_address(asset)
+        if name not in added:
+            archive.add(asset, arcname=ASSETS_PREFIX + name)
+            added.add(name)
+        rows.append(row[:value_index] + (name,) + row[value_index + 1 :])
+    return rows
+
+
+def export_runs(store: Store, path: str | Path, chunk_size: int = CHUNK_SIZE) -> int:
+    """Exports the runs of the store to a tar archive at the path. Returns the number of runs
+
+    Runs with a missing asset are skipped.
+    """
+    pa, pq = _import_pyarrow()
+    schema = pa.schema([(column, pa.string()) for column in RESULTS_COLUMNS])
+    added: Set[str] = set()
+    count = 0
+
+    with tempfile.TemporaryDirectory() as directory, tarfile.open(path, "w") as archive:
+        results_path = Path(directory) / RESULTS_NAME
+        with pq.ParquetWriter(results_path, schema) as writer:
+            for chunk in store.iter_rows(chunk_size=chunk_size):
+                rows = _add_assets(archive, store, chunk, added)
+                if rows:
+                    arrays = [pa.array(column) for column in zip(*rows)]
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+                    count += len(rows)
+        archive.add(results_path, arcname=RESULTS_NAME)
+    log.info("Exported %s runs and %s assets to %s", count, len(added), path)
+    return count
+
+
+def _extract(archive: tarfile.TarFile, name: str, target: Path):
+    """Extracts the member of the archive to the target via a temporary file"""
+    source = archive.extractfile(name)
+    if source is None:
+        raise ValueError(f"{name} is missing in the archive")
+    with source, atomic_write(target) as file:
+        shutil.copyfileobj(source, file)
+
+
+def _check_asset_name(name: str):
+    """Raises a ValueError if the name is not a bare file name. So a crafted archive cannot write
+    outside of the store"""
+    if name in ("", ".", "..") or "/" in name or "\\" in name or "\0" in name:
+        raise ValueError(f"Invalid asset name {name!r} in the archive")
+
+
+def _iter_chunks(
+    archive: tarfile.TarFile, results_path: Path, store: Store, chunk_size: int
+) -> Iterator[List[Tuple]]:
+    """Yields the rows of the results in chunks after extracting their assets to the store"""
+    _, pq = _import_pyarrow()
+    value_index = RESULTS_COLUMNS.index("value")
+    file = pq.ParquetFile(results_path)
+    # Archives exported by earlier versions miss the columns added since. They default to ""
+    names = [column for column in RESULTS_COLUMNS if column in file.schema_arrow.names]
+    for batch in file.iter_batches(batch_size=chunk_size, columns=names):
+        columns = [
+            batch.column(column).to_pylist() if column in names else [""] * batch.num_rows
+            for column in RESULTS_COLUMNS
+        ]
+        # The runs already in the store are skipped. So their assets are not extracted
+        rows = store.get_new_rows(list(zip(*columns)))
+        for name in {row[value_index] for row in rows}:
+            _check_asset_name(name)
+            target = store.asset_path / name
+            if not target.exists():
+                _extract(archive, ASSETS_PREFIX + name, target)
+        yield rows
+
+
+def import_runs(store: Store, path: str | Path, chunk_size: int = CHUNK_SIZE) -> int:
+    """Imports the runs of the tar archive at the path into the store. Returns the number of runs
+
+    The runs are inserted in a single transaction. So either all or none of them are imported. The
+    runs already in the store are skipped.
+    """
+    with tempfile.TemporaryDirectory() as directory, tarfile.open(path, "r") as archive:
+        results_path = Path(directory) / RESULTS_NAME
+        _extract(archive, RESULTS_NAME, results_path)
+        count = store.insert_rows(_iter_chunks(archive, results_path, store, chunk_size))
+    log.info("Imported %s runs from %s", count, path)
+    return count
+
+
+def main():
+    """Runs the export or import from the command line"""
+    parser = argparse.ArgumentParser(description="Export or import the runs of a Store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export the runs of a store to a file")
+    export_parser.add_argument("store")
+    export_parser.add_argument("file")
+    import_parser = subparsers.add_parser("import", help="Import the runs of a file to a store")
+    import_parser.add_argument("file")
+    import_parser.add_argument("store")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = Store(path=args.store)
+    if args.command == "export":
+        export_runs(store, args.file, chunk_size=args.chunk_size)
+    else:
+        import_runs(store, args.file, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Provides the ValueHandle showing the value of a run without extra copies of it
+
+The values of the runs can be large images, audio tensors and arrays. A ValueHandle does each
+conversion of its value for display once, without intermediate copies, and caches it. So the value
+is not converted again every time the view is updated.
+
+The values read from a Store are not materialized up front. An image read from the cache is shown
+from its PNG file without decoding it, and its tensors and arrays are memory-mapped from disk.
+"""
+from __future__ import annotations
+
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+from PIL.Image import Image as PIL_Image
+
+from transformers_agent_ui.domain.store import is_tensor
+
+
+def to_pcm16(value) -> np.ndarray:
+    """Returns the float32 audio tensor or array as 16 bit PCM samples. Other arrays are returned
+    as is
+
+    Only the result is allocated. The samples are not copied to an intermediate float array."""
+    if is_tensor(value):
+        # Shares the memory of the tensor on the CPU
+        value = value.detach().cpu().numpy()
+    if value.dtype != np.float32:
+        return value
+    pcm = np.empty(value.shape, dtype=np.int16)
+    np.multiply(value, 32768.0, out=pcm, casting="unsafe")
+    return pcm
+
+
+def get_file_path(value) -> Optional[Path]:
+    """Returns the PNG file of an image read lazily from a file. None for any other value"""
+    if isinstance(value, PIL_Image) and value.format == "PNG":
+        filename = getattr(value, "filename", "")
+        if filename:
+            return Path(filename)
+    return None
+
+
+class ValueHandle:
+    """A handle to the value of a run. Caches the conversions of the value
+
+    Args:
+        value: The value
+        path: The PNG file of the image, if read lazily from one. Shown without decoding it
+    """
+
+    def __init__(self, value: Any, path: str | Path | None = None):
+        self.value = value
+        self.path = None if path is None else Path(path)
+        self._conversions: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_value(cls, value: Any) -> ValueHandle:
+        """Returns a handle to the value. Refers to the file of an image read lazily from one"""
+        return cls(value, path=get_file_path(value))
+
+    def refers_to(self, value: Any) -> bool:
+        """Returns True if the handle is a handle to the value"""
+        return self.value is value
+
+    def convert(self, name: str, function: Callable[[Any], Any]) -> Any:
+        """Returns the value converted by the function. Converted once and cached by name"""
+        with self._lock:
+            if name not in self._conversions:
+                self._conversions[name] = function(self.value)
+            return self._conversions[name]
+
+    def to_pcm16(self) -> np.ndarray:
+        """Returns the audio as 16 bit PCM samples. See `to_pcm16`"""
+        return self.convert("pcm16", to_pcm16)
+
+    def to_png(self) -> bytes:
+        """Returns the image encoded as PNG. Read as is from its PNG file if it has one"""
+        with self._lock:
+            if "png" not in self._conversions and self.path is not None:
+                if self.path.suffix == ".png":
+                    try:
+                        self._conversions["png"] = self.path.read_bytes()
+                    except OSError:
+                        # For example removed since. The image may still be read via its value
+                        pass
+        return self.convert("png", _encode_png)
+
+
+def _encode_png(image: PIL_Image) -> bytes:
+    file = BytesIO()
+    image.save(file, format="PNG")
+    return file.getvalue()
@@ -0,0 +1,117 @@
+"""Pre-warms the cache by running the examples in the background
+
+So the first users of a new deployment do not have to wait for the agents.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION, DEFAULT_AGENT
+from transformers_agent_ui.domain.examples import EXAMPLES
+from transformers_agent_ui.domain.executor import RateLimiter, get_executor
+from transformers_agent_ui.domain.local_tools import preload_local_tools
+from transformers_agent_ui.domain.logs import configure_logging
+from transformers_agent_ui.domain.run import TaskInput
+from transformers_agent_ui.domain.store import BaseStore
+from transformers_agent_ui.domain.store_factory import get_default_store
+
+log = logging.getLogger(__name__)
+
+WARM_UP_ENV_VALUE = "TRANSFORMERS_AGENT_UI_WARM_UP"
+# The default number of runs per second. To stay below the rate limits of the inference endpoints
+RATE = 0.2
+
+_lock = threading.Lock()
+_futures: List[Future] = []
+
+
+def is_warm_up_enabled() -> bool:
+    """Returns True if the warm up is enabled via the `TRANSFORMERS_AGENT_UI_WARM_UP` environment
+    variable"""
+    return os.getenv(WARM_UP_ENV_VALUE, "").lower() in ("1", "true", "yes")
+
+
+def warm_up(  # pylint: disable=too-many-arguments
+    examples: Sequence[TaskInput] = tuple(EXAMPLES),
+    agents: Sequence[Tuple[str, str]] | None = None,
+    store: BaseStore | None = None,
+    executor: Executor | None = None,
+    rate_limiter: RateLimiter | None = None,
+    create_agent: Callable[..., TransformersAgent] = TransformersAgent,
+) -> List[Future]:
+    """Runs the examples in the background to populate the store. Returns the futures of the runs
+
+    Args:
+        examples: The examples to run
+        agents: The agent and model pairs to run the examples with. Defaults to the default model
+            of the default agent.
+        store: The store to populate. Defaults to the store shared by the sessions.
+        executor: Defaults to the executor shared by the process
+        rate_limiter: Limits the rate of the runs not found in the store
+        create_agent: Creates the TransformersAgent used to run an example
+    """
+    if agents is None:
+        agents = [(DEFAULT_AGENT, AGENT_CONFIGURATION[DEFAULT_AGENT]["default"])]
+    store = store or get_default_store()
+    executor = executor or get_executor()
+    rate_limiter = rate_limiter or RateLimiter(rate=RATE)
+
+    jobs = [(agent, model, example) for agent, model in agents for example in examples]
+    done: List[int] = []
+    done_lock = threading.Lock()
+
+    def _run(agent: str, model: str, example: TaskInput):
+        # The examples run by a previous start of the process are not run or written again
+        if not store.exists(agent=agent, model=model, task=example.task, kwargs=example.kwargs):
+            rate_limiter.acquire()
+            transformers_agent = create_agent(
+                agent=agent, model=model, task=example.task, kwargs=example.kwargs, cache=store
+            )
+            transformers_agent.run()
+        with done_lock:
+            done.append(1)
+            log.info(
+                "Warmed up %s/%s: agent='%s', model='%s', example='%s'",
+                len(done),
+                len(jobs),
+                agent,
+                model,
+                example.name,
+            )
+
+    log.info("Warming up %s runs", len(jobs))
+    return [executor.submit(_run, *job) for job in jobs]
+
+
+def start_warm_up(**kwargs) -> List[Future]:
+    """Starts the warm up once per process. Returns the futures of the runs
+
+    Safe to call from every session. Call it from the `--setup` script of `panel serve`, see
+    `apps/setup.py`, to start it before the first session is created.
+    """
+    with _lock:
+        if not _futures:
+            _futures.extend(warm_up(**kwargs))
+        return list(_futures)
+
+
+def get_warm_up_futures() -> Optional[List[Future]]:
+    """Returns the futures of the warm up of the process if started"""
+    with _lock:
+        return list(_futures) if _futures else None
+
+
+def on_startup():
+    """Configures the logging, preloads the local tools and starts the warm up if enabled
+
+    Each step runs once per process. So it is safe to call from every session.
+    """
+    configure_logging()
+    preload_local_tools()
+    if is_warm_up_enabled():
+        start_warm_up()
@@ -0,0 +1,281 @@
+"""Serves a headless REST and WebSocket API of the TransformersAgent
+
+- `POST /api/jobs` with a JSON body like `{"agent": "HuggingFace", "task": "Say hello"}` submits a
+job and responds with its status. The `model`, `kwargs`, `use_cache` and `priority`, i.e.
+`interactive` or `batch` by default, are optional. The token of the agent is required via the
+`Authorization` header. Set `TRANSFORMERS_AGENT_UI_API_SERVER_TOKEN=true` to run the jobs without
+one with the token of the server instead. Responds with status 503 if too many jobs are pending.
+- `GET /api/jobs/<id>` responds with the status and result of the job.
+- `DELETE /api/jobs/<id>` cancels the job and responds with its status. A running job stops at
+the next cancellation point of its run.
+- `WS /api/jobs/<id>/events` sends the status of the job every time it changes until finished.
+- `GET /api/runs` responds with a page of the cached runs. Filter via the `agent`, `model`,
+`search` and `limit` query arguments.
+- `GET /api/assets/<path>` responds with the value of a run, i.e. the file of an `asset`, with
+`ETag` and `Range` support.
+
+The jobs are run by the persistent JobQueue with the store shared by the sessions. The API
+provider of `transformers_agent_ui.ui.rest` serves the API as an extra route of `panel serve`. Or
+add the routes of `get_routes` to the `extra_patterns` of `pn.serve`.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.web import HTTPError, RequestHandler, StaticFileHandler
+from tornado.websocket import WebSocketClosedError, WebSocketHandler
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.jobs import (
+    FINISHED,
+    PRIORITIES,
+    Job,
+    JobQueue,
+    QueueFullError,
+    get_job_queue,
+)
+from transformers_agent_ui.domain.store import BaseStore
+from transformers_agent_ui.domain.token import TOKEN_PARAMETERS
+
+SERVER_TOKEN_ENV_VALUE = "TRANSFORMERS_AGENT_UI_API_SERVER_TOKEN"
+MAX_RUNS_LIMIT = 100
+# The seconds to wait before submitting again if too many jobs are pending
+RETRY_AFTER = 5
+# The milliseconds between the checks of the status of the jobs run by other processes
+POLL_PERIOD = 1000
+
+
+class _JsonHandler(RequestHandler):  # pylint: disable=abstract-method
+    """A handler responding with JSON, also on errors"""
+
+    def initialize(self, endpoint: str, jobs: JobQueue):  # pylint: disable=arguments-differ
+        """Sets the prefix of the routes and the JobQueue"""
+        self.endpoint = endpoint  # pylint: disable=attribute-defined-outside-init
+        self.jobs = jobs  # pylint: disable=attribute-defined-outside-init
+
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json")
+
+    def write_error(self, status_code: int, **kwargs):
+        self.finish({"error": self._reason})
+
+    def write_job(self, job: Job):
+        """Responds with the status of the job"""
+        self.finish(get_job_status(job, self.endpoint))
+
+
+def _run_in_executor(function: Callable, *args) -> Awaitable:
+    """Runs the function in the default executor. So the blocking calls, e.g. to the SQLite DB of
+    the JobQueue, do not block the IOLoop"""
+    return IOLoop.current().run_in_executor(None, function, *args)
+
+
+def is_server_token_enabled() -> bool:
+    """Returns True if the jobs submitted without a token may use the token of the server"""
+    return os.getenv(SERVER_TOKEN_ENV_VALUE, "").lower() in ("1", "true", "yes")
+
+
+def get_asset_url(endpoint: str, asset: str) -> str:
+    """Returns the url of the asset or "" if none"""
+    return f"/{endpoint}/assets/{asset}" if asset else ""
+
+
+def get_job_status(job: Job, endpoint: str) -> Dict[str, Any]:
+    """Returns the status of the job with the url of its asset"""
+    status = job.to_dict()
+    status["asset"] = get_asset_url(endpoint, status["asset"])
+    return status
+
+
+class JobsHandler(_JsonHandler):  # pylint: disable=abstract-method
+    """Submits the jobs"""
+
+    def _get_job(self) -> Job:
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError as exc:
+            raise HTTPError(400, reason=f"The body is not valid JSON: {exc}") from exc
+        if not isinstance(body, dict):
+            raise HTTPError(400, reason="The body must be a JSON object")
+        agent = body.get("agent", "")
+        if agent not in AGENT_CONFIGURATION:
+            raise HTTPError(400, reason=f"Unknown agent '{agent}'")
+        model = body.get("model") or AGENT_CONFIGURATION[agent]["default"]
+        if model not in AGENT_CONFIGURATION[agent]["models"]:
+            raise HTTPError(400, reason=f"Unknown model '{model}' of agent '{agent}'")
+        task = body.get("task", "")
+        if not task or not isinstance(task, str):
+            raise HTTPError(400, reason="A task is required")
+        kwargs = body.get("kwargs") or {}
+        if not isinstance(kwargs, dict):
+            raise HTTPError(400, reason="The kwargs must be a JSON object")
+        priority = body.get("priority", "batch")
+        if priority not in PRIORITIES:
+            raise HTTPError(400, reason=f"Unknown priority '{priority}'")
+        token = self.request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not token and agent in TOKEN_PARAMETERS and not is_server_token_enabled():
+            raise HTTPError(401, reason=f"A token of agent '{agent}' is required")
+        return Job(
+            agent=agent,
+            model=model,
+            task=task,
+            kwargs=kwargs,
+            use_cache=bool(body.get("use_cache", True)),
+            priority=PRIORITIES[priority],
+            token=token,
+        )
+
+    async def post(self):  # pylint: disable=arguments-differ
+        """Submits a job and responds with its status"""
+        job = self._get_job()
+        try:
+            job = await _run_in_executor(self.jobs.submit, job)
+        except QueueFullError as exc:
+            self.set_header("Retry-After", str(RETRY_AFTER))
+            raise HTTPError(503, reason=str(exc)) from exc
+        self.set_status(202)
+        self.set_header("Location", f"/{self.endpoint}/jobs/{job.id}")
+        self.write_job(job)
+
+
+class JobHandler(_JsonHandler):  # pylint: disable=abstract-method
+    """Responds with the status of a job and cancels it"""
+
+    async def get(self, job_id: str):  # pylint: disable=arguments-differ
+        """Responds with the status and result of the job"""
+        job = await _run_in_executor(self.jobs.get, job_id)
+        if job is None:
+            raise HTTPError(404, reason=f"Job '{job_id}' not found")
+        self.write_job(job)
+
+    async def delete(self, job_id: str):  # pylint: disable=arguments-differ
+        """Cancels the job and responds with its status"""
+        job = await _run_in_executor(self.jobs.cancel, job_id)
+        if job is None:
+            raise HTTPError(404, reason=f"Job '{job_id}' not found")
+        self.write_job(job)
+
+
+class JobEventsHandler(WebSocketHandler):  # pylint: disable=abstract-method
+    """Sends the status of a job every time it changes until finished
+
+    The jobs run by other processes sharing the queue are checked every `POLL_PERIOD`"""
+
+    job: Optional[Job] = None
+    _last_status: Dict[str, Any] = {}
+    _poll: Optional[PeriodicCallback] = None
+
+    def initialize(self, endpoint: str, jobs: JobQueue):  # pylint: disable=arguments-differ
+        """Sets the prefix of the routes and the JobQueue"""
+        # pylint: disable=attribute-defined-outside-init
+        self.endpoint = endpoint
+        self.jobs = jobs
+        self.loop = IOLoop.current()
+
+    async def open(self, *args: str, **kwargs: str):  # pylint: disable=invalid-overridden-method
+        job = await _run_in_executor(self.jobs.get, args[0])
+        if job is None:
+            self.close(code=4004, reason="Job not found")
+            return
+        self.job = job
+        job.watch(self._handle_change)
+        self._poll = PeriodicCallback(self._refresh, POLL_PERIOD)
+        self._poll.start()
+        self._send()
+
+    async def _refresh(self):
+        if self.job is not None:
+            job = await _run_in_executor(self.jobs.get, self.job.id)
+            if self.job is not None:
+                self.job = job or self.job
+                self._send()
+
+    def _handle_change(self, job: Job):  # pylint: disable=unused-argument
+        # Called from the thread running the job
+        self.loop.add_callback(self._send)
+
+    def _send(self):
+        if self.job is None or self.ws_connection is None:
+            return
+        status = get_job_status(self.job, self.endpoint)
+        if status == self._last_status:
+            return
+        self._last_status = status
+        try:
+            self.write_message(status)
+        except WebSocketClosedError:
+            return
+        if status["status"] in FINISHED:
+            self.close()
+
+    def on_close(self):
+        if self._poll is not None:
+            self._poll.stop()
+        if self.job is not None:
+            self.job.unwatch(self._handle_change)
+            self.job = None
+
+
+class RunsHandler(_JsonHandler):  # pylint: disable=abstract-method
+    """Responds with a page of the cached runs"""
+
+    async def get(self):  # pylint: disable=arguments-differ
+        """Responds with the latest runs matching the query arguments"""
+        try:
+            limit = min(int(self.get_argument("limit", "20")), MAX_RUNS_LIMIT)
+        except ValueError as exc:
+            raise HTTPError(400, reason="The limit must be an integer") from exc
+        store = self.jobs.store
+        if not store.supports_query_runs:
+            raise HTTPError(501, reason=f"{type(store).__name__} does not support querying runs")
+        runs, _ = await _run_in_executor(
+            lambda: store.query_runs(
+                agent=self.get_argument("agent", ""),
+                model=self.get_argument("model", ""),
+                search=self.get_argument("search", ""),
+                limit=limit,
+            ),
+        )
+        for run in runs:
+            asset = run.pop("value")
+            run["asset"] = get_asset_url(self.endpoint, asset) if store.asset_path else ""
+        self.finish({"runs": runs})
+
+
+class AssetHandler(StaticFileHandler):  # pylint: disable=abstract-method
+    """Serves the files of the values of the runs with ETag and Range support
+
+    The files are never changed once written. So they may be cached by the clients."""
+
+    def get_cache_time(self, path: str, modified, mime_type: str) -> int:
+        return self.CACHE_MAX_AGE
+
+
+def get_routes(
+    endpoint: str = "api", jobs: JobQueue | None = None, store: BaseStore | None = None
+) -> List:
+    """Returns the Tornado routes serving the API on the endpoint
+
+    Args:
+        endpoint: The prefix of the routes
+        jobs: Defaults to the JobQueue shared by the process
+        store: The store used by the jobs. Defaults to the store shared by the sessions
+    """
+    endpoint = endpoint.strip("/")
+    if jobs is None:
+        jobs = get_job_queue() if store is None else JobQueue(store=store).start()
+    kwargs = {"endpoint": endpoint, "jobs": jobs}
+    routes: List = [
+        (rf"^/{endpoint}/jobs/?$", JobsHandler, kwargs),
+        (rf"^/{endpoint}/jobs/([0-9a-f]+)/?$", JobHandler, kwargs),
+        (rf"^/{endpoint}/jobs/([0-9a-f]+)/events/?$", JobEventsHandler, kwargs),
+        (rf"^/{endpoint}/runs/?$", RunsHandler, kwargs),
+    ]
+    if jobs.store.asset_path is not None:
+        routes.append(
+            (rf"^/{endpoint}/assets/(.*)$", AssetHandler, {"path": str(jobs.store.asset_path)})
+        )
+    return routes
@@ -0,0 +1,134 @@
+"""Provides the ComparisonView for comparing the runs of the task by several models"""
+from __future__ import annotations
+
+import contextvars
+import threading
+from typing import List, Optional, Tuple
+
+import panel as pn
+import param
+from panel.io.state import set_curdoc
+from PIL.Image import Image as PIL_Image
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.compare import ModelRun, compare, get_all_models
+
+PREVIEW_SIZE = (300, 300)
+MAX_PREVIEW_LENGTH = 1000
+_SEPARATOR = "/"
+
+
+def _get_options():
+    return [_SEPARATOR.join(model) for model in get_all_models()]
+
+
+class ComparisonView(pn.viewable.Viewer):
+    """Enables the user to run the task of the agent by several agents and models concurrently and
+    to compare their results, latency and cost side by side"""
+
+    models = param.ListSelector(
+        default=[], objects=_get_options(), doc="The agents and models to compare"
+    )
+    compare = param.Event(doc="Click to run the task by the selected models")
+    is_running = param.Boolean(constant=True)
+
+    results = param.List(doc="The results of the last comparison", precedence=-1)
+    agent: TransformersAgent = param.ClassSelector(class_=TransformersAgent, precedence=-1)
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._thread: Optional[threading.Thread] = None
+
+    @param.depends("compare", watch=True)
+    def run(self):
+        """Starts running the task of the agent by the selected models
+
+        Runs in a thread. So the sessions stay responsive and the loading state is sent to the
+        browser. The results are sent on the next tick of the session once done."""
+        models = [tuple(option.split(_SEPARATOR, 1)) for option in self.models]
+        if not models or not self.agent.task or self.is_running:
+            return
+        with param.edit_constant(self):
+            self.is_running = True
+        doc = pn.state.curdoc
+        context = contextvars.copy_context()
+
+        def target():
+            with set_curdoc(doc):
+                self._compare(models)  # type: ignore[arg-type]
+
+        self._thread = threading.Thread(
+            target=context.run, args=(target,), daemon=True, name="transformers-agent-compare"
+        )
+        self._thread.start()
+
+    def _compare(self, models: List[Tuple[str, str]]):
+        try:
+            self.results = compare(self.agent, models)
+        finally:
+            with param.edit_constant(self):
+                self.is_running = False
+
+    def join(self, timeout: float | None = None):
+        """Waits for the running comparison, if any, to finish"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @staticmethod
+    def _get_preview(value):
+        if isinstance(value, PIL_Image):
+            value = value.copy()
+            value.thumbnail(PREVIEW_SIZE)
+            return pn.pane.PNG(value, width=PREVIEW_SIZE[0])
+        text = value if isinstance(value, str) else repr(value)
+        if len(text) > MAX_PREVIEW_LENGTH:
+            text = text[:MAX_PREVIEW_LENGTH] + " ..."
+        return pn.pane.Str(text, width=PREVIEW_SIZE[0])
+
+    def _get_result_view(self, result: ModelRun, fastest: bool):
+        model = f"{result.agent}{_SEPARATOR}{result.model}"
+        if result.model_used and result.model_used != result.model:
+            model += f" via {result.model_used}"
+        summary = (
+            f"**{result.seconds:.2f} s**{' (fastest)' if fastest else ''} | {result.source} | "
+            f"{result.tokens} tokens | ${result.cost:.4f}"
+        )
+        if result.error:
+            body = pn.pane.Alert(result.error, alert_type="danger")
+        else:
+            body = pn.Column(
+                self._get_preview(result.value), pn.widgets.Terminal(result.code, height=200)
+            )
+        return pn.Card(pn.pane.Markdown(summary), body, title=model, collapsible=False, width=340)
+
+    @param.depends("results")
+    def _results_view(self):
+        if not self.results:
+            return pn.pane.Markdown("Select the models and click COMPARE to run the task by each")
+        succeeded = [result.seconds for result in self.results if not result.error]
+        fastest = min(succeeded, default=None)
+        return pn.FlexBox(
+            *[
+                self._get_result_view(
+                    result, fastest=not result.error and result.seconds == fastest
+                )
+                for result in self.results
+            ],
+        )
+
+    def __panel__(self):
+        models_input = pn.widgets.CheckBoxGroup.from_param(self.param.models, inline=False)
+        compare_input = pn.widgets.Button.from_param(
+            self.param.compare,
+            button_type="primary",
+            disabled=self.param.is_running,
+            loading=self.param.is_running,
+            name="COMPARE",
+        )
+        task = pn.bind(lambda task: f"**Task:** {task or '*None*'}", self.agent.param.task)
+        return pn.Row(
+            pn.Column(models_input, compare_input, width=300),
+            pn.Column(pn.pane.Markdown(task), self._results_view, sizing_mode="stretch_width"),
+            name="Compare",
+            sizing_mode="stretch_width",
+        )
@@ -1,10 +1,11 @@
 """Custom components for the UI"""
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, Tuple
 
 import panel as pn
 import param
+from PIL.Image import Image as PIL_Image
 
 from transformers_agent_ui.domain.examples import get_examples_map
 from transformers_agent_ui.domain.run import TaskInput
@@ -35,9 +36,13 @@ def get_example_selection_widget(task: TaskInput, select_default=True):
 
 
 class KwargsEditor(pn.viewable.Viewer):
-    """An editor for displaying and editing the kwargs of a TaskInput"""
+    """An editor for displaying and editing the kwargs of a TaskInput
 
-    def __init__(self, kwargs: param.Dict, **params):
+    Images are shown as previews of at most `preview_size` to limit the memory used per session.
+    """
+
+    def __init__(self, kwargs: param.Dict, preview_size: Tuple[int, int] = (400, 400), **params):
+        self._preview_size = preview_size
         self._panel = pn.bind(self._get_panel, kwargs=kwargs)
 
         super().__init__(**params)
@@ -49,5 +54,8 @@ class KwargsEditor(pn.viewable.Viewer):
         layout = pn.Column(sizing_mode="stretch_width")
         for name, kwarg in kwargs.items():
             layout.append(pn.pane.Markdown(f"`{name}`", margin=(0, 10)))
+            if isinstance(kwarg, PIL_Image):
+                kwarg = kwarg.copy()
+                kwarg.thumbnail(self._preview_size)
             layout.append(pn.panel(kwarg, width=200, height=200))
         return layout
@@ -29,6 +29,17 @@ You can find the source code on Github at [awesome-panel/transformers-agent-ui](
 """
     )
     # pylint: enable=line-too-long
+    max_log_lines: int = param.Integer(
+        1000, bounds=(1, None), doc="The maximum number of log lines kept per session"
+    )
+    log_flush_period: int = param.Integer(
+        500, bounds=(1, None), doc="The milliseconds between the updates of the Logs tab"
+    )
+    max_preview_size: int = param.Integer(
+        400,
+        bounds=(1, None),
+        doc="The maximum width and height of the previews of the images in the arguments",
+    )
 
 
 HF_YELLOW = "#fef3c7"
@@ -0,0 +1,149 @@
+"""Provides the HistoryBrowser for browsing the runs in the Store"""
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+import panel as pn
+import param
+from PIL.Image import Image as PIL_Image
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.store import ASSET_ERRORS, BaseStore, HistoryCursor
+
+ALL = ""
+PREVIEW_SIZE = (120, 120)
+MAX_PREVIEW_LENGTH = 200
+
+
+def _get_all_models() -> List[str]:
+    return sorted({model for config in AGENT_CONFIGURATION.values() for model in config["models"]})
+
+
+class HistoryBrowser(pn.viewable.Viewer):
+    """Enables the user to browse, filter and search the runs in the Store page by page
+
+    Only the runs of the current page are kept in memory and only their values are read.
+    """
+
+    agent = param.Selector(default=ALL, objects=[ALL] + sorted(AGENT_CONFIGURATION))
+    model = param.Selector(default=ALL, objects=[ALL] + _get_all_models())
+    search = param.String(doc="Only show runs with a task containing all the words")
+    start = param.CalendarDate(default=None, doc="Only show runs at or after this date")
+    end = param.CalendarDate(default=None, doc="Only show runs before this date")
+    page_size = param.Integer(default=10, bounds=(1, 100))
+
+    runs = param.List(doc="The runs of the current page", precedence=-1)
+    page = param.Integer(default=1, constant=True, precedence=-1)
+    is_first_page = param.Boolean(default=True, constant=True, precedence=-1)
+    is_last_page = param.Boolean(default=True, constant=True, precedence=-1)
+
+    next_page = param.Event(label="Next")
+    previous_page = param.Event(label="Previous")
+
+    store: BaseStore = param.ClassSelector(class_=BaseStore, precedence=-1)
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self._cursors: List[Optional[HistoryCursor]] = [None]
+        self._next_cursor: Optional[HistoryCursor] = None
+        self._error = ""
+        self.load()
+
+    def load(self):
+        """Loads the runs of the current page"""
+        if not self.store.supports_query_runs:
+            self._error = f"{type(self.store).__name__} does not support querying runs"
+        runs, self._next_cursor = self.store.query_runs(
+            agent=self.agent,
+            model=self.model,
+            start=self.start.isoformat() if self.start else "",
+            end=self.end.isoformat() if self.end else "",
+            search=self.search,
+            after=self._cursors[-1],
+            limit=self.page_size,
+        )
+        with param.edit_constant(self):
+            self.page = len(self._cursors)
+            self.is_first_page = self.page == 1
+            self.is_last_page = self._next_cursor is None
+        self.runs = runs
+
+    @param.depends("agent", "model", "search", "start", "end", "page_size", watch=True)
+    def _reset(self):
+        self._cursors = [None]
+        self.load()
+
+    @param.depends("next_page", watch=True)
+    def _load_next_page(self):
+        if self._next_cursor is not None:
+            self._cursors.append(self._next_cursor)
+            self.load()
+
+    @param.depends("previous_page", watch=True)
+    def _load_previous_page(self):
+        if len(self._cursors) > 1:
+            self._cursors.pop()
+            self.load()
+
+    def _get_preview(self, path: str):
+        """Returns a small preview of the value. Read only when the page is shown"""
+        # The asset can be missing or corrupt. Images are only fully loaded by the thumbnail
+        try:
+            value = self.store.read_asset(path)
+            if isinstance(value, PIL_Image):
+                value = value.copy()
+                value.thumbnail(PREVIEW_SIZE)
+        except ASSET_ERRORS:
+            return pn.pane.Markdown("*Value not available*")
+        if isinstance(value, PIL_Image):
+            return pn.pane.PNG(value, width=PREVIEW_SIZE[0])
+        text = repr(value)
+        if len(text) > MAX_PREVIEW_LENGTH:
+            text = text[:MAX_PREVIEW_LENGTH] + " ..."
+        return pn.pane.Str(text, width=300)
+
+    def _get_run_view(self, run: Dict):
+        model = f"`{run['model']}`"
+        if run.get("model_used") and run["model_used"] != run["model"]:
+            model += f" via `{run['model_used']}`"
+        return pn.Row(
+            self._get_preview(run["value"]),
+            pn.pane.Markdown(
+                f"**{run['task']}**\n\n{run['time']} | `{run['agent']}` | {model}",
+                sizing_mode="stretch_width",
+            ),
+            sizing_mode="stretch_width",
+            styles={"border-bottom": "1px solid lightgray"},
+        )
+
+    @param.depends("runs")
+    def _runs_view(self):
+        if self._error:
+            return pn.pane.Alert(self._error, alert_type="warning")
+        if not self.runs:
+            return pn.pane.Markdown("No runs found")
+        return pn.Column(
+            *[self._get_run_view(run) for run in self.runs], sizing_mode="stretch_width"
+        )
+
+    def __panel__(self):
+        filters = pn.Param(
+            self,
+            parameters=["agent", "model", "search", "start", "end", "page_size"],
+            show_name=False,
+            widgets={"search": {"type": pn.widgets.TextInput, "placeholder": "Search tasks"}},
+            width=300,
+        )
+        navigation = pn.Row(
+            pn.widgets.Button.from_param(
+                self.param.previous_page, disabled=self.param.is_first_page
+            ),
+            pn.bind(lambda page: f"Page {page}", self.param.page),
+            pn.widgets.Button.from_param(self.param.next_page, disabled=self.param.is_last_page),
+        )
+        return pn.Row(
+            filters,
+            pn.Column(navigation, self._runs_view, sizing_mode="stretch_width"),
+            name="History",
+            sizing_mode="stretch_width",
+        )
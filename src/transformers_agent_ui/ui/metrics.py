@@ -0,0 +1,29 @@
+"""Serves the metrics of the process in the Prometheus text format
+
+The API provider of `transformers_agent_ui.ui.rest` serves the endpoint as an extra route of
+`panel serve`. Or add the ROUTES to the `extra_patterns` of `pn.serve`.
+"""
+from typing import List
+
+from tornado.web import RequestHandler
+
+from transformers_agent_ui.domain.metrics import REGISTRY
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsHandler(RequestHandler):  # pylint: disable=abstract-method
+    """Responds with the metrics of the REGISTRY"""
+
+    def get(self):  # pylint: disable=arguments-differ
+        """Responds with the metrics"""
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(REGISTRY.render())
+
+
+def get_routes(endpoint: str = "metrics") -> List:
+    """Returns the Tornado routes serving the metrics on the endpoint"""
+    return [(rf"^/{endpoint.strip('/')}/?$", MetricsHandler)]
+
+
+ROUTES = get_routes()
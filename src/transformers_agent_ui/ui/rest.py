@@ -0,0 +1,30 @@
+"""The `panel.io.rest` providers serving the API and the metrics
+
+`panel serve` accepts a single `--rest-provider`. So the API provider also serves the metrics on
+`/metrics`. Serve them via
+
+```bash
+panel serve apps/app.py --rest-provider transformers-agent-ui-api --rest-endpoint api
+```
+
+Panel loads the providers of all the installed packages when imported. So the routes, and their
+dependencies like transformers and torch, are only imported once a provider is used.
+"""
+# pylint: disable=import-outside-toplevel, unused-argument
+from typing import List, Sequence
+
+METRICS_ENDPOINT = "metrics"
+
+
+def api_rest_provider(files: Sequence[str], endpoint: str) -> List:
+    """The provider serving the API on the endpoint and the metrics on `/metrics`"""
+    from transformers_agent_ui.ui import api, metrics
+
+    return api.get_routes(endpoint) + metrics.get_routes(METRICS_ENDPOINT)
+
+
+def metrics_rest_provider(files: Sequence[str], endpoint: str) -> List:
+    """The provider serving only the metrics on the endpoint"""
+    from transformers_agent_ui.ui import metrics
+
+    return metrics.get_routes(endpoint)
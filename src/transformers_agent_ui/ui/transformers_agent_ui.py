@@ -1,10 +1,29 @@
 """Provides the TransformersAgentUI"""
+import contextvars
+import os
+import threading
+from io import BytesIO
+from typing import Optional
+
 import numpy as np
 import panel as pn
 import param
+from panel.io.state import set_curdoc
+from PIL.Image import Image as PIL_Image
 from torch import Tensor
 
 from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.jobs import (
+    CANCELLED,
+    INTERACTIVE,
+    Job,
+    QueueFullError,
+    get_job_queue,
+)
+from transformers_agent_ui.domain.logs import SessionLogHandler
+from transformers_agent_ui.domain.metrics import SESSIONS
+from transformers_agent_ui.domain.values import ValueHandle
+from transformers_agent_ui.ui.compare import ComparisonView
 from transformers_agent_ui.ui.components import (
     KwargsEditor,
     get_example_selection_widget,
@@ -15,11 +34,33 @@ from transformers_agent_ui.ui.config import (
     TransformersAgentUIConfig,
     TransformersAgentUIStyles,
 )
+from transformers_agent_ui.ui.history import HistoryBrowser
 from transformers_agent_ui.ui.token_manager import TokenManagerUI
 
+JOB_QUEUE_ENV_VALUE = "TRANSFORMERS_AGENT_UI_JOB_QUEUE"
 # Hack to fix bug similar to https://github.com/holoviz/panel/issues/4829
 pn.widgets.Terminal.param.clear.readonly = False
 pn.widgets.Terminal.param.clear.constant = False
+# With param<2 every Column registers a watcher on these parameters of the Column class instead of
+# on itself. They keep the Columns of closed sessions alive
+_COLUMN_CLASS_WATCHED_PARAMETERS = [
+    "scroll_position",
+    "auto_scroll_limit",
+    "scroll_button_threshold",
+    "view_latest",
+]
+
+
+def _release_column_class_watchers():
+    """Removes the watchers registered on the Column class by its instances
+
+    They are only triggered when the parameters of the class change, which they never do. So
+    removing them does not change the behaviour of the Columns in use.
+    """
+    parameters = pn.Column.param.objects("existing")
+    for name in _COLUMN_CLASS_WATCHED_PARAMETERS:
+        if name in parameters:
+            parameters[name].watchers.get("value", []).clear()
 
 
 class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
@@ -35,6 +76,14 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
     """
 
     submit = param.Event(doc="Click to run the task")
+    use_job_queue = param.Boolean(
+        default=False,
+        doc="""If True the runs are submitted to the persistent job queue. So they keep running if
+        the page is reloaded. The page re-attaches to the job via the `job` query argument""",
+    )
+    job_id = param.String(
+        precedence=-1, doc="The id of the job of the current run if submitted to the job queue"
+    )
 
     config: TransformersAgentUIConfig = param.ClassSelector(
         class_=TransformersAgentUIConfig, default=CONFIG
@@ -47,8 +96,78 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
     def __init__(self, **params):
         if "token_manager" not in params:
             params["token_manager"] = TokenManagerUI(name="Token Manager")
+        if "log_handler" not in params:
+            config = params.get("config", CONFIG)
+            params["log_handler"] = SessionLogHandler(max_lines=config.max_log_lines)
+        if "use_job_queue" not in params:
+            params["use_job_queue"] = os.getenv(JOB_QUEUE_ENV_VALUE, "").lower() in (
+                "1",
+                "true",
+                "yes",
+            )
         super().__init__(**params)
 
+        self._logs = pn.widgets.Terminal(name="Logs", sizing_mode="stretch_width")
+        self._log_line_count = 0
+        self.write_log("Hi. The logs from your runs will be shown here!")
+        self._history = HistoryBrowser(store=self.cache)
+        self._comparison = ComparisonView(agent=self)
+        self._log_callback = None
+        self._job = None
+        self._job_callback = None
+        self._value_handle: Optional[ValueHandle] = None
+        if pn.state.curdoc is not None:
+            SESSIONS.inc()
+            pn.state.on_session_destroyed(self._handle_session_destroyed)
+            # Streams the logs of long runs in batches
+            self._log_callback = pn.state.add_periodic_callback(
+                self.flush_logs, period=self.config.log_flush_period
+            )
+        if self.use_job_queue and pn.state.location is not None:
+            pn.state.location.sync(self, {"job_id": "job"})
+            if self.job_id:
+                self.attach(self.job_id)
+
+    def write_log(self, message: str):
+        """Writes the message to the Logs"""
+        self.log_handler.buffer.append(message)
+        self.flush_logs()
+
+    def flush_logs(self):
+        """Writes the new log lines to the Logs. Only the last `config.max_log_lines` lines are
+        kept"""
+        lines = self.log_handler.buffer.flush()
+        if not lines:
+            return
+        self._log_line_count += len(lines)
+        # Rewriting is amortized by only trimming when twice the maximum number of lines is shown
+        if self._log_line_count >= 2 * self.config.max_log_lines:
+            lines = self.log_handler.buffer.lines
+            self._log_line_count = len(lines)
+            self._logs.clear()
+        self._logs.write("\n".join(lines) + "\n")
+
+    def release(self):
+        """Releases the values, arguments, logs and history held by the session"""
+        with param.discard_events(self):
+            self.param.update(value=None, kwargs={}, prompt="", explanation="", code="")
+        self._value_handle = None
+        self.log_handler.buffer.clear()
+        self._log_line_count = 0
+        self._logs.clear()
+        self._history.runs = []
+        self._comparison.results = []
+
+    def _handle_session_destroyed(self, session_context):  # pylint: disable=unused-argument
+        SESSIONS.inc(-1)
+        if self._log_callback is not None:
+            self._log_callback.stop()
+            self._log_callback = None
+        # The job keeps running. A new session can re-attach to it
+        self._stop_job_callback()
+        self.release()
+        _release_column_class_watchers()
+
     def __panel__(self):
         # logo = pn.pane.PNG(
         #     object="https://pyviz-dev.github.io/panel/_static/logo_horizontal_light_theme.png",
@@ -66,8 +185,6 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
         )
         editor = self._create_editor()
 
-        logs = pn.widgets.Terminal(name="Logs", sizing_mode="stretch_width")
-        logs.write("Hi. The logs from your runs will be shown here!")
         # sys.stdout = self._terminal
         about = pn.pane.Markdown(self.config.about, sizing_mode="stretch_width", name="About")
         settings = pn.Column(self.token_manager, name="Settings")
@@ -75,7 +192,9 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
         tabs = pn.Tabs(
             editor,
             # self._results,
-            logs,
+            self._comparison,
+            self._history,
+            self._logs,
             settings,
             about,
         )
@@ -118,6 +237,13 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
                 align="start",
             ),
             pn.Row(self.param.use_cache, self.param.remote, margin=(15, 5)),
+            pn.widgets.FloatInput.from_param(
+                self.param.similarity_threshold,
+                step=0.05,
+                placeholder="Only exact matches",
+                description="""The minimum match score of a cached, similar task to use its run. \
+                    Leave empty to only use runs of the exact same task.""",
+            ),
             visible=show_details_input,
         )
         example_input = get_example_selection_widget(task=self)
@@ -137,8 +263,17 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
             stylesheets=[self.styles.submit_button_style_sheet],
             name="RUN",
         )
-        task_input = pn.Column(task_input, submit_input)
-        assets_input = KwargsEditor(kwargs=self.param.kwargs)
+        cancel_input = pn.widgets.Button.from_param(
+            self.param.cancel,
+            button_type="danger",
+            button_style="outline",
+            sizing_mode="stretch_width",
+            visible=self.param.is_running,
+            name="CANCEL",
+        )
+        task_input = pn.Column(task_input, submit_input, cancel_input)
+        preview_size = (self.config.max_preview_size, self.config.max_preview_size)
+        assets_input = KwargsEditor(kwargs=self.param.kwargs, preview_size=preview_size)
 
         inputs = pn.Column(
             show_details_input,
@@ -183,7 +318,7 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
         if self.is_running:
             return f"""Running `{self.agent=}` and `{self.model=}` on \n\n{self.task}"""
 
-        return pn.Tabs(
+        tabs = pn.Tabs(
             ("VALUE", self.get_value_pane),
             ("CODE", pn.widgets.Terminal(self.code)),
             ("EXPLANATION", self.explanation),
@@ -191,6 +326,26 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
             align="center",
             sizing_mode="stretch_width",
         )
+        messages = []
+        if self.match_score is not None:
+            messages.append(self._get_match_message())
+        if self.model_used and self.model_used != self.model:
+            messages.append(f"Generated by the model '{self.model_used}'")
+        if not messages:
+            return tabs
+        return pn.Column(
+            pn.pane.Alert(". ".join(messages), alert_type="info", margin=(0, 10)),
+            tabs,
+            sizing_mode="stretch_width",
+        )
+
+    def _get_match_message(self) -> str:
+        if self.matched_task == self.task:
+            return "Served from the cache"
+        return (
+            f"Served from the cache of the similar task '{self.matched_task}' with match score "
+            f"{self.match_score:.2f}"
+        )
 
     def _get_last_tool(self) -> str:
         """Returns the last tool used in the code"""
@@ -209,44 +364,164 @@ class TransformersAgentUI(TransformersAgent, pn.viewable.Viewer):
 
         return last_tool
 
+    def _get_value_handle(self) -> ValueHandle:
+        if self._value_handle is None or not self._value_handle.refers_to(self.value):
+            self._value_handle = ValueHandle.from_value(self.value)
+        return self._value_handle
+
     def get_value_pane(self):
-        """Returns a converted value that can be displayed by Panel"""
+        """Returns a converted value that can be displayed by Panel
+
+        The conversions are cached until the value changes"""
         # Here we should help the agent return something that can be displayed
-        value = self.value
+        handle = self._get_value_handle()
+        value = handle.value
         tool = self._get_last_tool()
 
-        if tool == "text_reader":
-            if isinstance(value, Tensor) and hasattr(value, "numpy"):
-                value = value.numpy()  # pylint: disable=no-member
-            if isinstance(value, np.ndarray) and value.dtype in (np.float32,):
-                value = (value * 32768.0).astype(np.int16)
-            if isinstance(value, np.ndarray):
-                return pn.pane.Audio(value, sample_rate=16000)
+        if tool == "text_reader" and isinstance(value, (Tensor, np.ndarray)):
+            return pn.pane.Audio(handle.to_pcm16(), sample_rate=16000)
+        if isinstance(value, PIL_Image):
+            # An image read from the cache is shown from its file without decoding it
+            return pn.pane.PNG(BytesIO(handle.to_png()))
 
         return value
 
     @pn.depends("submit", watch=True)
     def _submit(self):
-        self.run()
+        if self.use_job_queue:
+            self.submit_job()
+            return
+        doc = pn.state.curdoc
+        if doc is None or doc.session_context is None:
+            self._run_and_flush_logs()
+            return
+        # Runs in a thread. So the session stays responsive, e.g. to the clicks on CANCEL. The
+        # changes of the parameters are sent to the browser on the next tick of the session
+        self.is_running = True
+        context = contextvars.copy_context()
+
+        def target():
+            with set_curdoc(doc):
+                self._run_and_flush_logs()
+
+        threading.Thread(
+            target=context.run, args=(target,), daemon=True, name="transformers-agent-run"
+        ).start()
+
+    def _run_and_flush_logs(self):
+        try:
+            self.run()
+        finally:
+            self.flush_logs()
+
+    def cancel_run(self):
+        if self._job is not None:
+            get_job_queue().cancel(self._job.id)
+            return
+        super().cancel_run()
+
+    def submit_job(self):
+        """Submits the task to the job queue as an interactive job and attaches to it"""
+        job = Job(
+            agent=self.agent,
+            model=self.model,
+            task=self.task,
+            kwargs=self._get_run_kwargs(),
+            use_cache=self.use_cache,
+            similarity_threshold=self.similarity_threshold,
+            priority=INTERACTIVE,
+            token=self.get_token(),
+            log_handler=self.log_handler,
+        )
+        try:
+            get_job_queue().submit(job)
+        except QueueFullError as exc:
+            if pn.state.notifications:
+                pn.state.notifications.warning(f"The server is busy. {exc}.", duration=12000)
+            return
+        self.attach(job.id)
+
+    def attach(self, job_id: str):
+        """Shows the status and the result of the job once finished. For example to re-attach to
+        the job of the session after the page was reloaded"""
+        self._stop_job_callback()
+        job = get_job_queue().get(job_id)
+        if job is None:
+            self.job_id = ""
+            return
+        self._job = job
+        # A change of the agent resets the model
+        self.agent = job.agent
+        self.param.update(model=job.model, task=job.task, job_id=job_id)
+        self.param.update(
+            value=None,
+            prompt="Coming up ...",
+            code="Coming up ...",
+            explanation="Coming up ...",
+            model_used="",
+            error="",
+            is_running=True,
+        )
+        self.update_from_job()
+        if self._job is not None and pn.state.curdoc is not None:
+            self._job_callback = pn.state.add_periodic_callback(
+                self.update_from_job, period=self.config.log_flush_period
+            )
+
+    def update_from_job(self):
+        """Shows the result of the attached job if finished"""
+        if self._job is None:
+            return
+        # The jobs of other processes are only updated in the DB
+        job = get_job_queue().get(self._job.id) or self._job
+        if not job.is_finished:
+            return
+        self._job = None
+        self._stop_job_callback()
+        with param.edit_constant(self):
+            self.param.update(match_score=job.match_score, matched_task=job.matched_task)
+        self.param.update(
+            value=get_job_queue().read_value(job),
+            prompt=job.prompt,
+            explanation=job.explanation,
+            code=job.code,
+            model_used=job.model_used,
+            error=job.error,
+            is_running=False,
+        )
+        self.flush_logs()
+        if job.error and pn.state.notifications:
+            if job.status == CANCELLED:
+                pn.state.notifications.warning(f"{job.error}.", duration=12000)
+            else:
+                pn.state.notifications.error(job.error, duration=12000)
+
+    def _stop_job_callback(self):
+        if self._job_callback is not None:
+            self._job_callback.stop()
+            self._job_callback = None
 
     def _handle_no_token(self, agent):
-        message = f"No token found for agent '{agent}'. Please provide one."
-        print(message)
+        super()._handle_no_token(agent)
+        if pn.state.notifications:
+            pn.state.notifications.error(
+                f"No token found for agent '{agent}'. Please provide one.", duration=12000
+            )
+
+    def _handle_cancelled(self, exc):
+        super()._handle_cancelled(exc)
         if pn.state.notifications:
-            pn.state.notifications.error(message, duration=12000)
+            pn.state.notifications.warning(f"{exc}.", duration=12000)
 
     def _handle_run_exception(self, exc: Exception):
-        # openai.error.RateLimitError: You exceeded your current quota, please check your plan
-        # and billing details.
-        print(exc)
+        super()._handle_run_exception(exc)
         if pn.state.notifications:
             pn.state.notifications.error(f"The run failed: {exc}.", duration=12000)  # type: ignore
 
     def _handle_no_result(self):
-        message = "No result returned"
-        print(message)
+        super()._handle_no_result()
         if pn.state.notifications:
-            pn.state.notifications.error(message, duration=12000)
+            pn.state.notifications.error("No result returned", duration=12000)
 
 
 if pn.state.served:
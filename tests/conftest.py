@@ -0,0 +1,9 @@
+"""Registers the agents only used by the tests"""
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+
+# Registered before the test modules are imported, as the agents are listed by the UI on import
+AGENT_CONFIGURATION["Offline"] = {
+    "provider": "fixture",
+    "default": "fixtures",
+    "models": {"fixtures": {"path": None, "delay": 0.0}},
+}
@@ -0,0 +1,113 @@
+"""We can cancel the runs and time out their stages"""
+# pylint: disable=missing-function-docstring
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.cancellation import (
+    EVALUATE,
+    GENERATE,
+    Cancellation,
+    CancelledError,
+    StageTimeoutError,
+)
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION, TIMEOUT_CONFIGURATION
+from transformers_agent_ui.domain.custom_run import evaluate
+from transformers_agent_ui.domain.store import Store
+
+LATENCY = 0.2
+
+
+def _slow(value):
+    time.sleep(LATENCY)
+    return value
+
+
+@pytest.fixture(name="slow_model")
+def _slow_model():
+    """An Offline model taking 5 seconds to generate"""
+    models = {**AGENT_CONFIGURATION["Offline"]["models"], "slow": {"path": None, "delay": 5.0}}
+    with mock.patch.dict(AGENT_CONFIGURATION["Offline"], {"models": models}):
+        yield "slow"
+
+
+def test_call_is_cancelled_while_waiting():
+    cancellation = Cancellation()
+    threading.Timer(LATENCY, cancellation.cancel).start()
+
+    start = time.perf_counter()
+    with pytest.raises(CancelledError, match="cancelled"):
+        cancellation.call(time.sleep, 5)
+    assert time.perf_counter() - start < 1
+
+
+def test_stage_timeout():
+    cancellation = Cancellation({GENERATE: LATENCY})
+
+    with pytest.raises(StageTimeoutError, match="generate stage exceeded its timeout"):
+        with cancellation.stage(GENERATE):
+            cancellation.call(time.sleep, 5)
+    # The timeout only applies to its stage
+    with cancellation.stage(EVALUATE):
+        assert cancellation.call(_slow, 1) == 1
+
+
+def test_evaluate_stops_between_statements():
+    code = """
+a = slow(1)
+b = slow(a)
+c = slow(b)
+d = slow(c)
+"""
+    cancellation = Cancellation({EVALUATE: 1.5 * LATENCY})
+
+    start = time.perf_counter()
+    with pytest.raises(StageTimeoutError), cancellation.stage(EVALUATE):
+        evaluate(code, {"slow": _slow}, cancellation=cancellation)
+    assert time.perf_counter() - start < 3 * LATENCY
+
+
+def test_evaluate_with_cancellation():
+    code = """
+a = slow(1)
+b = slow(2)
+"""
+    assert evaluate(code, {"slow": _slow}, cancellation=Cancellation()) == 2
+
+
+def test_cancel_run(tmp_path, slow_model):
+    agent = TransformersAgent(
+        agent="Offline", model=slow_model, task="Say hello", cache=Store(tmp_path)
+    )
+    threading.Timer(LATENCY, agent.cancel_run).start()
+
+    start = time.perf_counter()
+    agent.run()
+
+    assert time.perf_counter() - start < 2
+    assert agent.error == "The run was cancelled"
+    assert not agent.is_running
+    # The next run is not cancelled
+    agent.model = "fixtures"
+    assert agent.run() == "Hello"
+    assert not agent.error
+
+
+def test_cancel_event_only_cancels_a_running_run(tmp_path):
+    agent = TransformersAgent(agent="Offline", task="Say hello", cache=Store(tmp_path))
+    agent.cancel = True
+    assert agent.run() == "Hello"
+
+
+def test_run_timeout(tmp_path, slow_model):
+    agent = TransformersAgent(
+        agent="Offline", model=slow_model, task="Say hello", cache=Store(tmp_path)
+    )
+
+    with mock.patch.dict(TIMEOUT_CONFIGURATION, {GENERATE: LATENCY}):
+        agent.run()
+
+    assert agent.error == f"The generate stage exceeded its timeout of {LATENCY}s"
@@ -0,0 +1,56 @@
+"""We can compare the runs of a task by several models"""
+# pylint: disable=missing-function-docstring
+from unittest import mock
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.compare import compare, get_price
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.token import EnvTokenProvider, TokenManager
+
+MODELS = {"fixtures": {}, "slow-fixtures": {"delay": 0.2}}
+
+
+def test_compare_models():
+    # Given
+    store = InMemoryStore()
+    source = TransformersAgent(
+        agent="Offline", task="Return the text", kwargs={"text": "Hi"}, cache=store, sandbox=None
+    )
+    with mock.patch.dict(AGENT_CONFIGURATION["Offline"], {"models": MODELS}), mock.patch.dict(
+        AGENT_CONFIGURATION["Offline"], {"pricing": {"slow-fixtures": 0.5}}
+    ):
+        # When
+        results = compare(source, [("Offline", "fixtures"), ("Offline", "slow-fixtures")])
+        # Then
+        assert [(result.model, result.value, result.source) for result in results] == [
+            ("fixtures", "Hi", "agent"),
+            ("slow-fixtures", "Hi", "agent"),
+        ]
+        assert results[0].seconds < 0.2 <= results[1].seconds
+        assert results[0].cost == 0.0
+        assert results[1].cost == results[1].tokens / 1000 * 0.5 > 0
+        assert store.read("Offline", "slow-fixtures", "Return the text", {})["value"] == "Hi"
+        # When the task is compared again
+        results = compare(source, [("Offline", "fixtures"), ("Offline", "slow-fixtures")])
+        # Then the runs are read from the cache of each model
+        assert [result.source for result in results] == ["cache", "cache"]
+        assert results[1].seconds < 0.2
+        assert results[1].cost == 0.0
+
+
+def test_compare_reports_errors():
+    token_manager = TokenManager(provider=EnvTokenProvider(env_values={}))
+    source = TransformersAgent(
+        task="Say hello", cache=InMemoryStore(), sandbox=None, token_manager=token_manager
+    )
+
+    (result,) = compare(source, [("HuggingFace", "Starcoder")])
+
+    assert result.error == "No token found for agent 'HuggingFace'"
+    assert result.value is None
+
+
+def test_get_price():
+    assert get_price("OpenAI", "text-davinci-003") > 0
+    assert get_price("HuggingFace", "Starcoder") == 0.0
@@ -0,0 +1,132 @@
+"""We can evaluate the code generated by the agent"""
+# pylint: disable=missing-function-docstring
+import time
+from unittest import mock
+
+import pytest
+from transformers import Tool
+from transformers.tools.python_interpreter import InterpretorError
+
+from transformers_agent_ui.domain import custom_run
+from transformers_agent_ui.domain.custom_run import evaluate, get_execution_levels, run
+from transformers_agent_ui.domain.providers import FixtureAgent
+
+LATENCY = 0.2
+
+
+def _slow(name):
+    def tool(value):
+        time.sleep(LATENCY)
+        return f"{name}({value})"
+
+    return tool
+
+
+TOOLS = {
+    "image_captioner": _slow("image_captioner"),
+    "translator": _slow("translator"),
+    "text_reader": _slow("text_reader"),
+}
+
+
+def test_get_execution_levels():
+    code = """
+caption = image_captioner(image)
+translation = translator(text)
+audio = text_reader(caption)
+"""
+    assert get_execution_levels(code, state={"image": 1, "text": 2}) == [[0, 1], [2]]
+
+
+def test_get_execution_levels_write_after_read():
+    code = """
+caption = image_captioner(image)
+image = translator(text)
+"""
+    assert get_execution_levels(code, state={"image": 1, "text": 2}) == [[0], [1]]
+
+
+def test_get_execution_levels_barriers():
+    """Statements that are not simple assignments or read unknown names are evaluated alone"""
+    code = """
+caption = image_captioner(image)
+print(caption)
+translation = translator(txt)
+audio = text_reader(text)
+"""
+    assert get_execution_levels(code, state={"image": 1, "text": 2}) == [[0], [1], [2], [3]]
+
+
+def test_evaluate_runs_independent_tools_concurrently():
+    # Given
+    code = """
+caption = image_captioner(image)
+translation = translator(text)
+audio = text_reader(caption)
+"""
+    state = {"image": "image", "text": "text"}
+    # When
+    start = time.perf_counter()
+    result = evaluate(code, TOOLS, state=state)
+    duration = time.perf_counter() - start
+    # Then
+    assert result == "text_reader(image_captioner(image))"
+    assert state["translation"] == "translator(text)"
+    assert duration < 3 * LATENCY
+
+
+def test_evaluate_sequentially():
+    code = """
+caption = image_captioner(image)
+translation = translator(text)
+"""
+    state = {"image": "image", "text": "text"}
+
+    start = time.perf_counter()
+    result = evaluate(code, TOOLS, state=state, max_workers=1)
+    duration = time.perf_counter() - start
+
+    assert result == "translator(text)"
+    assert duration >= 2 * LATENCY
+
+
+def test_evaluate_raises_first_error():
+    code = """
+caption = image_captioner(image)
+translation = unknown_tool(text)
+"""
+    with pytest.raises(InterpretorError, match="stopped at line 1"):
+        evaluate(code, TOOLS, state={"image": "image", "text": "text"})
+
+
+def test_evaluate_sequentially_without_executor():
+    code = """
+caption = image_captioner(image)
+translation = translator(caption)
+"""
+    with mock.patch.object(custom_run, "ThreadPoolExecutor") as executor:
+        result = evaluate(code, TOOLS, state={"image": "image"})
+
+    assert result == "translator(image_captioner(image))"
+    executor.assert_not_called()
+
+
+def test_run_caches_the_tools_of_the_agent():
+    class Translator(Tool):  # pylint: disable=abstract-method
+        """Returns the text as is"""
+
+        def __call__(self, *args, **kwargs):
+            return args[0]
+
+    translator = Translator()
+    agent = FixtureAgent(toolbox={"translator": translator})
+
+    output = run(agent, "Use the translator")
+
+    assert output.value == "Use the translator"
+    assert dict(agent.cached_tools)["translator"] is translator
+    # The tools resolved are reused by the next runs
+    with mock.patch.object(custom_run, "resolve_tools", wraps=custom_run.resolve_tools) as resolve:
+        assert run(agent, "Use the translator").value == "Use the translator"
+    assert resolve.call_args.kwargs["cached_tools"] == agent.cached_tools
+    assert resolve.call_args.kwargs["cached_tools"] is not agent.cached_tools
@@ -0,0 +1,90 @@
+"""We can check the integrity of a Store and repair it"""
+# pylint: disable=missing-function-docstring
+import os
+import time
+
+import pytest
+
+from transformers_agent_ui.domain.fsck import check_store
+from transformers_agent_ui.domain.store import Store
+
+pytestmark = pytest.mark.filterwarnings("ignore:Saved type")
+
+
+def _age(path, seconds=3600):
+    modified = time.time() - seconds
+    os.utime(path, (modified, modified))
+
+
+@pytest.fixture(name="store")
+def _store(tmp_path):
+    store = Store(path=tmp_path)
+    for index in range(5):
+        store.write("HuggingFace", "Starcoder", f"Task {index}", {}, "A", "B", "C", index)
+    store.write_tool_result("key", "tool", "result")
+    for path in store.asset_path.iterdir():
+        _age(path)
+    return store
+
+
+def test_consistent_store(store):
+    report = check_store(store, chunk_size=2)
+
+    assert (report.rows, report.files) == (6, 6)
+    assert (report.dropped_rows, report.removed_files, report.rebuilt_index) == (0, 0, False)
+
+
+def test_check_store(store):
+    # Given a run with a missing asset, an empty tool result, a file left by an interrupted write
+    # and an unreferenced asset
+    runs, _ = store.query_runs(limit=5)
+    (store.asset_path / runs[0]["value"]).unlink()
+    tool_result = next(
+        path
+        for path in store.asset_path.iterdir()
+        if path.name not in {run["value"] for run in runs}
+    )
+    tool_result.write_bytes(b"")
+    _age(tool_result)
+    temporary_file = store.asset_path / "interrupted.pickle.tmp"
+    temporary_file.write_bytes(b"partial")
+    _age(temporary_file)
+    store.delete("HuggingFace", "Starcoder", runs[1]["task"])
+    unreferenced = store.asset_path / "unreferenced.pickle"
+    unreferenced.write_bytes(b"value")
+    _age(unreferenced)
+    # And a new file of a write in progress
+    in_progress = store.asset_path / "in-progress.pickle.tmp"
+    in_progress.write_bytes(b"partial")
+    # When
+    report = check_store(store, chunk_size=2, workers=2)
+    # Then
+    assert report.dropped_rows == 2
+    assert report.removed_files == 3
+    assert {path.name for path in store.asset_path.iterdir()} == {
+        *[run["value"] for run in runs[2:]],
+        in_progress.name,
+    }
+    assert not store.exists("HuggingFace", "Starcoder", runs[0]["task"], {})
+    with pytest.raises(KeyError):
+        store.read_tool_result("key")
+    assert check_store(store).dropped_rows == 0
+
+
+def test_dry_run(store):
+    runs, _ = store.query_runs(limit=5)
+    (store.asset_path / runs[0]["value"]).unlink()
+
+    report = check_store(store, repair=False)
+
+    assert report.dropped_rows == 1
+    assert store.exists("HuggingFace", "Starcoder", runs[0]["task"], {})
+
+
+def test_verify(store):
+    runs, _ = store.query_runs(limit=1)
+    (store.asset_path / runs[0]["value"]).write_bytes(b"corrupt")
+
+    assert check_store(store).dropped_rows == 0
+    assert check_store(store, verify=True).dropped_rows == 1
+    assert check_store(store, verify=True).removed_files == 0
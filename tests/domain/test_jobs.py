@@ -0,0 +1,175 @@
+"""We can run tasks as jobs of a persistent queue and watch their status"""
+# pylint: disable=missing-function-docstring
+import time
+from unittest import mock
+
+import pytest
+
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.jobs import (
+    BATCH,
+    CANCELLED,
+    DONE,
+    FAILED,
+    INTERACTIVE,
+    PENDING,
+    RUNNING,
+    Job,
+    JobQueue,
+    QueueFullError,
+)
+from transformers_agent_ui.domain.store import Store
+
+
+def _wait(job_queue: JobQueue, job: Job, timeout: float = 10.0) -> Job:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        current = job_queue.get(job.id)
+        if current is not None and current.is_finished:
+            return current
+        time.sleep(0.01)
+    raise TimeoutError(job.id)
+
+
+def test_run_job(tmp_path):
+    store = Store(tmp_path)
+    job = Job(agent="Offline", model="fixtures", task="Say hello")
+    statuses = []
+    job.watch(lambda job: statuses.append(job.status))
+
+    job.run(store)
+
+    assert statuses == [RUNNING, DONE]
+    assert job.value == "Hello"
+    assert job.error == ""
+    assert job.match_score is None
+    assert (store.asset_path / job.asset).exists()
+    assert job.to_dict()["value"] == "Hello"
+    asset = job.asset
+    # When run again
+    job = Job(agent="Offline", model="fixtures", task="Say hello")
+    job.run(store)
+    # Then the run is read from the cache
+    assert job.match_score == 1.0
+    assert job.matched_task == "Say hello"
+    assert job.value == "Hello"
+    assert job.asset == asset
+
+
+def test_run_job_without_token(tmp_path):
+    job = Job(agent="HuggingFace", model="Starcoder", task="Say hello")
+
+    with mock.patch("transformers_agent_ui.domain.token.TokenManager.get", return_value=""):
+        job.run(Store(tmp_path))
+
+    assert job.status == FAILED
+    assert job.error == "No token found for agent 'HuggingFace'"
+    assert job.value is None
+
+
+def test_interactive_jobs_run_first(tmp_path):
+    job_queue = JobQueue(store=Store(tmp_path), max_concurrency=1)
+    batch = job_queue.submit(Job(agent="Offline", model="fixtures", task="Batch", priority=BATCH))
+    interactive = job_queue.submit(
+        Job(agent="Offline", model="fixtures", task="Interactive", priority=INTERACTIVE)
+    )
+    assert job_queue.count_pending() == 2
+
+    job_queue.start()
+    try:
+        batch, interactive = _wait(job_queue, batch), _wait(job_queue, interactive)
+    finally:
+        job_queue.stop()
+
+    assert interactive.value == "Interactive"
+    assert interactive.finished <= batch.started
+
+
+def test_jobs_are_persisted(tmp_path):
+    # Given a job submitted by a process
+    job_queue = JobQueue(store=Store(tmp_path))
+    job = job_queue.submit(
+        Job(agent="Offline", model="fixtures", task="Return the text", kwargs={"text": "Hi"})
+    )
+    # When another process starts
+    job_queue = JobQueue(store=Store(tmp_path)).start()
+    try:
+        # Then it runs the job
+        job = _wait(job_queue, job)
+    finally:
+        job_queue.stop()
+    assert job.status == DONE
+    assert job.kwargs == {"text": "Hi"}
+    assert job.value is None
+    assert job_queue.read_value(job) == "Hi"
+
+
+def test_jobs_of_expired_leases_are_resumed(tmp_path):
+    # Given a job claimed by a process that crashed
+    job_queue = JobQueue(store=Store(tmp_path), lease=0.1)
+    job = job_queue.submit(Job(agent="Offline", model="fixtures", task="Say hello"))
+    assert job_queue._claim() is job  # pylint: disable=protected-access
+    job_queue = JobQueue(store=Store(tmp_path), lease=0.1)
+    assert job_queue.get(job.id).status == RUNNING
+    assert job_queue._claim() is None  # pylint: disable=protected-access
+    # When the lease has expired
+    time.sleep(0.2)
+    job_queue.start()
+    try:
+        # Then the job is run again
+        assert _wait(job_queue, job).status == DONE
+    finally:
+        job_queue.stop()
+
+
+def test_queue_full(tmp_path):
+    job_queue = JobQueue(store=Store(tmp_path), max_pending=1)
+    job_queue.submit(Job(agent="Offline", model="fixtures", task="Say hello"))
+
+    with pytest.raises(QueueFullError):
+        job_queue.submit(Job(agent="Offline", model="fixtures", task="Say bye"))
+    assert job_queue.count_pending() == 1
+    assert job_queue.get("unknown") is None
+
+
+def test_finished_jobs_are_forgotten(tmp_path):
+    job_queue = JobQueue(store=Store(tmp_path), max_jobs=1).start()
+    try:
+        first = _wait(job_queue, job_queue.submit(Job("Offline", "fixtures", "Say hello")))
+        second = _wait(job_queue, job_queue.submit(Job("Offline", "fixtures", "Say bye")))
+    finally:
+        job_queue.stop()
+
+    assert job_queue.get(first.id) is None
+    assert job_queue.get(second.id).status == DONE
+    assert job_queue.get(second.id).to_dict()["status"] == DONE
+    assert PENDING not in (first.status, second.status)
+
+
+def test_cancel_pending_job(tmp_path):
+    job_queue = JobQueue(store=Store(tmp_path))
+    job = job_queue.submit(Job(agent="Offline", model="fixtures", task="Say hello"))
+
+    assert job_queue.cancel(job.id) is job
+
+    assert job.status == CANCELLED
+    assert job_queue.count_pending() == 0
+    assert JobQueue(store=Store(tmp_path)).get(job.id).status == CANCELLED
+    assert job_queue.cancel("unknown") is None
+
+
+def test_cancel_running_job(tmp_path):
+    models = {**AGENT_CONFIGURATION["Offline"]["models"], "slow": {"path": None, "delay": 5.0}}
+    job_queue = JobQueue(store=Store(tmp_path)).start()
+    try:
+        with mock.patch.dict(AGENT_CONFIGURATION["Offline"], {"models": models}):
+            job = job_queue.submit(Job(agent="Offline", model="slow", task="Say hello"))
+            while job.status != RUNNING:
+                time.sleep(0.01)
+            job_queue.cancel(job.id)
+            job = _wait(job_queue, job, timeout=2)
+    finally:
+        job_queue.stop()
+
+    assert job.status == CANCELLED
+    assert job.error == "The run was cancelled"
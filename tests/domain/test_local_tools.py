@@ -0,0 +1,115 @@
+"""We can share the local tools across agents within a memory budget"""
+# pylint: disable=missing-function-docstring, missing-class-docstring, arguments-differ
+# pylint: disable=too-few-public-methods
+from concurrent.futures import wait
+
+import pytest
+import torch
+from transformers.tools import Tool
+from transformers.tools.agents import PreTool
+
+from transformers_agent_ui.domain.local_tools import LocalToolPool, get_memory_size, quantize_tool
+
+# The size of the weights and bias of a Linear(256, 256) layer
+SIZE = (256 * 256 + 256) * 4
+
+
+class LinearTool(Tool):
+    def __init__(self, task):
+        super().__init__()
+        self.task = task
+        self.model = None
+        # Set like the device of a PipelineTool. None runs on the CPU
+        self.device = None
+
+    def setup(self):
+        self.model = torch.nn.Sequential(torch.nn.Linear(256, 256))
+        self.is_initialized = True
+
+    def __call__(self, value):
+        return self.model(value)
+
+
+class Loader:
+    def __init__(self):
+        self.loaded = []
+
+    def __call__(self, task_or_repo_id, **kwargs):
+        self.loaded.append(task_or_repo_id)
+        return LinearTool(task_or_repo_id)
+
+
+def test_get_loads_once():
+    # Given
+    load = Loader()
+    pool = LocalToolPool(load=load)
+    # When
+    tool = pool.get("image-captioning")
+    # Then
+    assert pool.get("image-captioning") is tool
+    assert tool.is_initialized
+    assert load.loaded == ["image-captioning"]
+    assert get_memory_size(tool) == SIZE == pool.memory
+
+
+def test_least_recently_used_tools_are_unloaded():
+    # Given
+    load = Loader()
+    pool = LocalToolPool(load=load, max_memory=2 * SIZE)
+    pool.get("image-captioning")
+    pool.get("text-to-speech")
+    pool.get("image-captioning")
+    # When
+    pool.get("summarization")
+    # Then
+    assert pool.loaded == ["image-captioning", "summarization"]
+    assert pool.memory == 2 * SIZE
+
+
+def test_preload():
+    load = Loader()
+    pool = LocalToolPool(load=load)
+    wait(pool.preload(["image-captioning", "text-to-speech"]))
+    assert sorted(pool.loaded) == ["image-captioning", "text-to-speech"]
+
+
+def test_quantize():
+    pool = LocalToolPool(load=Loader(), quantize=True)
+    tool = pool.get("image-captioning")
+    assert isinstance(tool.model[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert tool(torch.ones(1, 256)).shape == (1, 256)
+
+
+@pytest.mark.parametrize(
+    ["device", "is_quantized"],
+    [(torch.device("cpu"), True), ("cpu", True), (torch.device("cuda", 0), False)],
+)
+def test_quantize_tool_by_device(device, is_quantized):
+    # Given a tool with a device like a PipelineTool
+    tool = LinearTool("image-captioning")
+    tool.setup()
+    tool.device = device
+    # When
+    quantize_tool(tool)
+    # Then
+    assert isinstance(tool.model[0], torch.ao.nn.quantized.dynamic.Linear) == is_quantized
+
+
+def test_resolve_tools():
+    # Given
+    load = Loader()
+    pool = LocalToolPool(load=load)
+    custom_tool = LinearTool("custom")
+    toolbox = {
+        "image_captioner": PreTool(task="image-captioning", description="", repo_id=None),
+        "text_reader": PreTool(task="text-to-speech", description="", repo_id=None),
+        "custom_tool": custom_tool,
+    }
+    # When
+    tools = pool.resolve_tools("caption = image_captioner(image)\ncustom_tool(caption)", toolbox)
+    # Then
+    assert tools["image_captioner"] is pool.get("image-captioning")
+    assert tools["custom_tool"] is custom_tool
+    assert "text_reader" not in tools
+    assert "print" in tools
+    assert load.loaded == ["image-captioning"]
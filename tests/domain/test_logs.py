@@ -0,0 +1,110 @@
+"""We can log the runs per session and as JSON"""
+# pylint: disable=missing-function-docstring
+import json
+import logging
+import threading
+
+import numpy as np
+from PIL import Image
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.logs import (
+    LOGGER_NAME,
+    JsonFormatter,
+    LogBuffer,
+    SessionLogHandler,
+    ValueSummary,
+    capture_logs,
+    configure_logging,
+)
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+
+log = logging.getLogger("transformers_agent_ui.tests")
+
+
+class StubAgent(TransformersAgent):
+    """Runs without calling an inference endpoint"""
+
+    def _run_or_read_from_cache(self, kwargs) -> bool:
+        self.param.update(prompt="prompt", explanation="explanation", code="code")
+        self.value = Image.new("RGB", (1000, 800))
+        return False
+
+
+def test_log_buffer_is_bounded():
+    buffer = LogBuffer(max_lines=3)
+
+    buffer.append("a\nb")
+    assert buffer.flush() == ["a", "b"]
+    assert not buffer.flush()
+
+    buffer.append("c\nd\ne\nf")
+    assert buffer.lines == ["d", "e", "f"]
+    assert buffer.flush() == ["d", "e", "f"]
+
+
+def test_capture_logs_of_the_current_context_only():
+    handler = SessionLogHandler()
+    other_handler = SessionLogHandler()
+
+    def log_other_session():
+        with capture_logs(other_handler):
+            log.info("other session")
+
+    with capture_logs(handler):
+        log.info("this session")
+        thread = threading.Thread(target=log_other_session)
+        thread.start()
+        thread.join()
+    log.info("no session")
+
+    assert [line.endswith("this session") for line in handler.buffer.lines] == [True]
+    assert [line.endswith("other session") for line in other_handler.buffer.lines] == [True]
+
+
+def test_run_logs_a_summary_of_the_value():
+    handler = SessionLogHandler()
+    agent = StubAgent(cache=InMemoryStore(), log_handler=handler, use_cache=False)
+
+    agent.run()
+
+    lines = handler.buffer.lines
+    assert lines[-1].endswith("Result: <Image mode=RGB size=(1000, 800)>")
+
+
+def test_value_summary_truncates_text():
+    assert str(ValueSummary("a" * 10, max_length=4)) == "aaaa... (10 characters)"
+    assert str(ValueSummary(1)) == "1"
+    assert str(ValueSummary(np.zeros((2, 3)))) == "<ndarray shape=(2, 3) dtype=float64>"
+
+
+def test_json_formatter_includes_extras():
+    record = logging.makeLogRecord(
+        {"name": "transformers_agent_ui", "levelname": "INFO", "msg": "Hi %s", "args": ("you",)}
+    )
+    record.agent = "HuggingFace"
+
+    data = json.loads(JsonFormatter().format(record))
+
+    assert data["message"] == "Hi you"
+    assert data["level"] == "INFO"
+    assert data["agent"] == "HuggingFace"
+    assert "args" not in data
+
+
+def test_configure_logging_once():
+    logger = logging.getLogger(LOGGER_NAME)
+    handlers, level, propagate = list(logger.handlers), logger.level, logger.propagate
+    configure_logging.cache_clear()
+    try:
+        handler = configure_logging()
+        assert configure_logging() is handler
+        # The configuration was run again after clearing the cache
+        assert handler not in handlers
+        assert logger.handlers.count(handler) == 1
+    finally:
+        logger.handlers = handlers
+        logger.setLevel(level)
+        logger.propagate = propagate
+        # The handler of the cache was removed. So the next call configures the logging again
+        configure_logging.cache_clear()
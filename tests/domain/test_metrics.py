@@ -0,0 +1,94 @@
+"""We can collect metrics of the runs in the Prometheus text format"""
+# pylint: disable=missing-function-docstring
+import pytest
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.metrics import (
+    RUN_SECONDS,
+    RUNS,
+    STORE_RUNS,
+    TOOL_SECONDS,
+    MetricsRegistry,
+    time_tools,
+)
+from transformers_agent_ui.domain.store import Store
+
+LABELS = {"agent": "HuggingFace", "model": "StarcoderBase"}
+
+
+class StubAgent(TransformersAgent):
+    """Runs without calling an inference endpoint"""
+
+    def _run_or_read_from_cache(self, kwargs) -> bool:
+        if self._find_cached_task():
+            self.param.update(**self.cache.read(self.agent, self.model, self.task, self.kwargs))
+            return False
+        self.param.update(prompt="prompt", explanation="explanation", code="code", value=self.task)
+        return False
+
+
+def test_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("calls_total", "The calls", ["tool"])
+    histogram = registry.histogram("call_seconds", "The calls", ["tool"], buckets=[0.1, 1])
+
+    counter.inc(tool='say "hi"')
+    counter.inc(2, tool='say "hi"')
+    histogram.observe(0.5, tool="a")
+
+    assert registry.counter("calls_total", "The calls", ["tool"]) is counter
+    assert registry.render() == (
+        "# HELP transformers_agent_ui_calls_total The calls\n"
+        "# TYPE transformers_agent_ui_calls_total counter\n"
+        'transformers_agent_ui_calls_total{tool="say \\"hi\\""} 3\n'
+        "# HELP transformers_agent_ui_call_seconds The calls\n"
+        "# TYPE transformers_agent_ui_call_seconds histogram\n"
+        'transformers_agent_ui_call_seconds_bucket{tool="a",le="0.1"} 0\n'
+        'transformers_agent_ui_call_seconds_bucket{tool="a",le="1"} 1\n'
+        'transformers_agent_ui_call_seconds_bucket{tool="a",le="+Inf"} 1\n'
+        'transformers_agent_ui_call_seconds_sum{tool="a"} 0.5\n'
+        'transformers_agent_ui_call_seconds_count{tool="a"} 1\n'
+    )
+
+
+def test_labels_are_required():
+    counter = MetricsRegistry().counter("calls_total", "The calls", ["tool"])
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_run_counts_cache_hits():
+    agent = StubAgent(cache=InMemoryStore(), task="metrics test task", **LABELS)
+    runs = RUNS.get(outcome="run", **LABELS)
+    cache_hits = RUNS.get(outcome="cache_hit", **LABELS)
+    cached_runs = RUN_SECONDS.get_count(source="cache", **LABELS)
+
+    agent.run()
+    agent.run()
+
+    assert RUNS.get(outcome="run", **LABELS) == runs + 1
+    assert RUNS.get(outcome="cache_hit", **LABELS) == cache_hits + 1
+    assert RUN_SECONDS.get_count(source="cache", **LABELS) == cached_runs + 1
+
+
+def test_time_tools():
+    count = TOOL_SECONDS.get_count(tool="metrics_tool", **LABELS)
+    tools = time_tools({"metrics_tool": lambda text: text.upper(), "print": print}, LABELS)
+
+    assert tools["metrics_tool"]("a") == "A"
+    assert tools["print"] is print
+    assert TOOL_SECONDS.get_count(tool="metrics_tool", **LABELS) == count + 1
+
+
+def test_store_runs(tmp_path):
+    store = Store(path=tmp_path)
+
+    store.write(task="a", kwargs={}, prompt="", explanation="", code="", value="a", **LABELS)
+    store.write(task="b", kwargs={}, prompt="", explanation="", code="", value="b", **LABELS)
+    store.delete(task="a", **LABELS)
+
+    assert STORE_RUNS.get(path=str(tmp_path)) == 1
+    # The runs are counted when the Store is opened
+    Store(path=tmp_path)
+    assert STORE_RUNS.get(path=str(tmp_path)) == 1
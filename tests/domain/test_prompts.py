@@ -0,0 +1,135 @@
+"""We can make the prompts smaller by only describing the tools relevant to the task"""
+# pylint: disable=missing-function-docstring, redefined-outer-name
+import pytest
+from transformers.tools import Tool
+from transformers.tools.agents import resolve_tools
+
+from transformers_agent_ui.domain.custom_run import run
+from transformers_agent_ui.domain.prompts import PromptBuilder
+
+TEMPLATE = """Use the tools.
+
+Tools:
+<<all_tools>>
+
+
+Task: "Translate the `question` to English and answer it about the `image`"
+
+I will use the following tools: `translator` and then `image_qa`.
+
+Answer:
+```py
+question = translator(question, src_lang="French", tgt_lang="English")
+answer = image_qa(image=image, question=question)
+```
+
+Task: "Summarize the `text` and read it out loud"
+
+I will use the following tools: `summarizer` and then `text_reader`.
+
+Answer:
+```py
+summary = summarizer(text)
+audio = text_reader(summary)
+```
+
+Task: "<<prompt>>"
+
+I will use the following tools:"""
+DESCRIPTIONS = {
+    "image_captioner": "This is a tool that generates a description of an image.",
+    "image_qa": "This is a tool that answers a question about an image.",
+    "image_segmenter": "This is a tool that creates a segmentation mask of an image.",
+    "summarizer": "This is a tool that summarizes an English text.",
+    "text_reader": "This is a tool that reads an English text out loud.",
+    "transcriber": "This is a tool that transcribes an audio into text.",
+    "translator": "This is a tool that translates text from a language to another.",
+}
+
+
+class StubTool(Tool):
+    """A tool that returns its first input"""
+
+    def __init__(self, name: str, description: str):
+        super().__init__()
+        self.name = name
+        self.description = description
+
+    def __call__(self, *args, **kwargs):
+        return args[0] if args else next(iter(kwargs.values()))
+
+
+class StubAgent:
+    """An agent with a run prompt template completing with code reading and translating a text"""
+
+    run_prompt_template = TEMPLATE
+
+    def __init__(self):
+        self.toolbox = {name: StubTool(name, text) for name, text in DESCRIPTIONS.items()}
+        self.cached_tools = None
+        self.prompts = []
+
+    def format_prompt(self, task):
+        return TEMPLATE.replace("<<all_tools>>", "all tools").replace("<<prompt>>", task)
+
+    def generate_one(self, prompt, stop):  # pylint: disable=unused-argument
+        self.prompts.append(prompt)
+        return """`translator` and `text_reader`.
+
+Answer:
+```py
+translated = translator(text, src_lang="French", tgt_lang="English")
+audio = text_reader(translated)
+```"""
+
+
+@pytest.fixture
+def agent():
+    return StubAgent()
+
+
+def test_select_relevant_tools(agent):
+    builder = PromptBuilder(max_tools=2)
+
+    assert builder.select_tools("Translate the text to German", agent.toolbox) == ["translator"]
+    assert set(builder.select_tools("Summarize the text and read it out loud", agent.toolbox)) == {
+        "summarizer",
+        "text_reader",
+    }
+    # All tools if none is relevant
+    assert builder.select_tools("Hello", agent.toolbox) == list(agent.toolbox)
+
+
+def test_format_smaller_prompt(agent):
+    builder = PromptBuilder(max_examples=1)
+
+    prompt = builder.format_prompt(agent, "Summarize the `text` and read it out loud")
+
+    assert "- summarizer: " in prompt
+    assert "- text_reader: " in prompt
+    assert "- translator: " not in prompt
+    # Only the example using the selected tools is kept
+    assert "summary = summarizer(text)" in prompt
+    assert "image_qa(image=image" not in prompt
+    assert prompt.endswith(
+        'Task: "Summarize the `text` and read it out loud"\n\nI will use the following tools:'
+    )
+    assert len(prompt) < len(TEMPLATE.replace("<<all_tools>>", "\n".join(DESCRIPTIONS.values())))
+
+
+def test_fall_back_to_the_prompt_of_the_agent(agent):
+    agent.run_prompt_template = "No placeholders"
+
+    assert PromptBuilder().format_prompt(agent, "Read it") == agent.format_prompt("Read it")
+
+
+def test_generated_code_resolves_via_the_full_toolbox(agent):
+    # Given
+    builder = PromptBuilder(max_tools=1)
+    # When
+    output = run(agent, "Translate the text", prompt_builder=builder, max_workers=1, text="Bonjour")
+    # Then the prompt only describes the translator but all tools used by the code resolve
+    assert "- text_reader: " not in agent.prompts[-1]
+    assert output.value == "Bonjour"
+    tools = resolve_tools(output.code, agent.toolbox)
+    assert {"translator", "text_reader"} <= set(tools)
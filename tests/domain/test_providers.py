@@ -0,0 +1,86 @@
+"""We can register providers of agents and run the offline fixture provider"""
+# pylint: disable=missing-function-docstring
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.providers import (
+    Capabilities,
+    FixtureAgent,
+    Provider,
+    create_agent,
+    get_capabilities,
+    get_provider,
+    register_provider,
+)
+from transformers_agent_ui.domain.token import EnvTokenProvider, TokenManager
+
+
+def test_fixture_agent():
+    agent = FixtureAgent()
+
+    assert "result = text" in agent.generate_one(agent.format_prompt("Return the text"), [])
+    assert "result = 'Do it'" in agent.generate_one(agent.format_prompt("Do it"), [])
+    assert len(agent.generate_many(["Task: a", "Task: b"], [])) == 2
+
+
+def test_run_offline_agent():
+    token_manager = TokenManager(provider=EnvTokenProvider(env_values={}))
+    agent = TransformersAgent(
+        agent="Offline", cache=InMemoryStore(), sandbox=None, token_manager=token_manager
+    )
+
+    agent.param.update(task="Return the text", kwargs={"text": "Hello"})
+    assert agent.run() == "Hello"
+    agent.param.update(task="Anything", kwargs={})
+    assert agent.run() == "Anything"
+
+
+def test_capabilities():
+    assert not get_capabilities("Offline").requires_token
+    assert get_capabilities("HuggingFace").requires_token
+    with mock.patch.dict(AGENT_CONFIGURATION["Offline"], {"capabilities": {"max_concurrency": 2}}):
+        assert get_capabilities("Offline").max_concurrency == 2
+
+
+def test_register_provider():
+    class SlowAgent(FixtureAgent):
+        """Counts the concurrent generations"""
+
+        running = 0
+        max_running = 0
+        lock = threading.Lock()
+
+        def generate_one(self, prompt, stop):
+            with self.lock:
+                SlowAgent.running += 1
+                SlowAgent.max_running = max(SlowAgent.max_running, SlowAgent.running)
+            time.sleep(0.05)
+            with self.lock:
+                SlowAgent.running -= 1
+            return super().generate_one(prompt, stop)
+
+    register_provider(
+        Provider("slow", lambda model, configuration: SlowAgent(), Capabilities(max_concurrency=2))
+    )
+    configuration = {"provider": "slow", "default": "slow", "models": {"slow": {}}}
+    with mock.patch.dict(AGENT_CONFIGURATION, {"Slow": configuration}):
+        assert get_provider("Slow").name == "slow"
+        agent = create_agent("Slow", "slow")
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(lambda _: agent.generate_one("Task: a", []), range(6)))
+
+    assert SlowAgent.max_running == 2
+
+
+def test_unknown_provider():
+    configuration = {"provider": "unknown", "default": "a", "models": {"a": {}}}
+    with mock.patch.dict(AGENT_CONFIGURATION, {"Unknown": configuration}):
+        with pytest.raises(ValueError):
+            get_provider("Unknown")
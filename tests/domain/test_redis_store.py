@@ -0,0 +1,95 @@
+"""We can share the runs across server processes via Redis"""
+# pylint: disable=redefined-outer-name, missing-function-docstring
+import threading
+import time
+
+import pytest
+
+from transformers_agent_ui.domain.redis_store import RedisStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+AGENT = "HuggingFace"
+MODEL = "StarcoderBase"
+TASK = "Generate an image of a boat in the water"
+OUTPUT = {
+    "prompt": "A",
+    "explanation": "B",
+    "code": "C",
+    "value": "A boat in the water",
+    "model_used": "Starcoder",
+}
+
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two stores as used by two server processes sharing a Redis server and an asset directory"""
+    server = fakeredis.FakeServer()
+    return [
+        RedisStore(client=fakeredis.FakeRedis(server=server), asset_path=tmp_path, lock_timeout=5)
+        for _ in range(2)
+    ]
+
+
+def test_run_is_shared(stores):
+    # When
+    stores[0].write(AGENT, MODEL, TASK, {}, **OUTPUT)
+    # Then
+    assert stores[1].exists(AGENT, MODEL, TASK, {})
+    assert stores[1].read(AGENT, MODEL, TASK, {}) == OUTPUT
+
+
+def test_large_values_are_written_to_the_asset_directory(tmp_path):
+    store = RedisStore(client=fakeredis.FakeRedis(), asset_path=tmp_path, max_inline_size=1)
+
+    store.write(AGENT, MODEL, TASK, {}, **OUTPUT)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert store.read(AGENT, MODEL, TASK, {}) == OUTPUT
+
+    store.delete(AGENT, MODEL, TASK)
+    assert not list(tmp_path.iterdir())
+
+
+def test_single_flight(stores):
+    """A run computed by one process is a hit in the other processes waiting for it"""
+    computed = []
+
+    def run(store):
+        with store.single_flight(AGENT, MODEL, TASK):
+            if not store.exists(AGENT, MODEL, TASK, {}):
+                time.sleep(0.2)
+                computed.append(store)
+                store.write(AGENT, MODEL, TASK, {}, **OUTPUT)
+
+    threads = [threading.Thread(target=run, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(computed) == 1
+
+
+def test_lock_expires(stores):
+    """A lock held by a crashed process does not block forever"""
+    stores[0].lock_timeout = 0.2
+    stores[0].single_flight(AGENT, MODEL, TASK).acquire()
+
+    start = time.perf_counter()
+    with stores[1].single_flight(AGENT, MODEL, TASK):
+        assert time.perf_counter() - start < 2
+
+
+@pytest.mark.parametrize("max_inline_size", [1024, 1])
+def test_evicted_tool_result_is_a_cache_miss(tmp_path, max_inline_size):
+    # Given a tool result whose value is evicted by another process after it was looked up
+    client = fakeredis.FakeRedis()
+    store = RedisStore(client=client, asset_path=tmp_path, max_inline_size=max_inline_size)
+    store.write_tool_result(key="key", tool="translator", value="Hello")
+    for value_key in client.keys("*values:*"):
+        client.delete(value_key)
+    for path in tmp_path.iterdir():
+        path.unlink()
+    # When/ Then
+    with pytest.raises(KeyError):
+        store.read_tool_result("key")
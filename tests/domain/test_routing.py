@@ -0,0 +1,119 @@
+"""We can route the generations between the models of an agent by their latency and errors"""
+# pylint: disable=missing-function-docstring, redefined-outer-name
+import time
+from unittest import mock
+
+import pytest
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.config import AGENT_CONFIGURATION
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.providers import FixtureAgent
+from transformers_agent_ui.domain.routing import (
+    ModelStats,
+    RoutedAgent,
+    clear_stats,
+    get_candidates,
+    get_stats,
+)
+
+
+class FailingAgent(FixtureAgent):
+    """An agent whose generations fail"""
+
+    def generate_one(self, prompt, stop):
+        raise ValueError("Service Unavailable")
+
+
+AGENTS = {"fast": FixtureAgent(), "slow": FixtureAgent(delay=0.5), "down": FailingAgent()}
+
+
+def get_agent(agent, model):  # pylint: disable=unused-argument
+    return AGENTS[model]
+
+
+@pytest.fixture(autouse=True)
+def routed():
+    configuration = {
+        "provider": "fixture",
+        "default": "fast",
+        "models": {model: {} for model in AGENTS},
+        "routing": {"min_samples": 2},
+    }
+    clear_stats()
+    with mock.patch.dict(AGENT_CONFIGURATION, {"Routed": configuration}):
+        yield configuration
+    clear_stats()
+
+
+def test_model_stats():
+    stats = ModelStats(window=3)
+    assert stats.latency is None
+    assert stats.error_rate == 0.0
+
+    for latency, ok in [(9.0, False), (1.0, True), (3.0, True), (2.0, False)]:
+        stats.observe(latency, ok)
+
+    assert stats.count == 3
+    assert stats.latency == 2.0
+    assert stats.error_rate == pytest.approx(1 / 3)
+
+
+def test_fall_back_to_the_fastest_other_model():
+    # Given
+    get_stats("Routed", "fast").observe(0.1, ok=True)
+    get_stats("Routed", "slow").observe(0.5, ok=True)
+    agent = RoutedAgent("Routed", "down", get_agent=get_agent)
+    # When
+    result = agent.generate_one(agent.format_prompt("Say hello"), [])
+    # Then
+    assert "Hello" in result
+    assert agent.model_used == "fast"
+    assert get_stats("Routed", "down").error_rate == 1.0
+
+
+def test_skip_unhealthy_model():
+    assert get_candidates("Routed", "down")[0] == "down"
+
+    for _ in range(2):
+        get_stats("Routed", "down").observe(1.0, ok=False)
+
+    assert get_candidates("Routed", "down")[-1] == "down"
+
+
+def test_no_fallback(routed):
+    routed["routing"]["fallback"] = False
+    agent = RoutedAgent("Routed", "down", get_agent=get_agent)
+
+    with pytest.raises(ValueError):
+        agent.generate_one("Task: Say hello", [])
+
+
+def test_hedge_slow_generation(routed):
+    # Given
+    routed["routing"]["hedge_after"] = 0.05
+    get_stats("Routed", "fast").observe(0.01, ok=True)
+    agent = RoutedAgent("Routed", "slow", get_agent=get_agent)
+    # When
+    start = time.perf_counter()
+    agent.generate_one("Task: Say hello", [])
+    # Then
+    assert time.perf_counter() - start < 0.4
+    assert agent.model_used == "fast"
+
+
+def test_run_records_the_model_used():
+    # Given
+    store = InMemoryStore()
+    models = {"down": {}, "fast": {}}
+    with mock.patch.dict(AGENT_CONFIGURATION["Offline"], {"models": models}), mock.patch(
+        "transformers_agent_ui.domain.agent._get_agent", get_agent
+    ):
+        agent = TransformersAgent(
+            agent="Offline", model="down", task="Say hello", cache=store, sandbox=None
+        )
+        # When
+        agent.run()
+    # Then
+    assert agent.model_used == "fast"
+    assert store.read("Offline", "down", "Say hello", {})["model_used"] == "fast"
@@ -0,0 +1,144 @@
+"""We can evaluate the code generated by the agents in worker processes"""
+# pylint: disable=redefined-outer-name, missing-function-docstring, missing-class-docstring
+# pylint: disable=arguments-differ, unused-argument
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+from transformers.tools import Tool
+from transformers.tools.python_interpreter import InterpretorError
+
+from transformers_agent_ui.domain.cancellation import EVALUATE, Cancellation, StageTimeoutError
+from transformers_agent_ui.domain.custom_run import run
+from transformers_agent_ui.domain.sandbox import (
+    MIN_SHARED_MEMORY_SIZE,
+    SHARED_MEMORY_PATH,
+    ProcessSandbox,
+    SandboxLimits,
+    SandboxTimeoutError,
+    decode_value,
+    encode_value,
+)
+
+
+class Doubler(Tool):
+    def __call__(self, value):
+        return value * 2
+
+
+class ArrayGenerator(Tool):
+    def __call__(self, size):
+        return np.ones(size, dtype=np.float32)
+
+
+class Sleeper(Tool):
+    def __call__(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+
+class Spinner(Tool):
+    def __call__(self, value):
+        while True:
+            value += 1
+
+
+TOOLBOX = {
+    "doubler": Doubler(),
+    "array_generator": ArrayGenerator(),
+    "sleeper": Sleeper(),
+    "spinner": Spinner(),
+}
+
+
+@pytest.fixture(scope="module")
+def sandbox():
+    with ProcessSandbox(workers=1, toolbox=TOOLBOX, preload=["doubler"]) as sandbox:
+        yield sandbox
+
+
+def test_evaluate(sandbox):
+    assert sandbox.evaluate("result = doubler(value)", state={"value": 21}) == 42
+
+
+class StubAgent:
+    toolbox = TOOLBOX
+    cached_tools = None
+
+    def format_prompt(self, task):
+        return f"Task: {task}"
+
+    def generate_one(self, prompt, stop):
+        return (
+            "tool: `doubler` to double the value.\n\nAnswer:\n```py\nresult = doubler(value)\n```"
+        )
+
+
+def test_run(sandbox):
+    run_output = run(StubAgent(), "Double the value", sandbox=sandbox, value=4)
+    assert run_output.value == 8
+    assert "doubler" in run_output.code
+
+
+def test_evaluate_error(sandbox):
+    with pytest.raises(InterpretorError):
+        sandbox.evaluate("result = unknown_tool(value)", state={"value": 21})
+
+
+def test_evaluate_large_array(sandbox):
+    size = MIN_SHARED_MEMORY_SIZE
+    result = sandbox.evaluate("result = array_generator(size)", state={"size": size})
+    assert isinstance(result, np.ndarray)
+    assert result.shape == (size,)
+    assert result.sum() == size
+    # Mapped instead of copied where the shared memory blocks are files
+    assert isinstance(result, np.memmap) == Path(SHARED_MEMORY_PATH).is_dir()
+
+
+def test_encode_image():
+    image = Image.new("RGB", (1024, 1024), color="red")
+    kind, payload = encode_value(image)
+    assert kind == "image"
+    result = decode_value(kind, payload)
+    assert result.size == image.size
+    assert result.getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_encode_small_value():
+    assert encode_value([1, 2]) == ("value", [1, 2])
+
+
+def test_wall_time_limit(sandbox):
+    with pytest.raises(SandboxTimeoutError):
+        sandbox.evaluate(
+            "result = sleeper(seconds)",
+            state={"seconds": 30},
+            limits=SandboxLimits(wall_time=0.5),
+        )
+    # The worker is replaced
+    assert sandbox.evaluate("result = doubler(value)", state={"value": 1}) == 2
+
+
+def test_evaluate_timeout(sandbox):
+    cancellation = Cancellation({EVALUATE: 0.5})
+    start = time.perf_counter()
+    with pytest.raises(StageTimeoutError), cancellation.stage(EVALUATE):
+        sandbox.evaluate(
+            "result = sleeper(seconds)", state={"seconds": 30}, cancellation=cancellation
+        )
+    assert time.perf_counter() - start < 10
+    # The worker is replaced
+    assert sandbox.evaluate("result = doubler(value)", state={"value": 1}) == 2
+
+
+def test_cpu_time_limit(sandbox):
+    pytest.importorskip("resource")
+    with pytest.raises(SandboxTimeoutError, match="CPU"):
+        sandbox.evaluate(
+            "result = spinner(value)",
+            state={"value": 1},
+            limits=SandboxLimits(cpu_time=1, wall_time=30),
+        )
+    assert sandbox.evaluate("result = doubler(value)", state={"value": 2}) == 4
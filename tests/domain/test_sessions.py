@@ -0,0 +1,121 @@
+"""We can share pooled, keep-alive HTTP sessions across runs"""
+# pylint: disable=redefined-outer-name, missing-function-docstring
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import pytest
+from huggingface_hub.utils import get_session
+from transformers.tools.base import RemoteTool
+
+from transformers_agent_ui.domain.agent import PooledHfAgent, PooledOpenAiAgent, generate_one
+from transformers_agent_ui.domain.config import HTTP_CONFIGURATION
+from transformers_agent_ui.domain.sessions import (
+    SESSION_POOL,
+    SessionPool,
+    get_configured_endpoints,
+    get_endpoint,
+    use_pooled_sessions,
+)
+from transformers_agent_ui.domain.token import use_token
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """A stub of the Hugging Face inference endpoint counting the connections"""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    authorizations: List[str] = []
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers["Content-Length"])
+        data = json.loads(self.rfile.read(length))
+        type(self).authorizations.append(self.headers["Authorization"])
+        if self.path == "/v1/completions":
+            body = json.dumps({"choices": [{"text": f"{data['prompt'][0]} completed"}]}).encode()
+        else:
+            body = json.dumps([{"generated_text": f"{data['inputs']} completed Task:"}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def url_endpoint():
+    _StubHandler.connections = 0
+    _StubHandler.authorizations = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/models/bigcode/starcoder"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_configured_endpoints():
+    endpoints = get_configured_endpoints()
+
+    assert endpoints["https://api-inference.huggingface.co"] == HTTP_CONFIGURATION
+    assert "https://api.openai.com" in endpoints
+
+
+def test_connections_are_reused(url_endpoint):
+    # Given
+    pool = SessionPool()
+    # When
+    for _ in range(5):
+        session = pool.get(url_endpoint)
+        result = generate_one(session, url_endpoint, "Bearer token", "prompt", stop=["Task:"])
+        assert result == "prompt completed "
+    # Then
+    assert _StubHandler.connections == 1
+    metrics = next(iter(pool.metrics().values()))
+    assert metrics.requests == 5
+    assert metrics.connections == 1
+    assert metrics.reuse_ratio == pytest.approx(0.8)
+
+    pool.close()
+    assert not pool.metrics()
+
+
+def test_shared_agents_use_the_token_of_the_request(url_endpoint):
+    # Constructing the agents downloads the prompt templates
+    hf_agent = object.__new__(PooledHfAgent)
+    hf_agent.url_endpoint, hf_agent.token = url_endpoint, "Bearer default"
+    openai_agent = object.__new__(PooledOpenAiAgent)
+    openai_agent.model = "text-davinci-003"
+    openai_agent.endpoint = url_endpoint.split("/models")[0]
+
+    with use_token("user1"):
+        assert hf_agent.generate_one("prompt", stop=["Task:"]) == "prompt completed "
+    with use_token("user2"):
+        assert openai_agent.generate_one("prompt", stop=["Task:"]) == "prompt completed"
+    hf_agent.generate_one("prompt", stop=["Task:"])
+
+    assert _StubHandler.authorizations == ["Bearer user1", "Bearer user2", "Bearer default"]
+
+
+def test_remote_tools_use_the_pooled_sessions(url_endpoint):
+    # Given
+    tool = RemoteTool(endpoint_url=url_endpoint, token="token")
+    tools = use_pooled_sessions({"tool": tool})
+    # When
+    for _ in range(3):
+        assert tools["tool"]("prompt") == [{"generated_text": "prompt completed Task:"}]
+    # Then
+    metrics = SESSION_POOL.metrics()[get_endpoint(url_endpoint)]
+    assert metrics.requests == 3
+    assert metrics.connections == 1
+    assert tool.client.headers["authorization"] == "Bearer token"
+    # The session of the other Hugging Face Hub clients is not replaced
+    assert get_session() is not SESSION_POOL.get(url_endpoint)
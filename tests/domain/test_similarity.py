@@ -0,0 +1,94 @@
+"""We can serve runs of similar tasks from the cache"""
+# pylint: disable=missing-function-docstring
+from transformers_agent_ui.domain import agent as agent_module
+from transformers_agent_ui.domain.agent import TransformersAgent, get_default_task_index
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.similarity import TaskIndex, normalize_task
+from transformers_agent_ui.domain.token import EnvTokenProvider, TokenManager
+
+AGENT = "HuggingFace"
+MODEL = "StarcoderBase"
+TASK = "Generate an image of a boat in the water"
+SIMILAR_TASK = "generate an image of a boat in water."
+OTHER_TASK = "Generate an image of a car in the water"
+
+
+def _create_agent(**params) -> TransformersAgent:
+    """Returns an agent without a token. So it does not call the inference endpoints"""
+    token_manager = TokenManager(provider=EnvTokenProvider(env_values={}))
+    return TransformersAgent(agent=AGENT, model=MODEL, token_manager=token_manager, **params)
+
+
+def test_normalize_task():
+    assert normalize_task(TASK) == normalize_task(SIMILAR_TASK) == "generate image of boat in water"
+
+
+def test_task_index():
+    # Given
+    index = TaskIndex()
+    index.add(AGENT, MODEL, TASK)
+    index.add(AGENT, MODEL, "Draw me a picture of rivers and lakes.")
+    # Then
+    assert len(index) == 2
+    assert index.search(AGENT, MODEL, TASK) == (TASK, 1.0)
+    assert index.search(AGENT, MODEL, SIMILAR_TASK) == (TASK, 1.0)
+    task, score = index.search(AGENT, MODEL, OTHER_TASK)
+    assert task == TASK and score < 0.9
+    assert index.search(AGENT, "OtherModel", TASK) is None
+
+
+def test_task_index_grows():
+    index = TaskIndex(num_permutations=16)
+    for number in range(100):
+        index.add(AGENT, MODEL, f"task number {number}")
+    assert len(index) == 100
+    assert index.search(AGENT, MODEL, "task number 42") == ("task number 42", 1.0)
+
+
+def test_run_similar_task():
+    # Given
+    store = InMemoryStore()
+    store.write(AGENT, MODEL, TASK, {}, "prompt", "explanation", "code", "value")
+    agent = _create_agent(task=SIMILAR_TASK, cache=store, similarity_threshold=0.9)
+    # When
+    value = agent.run()
+    # Then
+    assert value == "value"
+    assert agent.match_score == 1.0
+    assert agent.matched_task == TASK
+    # The run of the similar task is not copied
+    assert not store.exists(AGENT, MODEL, SIMILAR_TASK, {})
+    # When a dissimilar task is run
+    agent.task = OTHER_TASK
+    agent.run()
+    # Then
+    assert agent.match_score is None
+    assert agent.value == "No output generated"
+
+
+def test_run_similar_task_without_threshold():
+    store = InMemoryStore()
+    store.write(AGENT, MODEL, TASK, {}, "prompt", "explanation", "code", "value")
+    agent = _create_agent(task=SIMILAR_TASK, cache=store)
+    agent.run()
+    assert agent.match_score is None
+    assert agent.value == "No output generated"
+
+
+def test_runs_without_threshold_are_added_to_the_default_task_index(monkeypatch):
+    store = InMemoryStore()
+    monkeypatch.setattr(agent_module, "get_default_store", lambda: store)
+    get_default_task_index.cache_clear()
+    try:
+        # Given a session with a threshold whose index is already created
+        agent = TransformersAgent(
+            agent="Offline", task="say hello.", cache=store, sandbox=None, similarity_threshold=0.9
+        )
+        agent.get_task_index()
+        # When a session without a threshold runs a task
+        TransformersAgent(agent="Offline", task="Say hello", cache=store, sandbox=None).run()
+        # Then the session with a threshold is served its run
+        assert agent.run() == "Hello"
+        assert agent.matched_task == "Say hello"
+    finally:
+        get_default_task_index.cache_clear()
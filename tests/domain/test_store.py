@@ -1,12 +1,46 @@
 """We can store runs"""
 # pylint: disable=redefined-outer-name, (missing-function-docstring
+import sqlite3
+import time
 import warnings
+from datetime import timedelta
 from pathlib import Path
 
 import pytest
 from PIL import Image
 
-from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.domain import s3_store
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.memory_store import CachedStore, InMemoryStore
+from transformers_agent_ui.domain.redis_store import RedisStore
+from transformers_agent_ui.domain.s3_store import S3Store
+from transformers_agent_ui.domain.store import DB_NAME, QUERY_CREATE_TABLE, BaseStore, Store
+
+BUCKET = "transformers-agent"
+
+
+@pytest.fixture
+def s3_client():
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture(params=["local", "memory", "cached", "s3", "redis"])
+def any_store(request, tmp_path) -> BaseStore:
+    if request.param == "memory":
+        return InMemoryStore()
+    if request.param == "cached":
+        return CachedStore(Store(path=tmp_path), max_runs=2)
+    if request.param == "s3":
+        return S3Store(bucket=BUCKET, client=request.getfixturevalue("s3_client"))
+    if request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        return RedisStore(client=fakeredis.FakeRedis(), asset_path=tmp_path, max_inline_size=10)
+    return Store(path=tmp_path)
 
 
 @pytest.fixture
@@ -24,7 +58,7 @@ def test_constructor(store):
     isinstance(store, Store)
 
 
-def test_store(store, image):
+def test_store(any_store, image):
     # Given
     agent = "HuggingFace"
     model = "Starcoder"
@@ -35,7 +69,9 @@ def test_store(store, image):
         "explanation": "B",
         "code": "C",
         "value": image,
+        "model_used": "StarcoderBase",
     }
+    store = any_store
     # Then
     assert not store.exists(agent, model, task, kwargs)
     assert not store.read(agent, model, task, kwargs)
@@ -51,6 +87,51 @@ def test_store(store, image):
     assert not store.read(agent, model, task, kwargs)
 
 
+def test_tool_results(any_store, image):
+    """We can write and read the results of tool calls"""
+    with pytest.raises(KeyError):
+        any_store.read_tool_result("key")
+
+    any_store.write_tool_result(key="key", tool="image_transformer", value=image)
+    assert any_store.read_tool_result("key") == image
+
+
+def test_s3_tool_results_are_evicted_periodically(s3_client, monkeypatch):
+    """The S3Store only lists the tool results to evict every `eviction_interval` writes"""
+    store = S3Store(bucket=BUCKET, client=s3_client, max_tool_results=2, eviction_interval=3)
+    monkeypatch.setattr(s3_store, "REFRESH_INTERVAL", timedelta(0))
+    for key in ("a", "b"):
+        store.write_tool_result(key=key, tool="tool", value=key)
+    # Reading refreshes the result
+    time.sleep(1)
+    assert store.read_tool_result("a") == "a"
+    store.write_tool_result(key="c", tool="tool", value="c")
+    with pytest.raises(KeyError):
+        store.read_tool_result("b")
+    for key in ("d", "e"):
+        store.write_tool_result(key=key, tool="tool", value=key)
+    # Not evicted until the next check
+    assert [store.read_tool_result(key) for key in ("a", "c", "d", "e")] == ["a", "c", "d", "e"]
+
+
+def test_single_flight_locks_are_removed(store):
+    """The lock of a run is shared while held and removed once released"""
+    lock = store.single_flight("A", "B", "C")
+    with lock:
+        assert store.single_flight("A", "B", "C") is lock
+    del lock
+    assert not store._single_flight_locks  # pylint: disable=protected-access
+
+
+def test_write_returns_the_asset(store):
+    """The path of the value written is returned and found again via `get_asset`"""
+    assert store.get_asset("A", "B", "C") == ""
+    path = store.write("A", "B", "C", {}, "prompt", "explanation", "code", "value")
+    assert (store.asset_path / path).exists()
+    assert store.get_asset("A", "B", "C") == path
+    assert CachedStore(store).get_asset("A", "B", "C") == path
+
+
 def test_pickle(store):
     """We can write and read pickle"""
     agent = "A"
@@ -62,6 +143,7 @@ def test_pickle(store):
         "explanation": "B",
         "code": "C",
         "value": pytest.fixture,  # We expect this to be pickled
+        "model_used": "B",
     }
     with warnings.catch_warnings(record=True) as wrn:
         store.write(agent, model, task, kwargs, **output)
@@ -69,3 +151,122 @@ def test_pickle(store):
         assert "Saved type " in str(wrn[-1].message)
     actual = store.read(agent, model, task, kwargs)
     assert actual == output
+
+
+def test_migrate_results_table(tmp_path, image):
+    """We can read the runs of a store created before the model_used column was added"""
+    # Given
+    connection = sqlite3.connect(tmp_path / DB_NAME)
+    connection.execute(QUERY_CREATE_TABLE)
+    connection.execute(
+        "INSERT INTO RESULTS VALUES('2023-06-01 12:00:00', 'A', 'B', 'C', 'prompt', '', 'code', 'x.png')"
+    )
+    connection.commit()
+    connection.close()
+    (tmp_path / "assets").mkdir()
+    image.save(tmp_path / "assets" / "x.png")
+    # When
+    store = Store(path=tmp_path)
+    # Then
+    assert store.read("A", "B", "C", {})["model_used"] == ""
+    store.write("A", "B", "C", {}, "prompt", "", "code", image, model_used="D")
+    assert store.read("A", "B", "C", {})["model_used"] == "D"
+
+
+@pytest.mark.filterwarnings("ignore:Saved type")
+def test_query_runs(store):
+    """We can query the runs page by page"""
+    # Given
+    for index in range(5):
+        model = "Starcoder" if index % 2 else "StarcoderBase"
+        store.write("HuggingFace", model, f"Draw river {index}", {}, "A", "B", "C", index)
+    # When
+    runs, cursor = store.query_runs(limit=2)
+    # Then
+    assert [run["task"] for run in runs] == ["Draw river 4", "Draw river 3"]
+    assert store.read_asset(runs[0]["value"]) == 4
+    # When/ Then
+    runs, cursor = store.query_runs(limit=2, after=cursor)
+    assert [run["task"] for run in runs] == ["Draw river 2", "Draw river 1"]
+    runs, cursor = store.query_runs(limit=2, after=cursor)
+    assert [run["task"] for run in runs] == ["Draw river 0"]
+    assert cursor is None
+    # When/ Then
+    runs, _ = store.query_runs(model="Starcoder")
+    assert [run["task"] for run in runs] == ["Draw river 3", "Draw river 1"]
+    runs, _ = store.query_runs(search="river 2")
+    assert [run["task"] for run in runs] == ["Draw river 2"]
+    runs, _ = store.query_runs(search='"river" OR')
+    assert not runs
+    runs, _ = store.query_runs(start="2000-01-01", end="2001-01-01")
+    assert not runs
+
+
+def test_failed_write_leaves_no_files(tmp_path):
+    store = Store(path=tmp_path)
+
+    with pytest.raises(Exception):
+        store.write("HuggingFace", "Starcoder", "Run", {}, "A", "B", "C", lambda: None)
+
+    assert not list(store.asset_path.iterdir())
+    assert not store.exists("HuggingFace", "Starcoder", "Run", {})
+
+
+def test_read_skips_missing_asset(tmp_path):
+    store = Store(path=tmp_path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        store.write("HuggingFace", "Starcoder", "Run", {}, "A", "B", "C", "first")
+        store.write("HuggingFace", "Starcoder", "Run", {}, "A", "B", "C", "second")
+    runs, _ = store.query_runs()
+    (store.asset_path / runs[0]["value"]).unlink()
+
+    # The run with the missing asset is skipped
+    assert store.read("HuggingFace", "Starcoder", "Run", {})["value"] in ("first", "second")
+    (store.asset_path / runs[1]["value"]).unlink()
+    assert store.read("HuggingFace", "Starcoder", "Run", {}) == {}
+
+
+def test_cache_hits_are_not_written_again(tmp_path):
+    # Given
+    store = Store(path=tmp_path)
+    # When the same task is run three times
+    for _ in range(3):
+        agent = TransformersAgent(agent="Offline", task="Say hello", cache=store, sandbox=None)
+        assert agent.run() == "Hello"
+    # Then it is written once
+    with sqlite3.connect(store.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM RESULTS").fetchone()[0] == 1
+    assert len(list(store.asset_path.iterdir())) == 1
+
+
+def test_optional_capabilities(any_store):
+    # Given
+    any_store.write("HuggingFace", "Starcoder", "Count", {}, "A", "B", "C", 1)
+    # When
+    runs, cursor = any_store.query_runs()
+    tasks = list(any_store.iter_tasks())
+    # Then the stores without the capabilities return no runs
+    assert len(runs) == int(any_store.supports_query_runs)
+    assert cursor is None
+    assert tasks == [("HuggingFace", "Starcoder", "Count")] * int(any_store.supports_iter_tasks)
+    if not any_store.supports_query_runs:
+        with pytest.raises(FileNotFoundError):
+            any_store.read_asset("1.pickle")
+
+
+def test_delete_removes_the_assets(store, image):
+    # Given two runs and a run sharing its asset with another task, like imported runs
+    store.write("HuggingFace", "Starcoder", "Draw a boat", {}, "A", "B", "C", image)
+    store.write("HuggingFace", "Starcoder", "Draw a boat", {}, "A", "B", "C", image)
+    store.write("HuggingFace", "Starcoder", "Draw a lake", {}, "A", "B", "C", image)
+    (run,), _ = store.query_runs(search="lake")
+    store.insert_rows(
+        [[("2000-01-01", "HuggingFace", "Starcoder", "Paint", "A", "B", "C", run["value"], "")]]
+    )
+    # When
+    store.delete("HuggingFace", "Starcoder", "Draw a boat")
+    store.delete("HuggingFace", "Starcoder", "Draw a lake")
+    # Then only the shared asset is kept
+    assert [path.name for path in store.asset_path.iterdir()] == [run["value"]]
+    assert store.read("HuggingFace", "Starcoder", "Paint", {})["value"] == image
@@ -0,0 +1,18 @@
+"""We can configure the Store via an url"""
+# pylint: disable=missing-function-docstring
+import os
+from unittest import mock
+
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.domain.store_factory import STORE_ENV_VALUE, create_store
+
+
+def test_create_store(tmp_path):
+    assert isinstance(create_store("memory://"), InMemoryStore)
+    assert isinstance(create_store(str(tmp_path)), Store)
+
+
+def test_create_store_from_environment_variable():
+    with mock.patch.dict(os.environ, {STORE_ENV_VALUE: "memory://"}):
+        assert isinstance(create_store(), InMemoryStore)
@@ -5,7 +5,13 @@ from unittest import mock
 from transformers_agent_ui.domain.token import (
     HUGGING_FACE_ENV_VALUE,
     OPEN_AI_ENV_VALUE,
+    CachedTokenProvider,
+    ChainTokenProvider,
+    EnvTokenProvider,
+    FileTokenProvider,
     TokenManager,
+    get_request_token,
+    use_token,
 )
 
 
@@ -54,3 +60,41 @@ def test_token_manager_env_set():
     assert manager.get("HuggingFace") == "b"
     manager.open_ai = "a"
     assert manager.get("OpenAI") == "a"
+
+
+def test_token_providers(tmp_path):
+    """The tokens can be provided from files and the lookups cached"""
+    provider = CachedTokenProvider(FileTokenProvider(tmp_path), ttl=60)
+    (tmp_path / HUGGING_FACE_ENV_VALUE).write_text("A\n")
+
+    assert provider.get("HuggingFace") == "A"
+    assert provider.get("OpenAI") == ""
+    assert provider.get("Unknown") == ""
+
+    # When the token is rotated. Then the cached token is used until cleared
+    (tmp_path / HUGGING_FACE_ENV_VALUE).write_text("B")
+    assert provider.get("HuggingFace") == "A"
+    provider.clear()
+    assert provider.get("HuggingFace") == "B"
+
+
+@mock.patch.dict(os.environ, {OPEN_AI_ENV_VALUE: "", HUGGING_FACE_ENV_VALUE: "A"})
+def test_token_manager_provider(tmp_path):
+    """The tokens not set for the session are resolved by the provider"""
+    (tmp_path / OPEN_AI_ENV_VALUE).write_text("B")
+    provider = ChainTokenProvider([EnvTokenProvider(), FileTokenProvider(tmp_path)])
+    manager = TokenManager(provider=provider)
+
+    assert manager.get("HuggingFace") == "A"
+    assert manager.get("OpenAI") == "B"
+    assert manager.open_ai_env_exists
+    manager.open_ai = "a"
+    assert manager.get("OpenAI") == "a"
+
+
+def test_use_token():
+    """The token of the request is set per thread or task"""
+    assert get_request_token() == ""
+    with use_token("A"):
+        assert get_request_token() == "A"
+    assert get_request_token() == ""
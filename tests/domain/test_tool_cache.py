@@ -0,0 +1,80 @@
+"""We can cache the results of the tool calls"""
+# pylint: disable=redefined-outer-name, missing-function-docstring
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from PIL import Image
+
+from transformers_agent_ui.domain.hashing import get_hash, share_hashes
+from transformers_agent_ui.domain.metrics import STORE_SECONDS, TOOL_CACHE_HITS
+from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.domain.tool_cache import CachedTool, cache_tools
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(path=tmp_path, max_tool_results=2)
+
+
+@pytest.fixture
+def image() -> Image.Image:
+    path = Path(__file__).parent / "test_image.png"
+    return Image.open(path)
+
+
+def test_get_hash(image):
+    assert get_hash(image) == get_hash(image.copy())
+    assert get_hash(("a", {"b": 1})) == get_hash(("a", {"b": 1}))
+    assert get_hash("1") != get_hash(1)
+    assert get_hash(image) != get_hash(image.rotate(90))
+
+
+def test_share_hashes(image):
+    expected = get_hash(("image_captioner", (image,), {}))
+
+    with share_hashes({"image": image}):
+        assert get_hash(("image_captioner", (image,), {})) == expected
+        # The content of a shared value is not hashed again
+        with mock.patch.object(image, "tobytes", side_effect=AssertionError):
+            assert get_hash(image) == get_hash(image.copy())
+
+
+def test_cached_tool(store, image):
+    # Given
+    calls = []
+
+    def image_captioner(image):
+        calls.append(image)
+        return "A boat in the water"
+
+    tool = CachedTool(name="image_captioner", tool=image_captioner, store=store)
+    # When/ Then
+    assert tool(image) == "A boat in the water"
+    assert tool(image.copy()) == "A boat in the water"
+    assert len(calls) == 1
+
+
+def test_cache_tools(store):
+    labels = {"agent": "HuggingFace", "model": "cache-tools-model"}
+    tools = cache_tools(
+        {"print": print, "translator": str.upper}, store=store, metric_labels=labels
+    )
+
+    assert tools["print"] is print
+    assert isinstance(tools["translator"], CachedTool)
+    assert tools["translator"]("hello") == "HELLO"
+    assert tools["translator"]("hello") == "HELLO"
+    assert TOOL_CACHE_HITS.get(tool="translator", **labels) == 1
+    assert STORE_SECONDS.get_count(operation="write_tool_result", **labels) == 1
+
+
+def test_tool_results_are_evicted(store):
+    # Given
+    for key in ["a", "b", "c"]:
+        store.write_tool_result(key=key, tool="translator", value=key)
+    # Then
+    with pytest.raises(KeyError):
+        store.read_tool_result("a")
+    assert store.read_tool_result("b") == "b"
+    assert store.read_tool_result("c") == "c"
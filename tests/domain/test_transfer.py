@@ -0,0 +1,86 @@
+"""We can export and import the runs of a Store"""
+# pylint: disable=missing-function-docstring
+import tarfile
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from transformers_agent_ui.domain.store import RESULTS_COLUMNS, Store
+from transformers_agent_ui.domain.transfer import (
+    ASSETS_PREFIX,
+    RESULTS_NAME,
+    export_runs,
+    import_runs,
+)
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.mark.filterwarnings("ignore:Saved type")
+def test_export_and_import(tmp_path):
+    # Given
+    image = Image.open(Path(__file__).parent / "test_image.png")
+    source = Store(path=tmp_path / "source")
+    source.write("HuggingFace", "Starcoder", "Draw a boat", {}, "A", "B", "C", image)
+    source.write("HuggingFace", "Starcoder", "Draw a lake", {}, "A", "B", "C", image)
+    source.write("OpenAI", "text-davinci-003", "Caption", {}, "D", "E", "F", "A boat", "gpt-4")
+    archive = tmp_path / "cache.tar"
+    # When
+    assert export_runs(source, archive, chunk_size=2) == 3
+    # Then the equal images are only exported once
+    with tarfile.open(archive) as file:
+        assert len(file.getnames()) == 3
+    # When
+    target = Store(path=tmp_path / "target")
+    assert import_runs(target, archive, chunk_size=2) == 3
+    # Then
+    assert target.read("HuggingFace", "Starcoder", "Draw a lake", {})["value"] == image
+    assert target.read("OpenAI", "text-davinci-003", "Caption", {}) == {
+        "prompt": "D",
+        "explanation": "E",
+        "code": "F",
+        "value": "A boat",
+        "model_used": "gpt-4",
+    }
+    runs, _ = target.query_runs(search="boat")
+    assert [run["task"] for run in runs] == ["Draw a boat"]
+
+
+def test_import_skips_the_runs_in_the_store(tmp_path):
+    # Given
+    source = Store(path=tmp_path / "source")
+    source.write("OpenAI", "text-davinci-003", "Caption", {}, "D", "E", "F", "A boat")
+    source.write("OpenAI", "text-davinci-003", "Summarize", {}, "G", "H", "I", "A text")
+    archive = tmp_path / "cache.tar"
+    export_runs(source, archive)
+    target = Store(path=tmp_path / "target")
+    assert import_runs(target, archive) == 2
+    # When
+    assert import_runs(target, archive) == 0
+    # Then
+    runs, _ = target.query_runs()
+    assert sorted(run["task"] for run in runs) == ["Caption", "Summarize"]
+
+
+@pytest.mark.parametrize("name", ["../escaped.png", "/tmp/escaped.png", ".."])
+def test_import_rejects_unsafe_asset_names(tmp_path, name):
+    # Given an archive whose run refers to an asset outside of the store
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    row = ["2023-01-01", "OpenAI", "text-davinci-003", "Caption", "D", "E", "F", name, ""]
+    results_path = tmp_path / RESULTS_NAME
+    pq.write_table(
+        pa.table({column: [value] for column, value in zip(RESULTS_COLUMNS, row)}), results_path
+    )
+    archive = tmp_path / "cache.tar"
+    with tarfile.open(archive, "w") as file:
+        file.add(results_path, arcname=RESULTS_NAME)
+        file.add(Path(__file__).parent / "test_image.png", arcname=ASSETS_PREFIX + name)
+    target = Store(path=tmp_path / "target")
+    # When
+    with pytest.raises(ValueError, match="Invalid asset name"):
+        import_runs(target, archive)
+    # Then
+    assert not list(tmp_path.rglob("escaped.png"))
+    assert not target.query_runs()[0]
@@ -0,0 +1,66 @@
+"""We can show the values of the runs without extra copies of them"""
+# pylint: disable=missing-function-docstring
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.domain.values import ValueHandle, to_pcm16
+
+IMAGE_PATH = Path(__file__).parent / "test_image.png"
+
+
+def test_to_pcm16():
+    audio = torch.linspace(-0.5, 0.5, 1000)
+
+    pcm = to_pcm16(audio)
+
+    assert pcm.dtype == np.int16
+    np.testing.assert_array_equal(pcm, (audio.numpy() * 32768.0).astype(np.int16))
+    assert to_pcm16(pcm) is pcm
+
+
+def test_conversions_are_cached():
+    handle = ValueHandle.from_value(torch.zeros(1000))
+
+    assert handle.to_pcm16() is handle.to_pcm16()
+
+
+def test_image_from_file_is_not_decoded():
+    image = Image.open(IMAGE_PATH)
+    handle = ValueHandle.from_value(image)
+
+    assert handle.path == IMAGE_PATH
+    assert handle.to_png() == IMAGE_PATH.read_bytes()
+
+
+def test_image_in_memory_is_encoded():
+    image = Image.new("RGB", (8, 8), color="red")
+
+    png = ValueHandle.from_value(image).to_png()
+
+    assert png.startswith(b"\x89PNG")
+
+
+@pytest.mark.parametrize(
+    ["value", "suffix"],
+    [(torch.arange(10.0), ".pt"), (np.arange(10.0), ".npy"), (np.array([None]), ".pickle")],
+)
+def test_arrays_are_stored_without_pickle(tmp_path, value, suffix):
+    store = Store(tmp_path)
+    with warnings.catch_warnings(record=True) as records:
+        warnings.simplefilter("always")
+        store.write("HuggingFace", "Starcoder", "Run", {}, "A", "B", "C", value)
+
+    (asset,) = store.asset_path.iterdir()
+    read = store.read("HuggingFace", "Starcoder", "Run", {})["value"]
+
+    assert asset.suffix == suffix
+    # Only pickled values are warned about
+    assert bool(records) == (suffix == ".pickle")
+    assert type(read) is type(value) or isinstance(read, np.memmap)
+    np.testing.assert_array_equal(np.asarray(read), np.asarray(value))
@@ -0,0 +1,90 @@
+"""We can pre-warm the cache with the examples"""
+# pylint: disable=missing-function-docstring
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from unittest import mock
+
+from transformers_agent_ui.domain import warmup
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.examples import default, text_to_image
+from transformers_agent_ui.domain.executor import RateLimiter
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.warmup import WARM_UP_ENV_VALUE, on_startup, warm_up
+
+AGENTS = [("HuggingFace", "StarcoderBase")]
+
+
+class StubAgent(TransformersAgent):
+    """Runs without calling an inference endpoint"""
+
+    runs = 0
+
+    def _run_or_read_from_cache(self, kwargs) -> bool:
+        if self.cache.exists(
+            agent=self.agent, model=self.model, task=self.task, kwargs=self.kwargs
+        ):
+            self.param.update(**self.cache.read(self.agent, self.model, self.task, self.kwargs))
+            return False
+        StubAgent.runs += 1
+        self.param.update(prompt="prompt", explanation="explanation", code="code", value=self.task)
+        return False
+
+
+def test_warm_up():
+    # Given
+    store = InMemoryStore()
+    StubAgent.runs = 0
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # When
+        futures = warm_up(
+            examples=[default, text_to_image],
+            agents=AGENTS,
+            store=store,
+            executor=executor,
+            rate_limiter=RateLimiter(rate=1000, burst=2),
+            create_agent=StubAgent,
+        )
+        wait(futures)
+        # Then
+        for future in futures:
+            future.result()
+        assert StubAgent.runs == 2
+        for example in [default, text_to_image]:
+            assert store.exists(*AGENTS[0], task=example.task, kwargs=example.kwargs)
+        # When warming up again the examples in the store are skipped
+        futures = warm_up(
+            examples=[default, text_to_image],
+            agents=AGENTS,
+            store=store,
+            executor=executor,
+            create_agent=_fail,
+        )
+        wait(futures)
+        for future in futures:
+            future.result()
+        assert StubAgent.runs == 2
+
+
+def _fail(**params):
+    raise AssertionError(f"No agent should be created for {params['task']}")
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_on_startup(monkeypatch):
+    monkeypatch.setenv(WARM_UP_ENV_VALUE, "true")
+    with mock.patch.object(warmup, "configure_logging") as configure_logging, mock.patch.object(
+        warmup, "preload_local_tools"
+    ) as preload_local_tools, mock.patch.object(warmup, "start_warm_up") as start_warm_up:
+        on_startup()
+        monkeypatch.setenv(WARM_UP_ENV_VALUE, "false")
+        on_startup()
+
+    assert configure_logging.call_count == preload_local_tools.call_count == 2
+    start_warm_up.assert_called_once_with()
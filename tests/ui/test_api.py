@@ -0,0 +1,137 @@
+"""We can run tasks and fetch their results via the REST and WebSocket API"""
+# pylint: disable=missing-function-docstring
+import asyncio
+import json
+import threading
+from unittest import mock
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+from tornado.websocket import websocket_connect
+
+from transformers_agent_ui.domain.jobs import JobQueue
+from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.ui.api import SERVER_TOKEN_ENV_VALUE, get_routes, is_server_token_enabled
+
+
+def _serve(tmp_path, client):
+    """Runs the client with the url of an API server"""
+
+    async def serve():
+        job_queue = JobQueue(store=Store(tmp_path)).start()
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(Application(get_routes("api", jobs=job_queue)))
+        server.add_sockets(sockets)
+        port = sockets[0].getsockname()[1]
+        try:
+            return await client(f"127.0.0.1:{port}")
+        finally:
+            server.stop()
+            job_queue.stop()
+
+    return asyncio.run(serve())
+
+
+def test_submit_and_stream_job(tmp_path):
+    async def client(host):
+        http = AsyncHTTPClient()
+        response = await http.fetch(
+            f"http://{host}/api/jobs",
+            method="POST",
+            body=json.dumps({"agent": "Offline", "task": "Say hello"}),
+        )
+        assert response.code == 202
+        job = json.loads(response.body)
+        assert response.headers["Location"] == f"/api/jobs/{job['id']}"
+
+        connection = await websocket_connect(f"ws://{host}/api/jobs/{job['id']}/events")
+        statuses = []
+        while message := await connection.read_message():
+            statuses.append(json.loads(message))
+
+        response = await http.fetch(f"http://{host}/api/jobs/{job['id']}")
+        job = json.loads(response.body)
+        asset = await http.fetch(f"http://{host}{job['asset']}")
+        partial = await http.fetch(f"http://{host}{job['asset']}", headers={"Range": "bytes=0-1"})
+        not_modified = await http.fetch(
+            f"http://{host}{job['asset']}",
+            headers={"If-None-Match": asset.headers["Etag"]},
+            raise_error=False,
+        )
+        runs = await http.fetch(f"http://{host}/api/runs?agent=Offline&search=hello")
+        return statuses, job, asset, partial, not_modified, json.loads(runs.body)["runs"]
+
+    statuses, job, asset, partial, not_modified, runs = _serve(tmp_path, client)
+
+    assert statuses[-1]["status"] == "done"
+    assert job["value"] == "Hello"
+    assert job["code"]
+    assert job["asset"].startswith("/api/assets/")
+    assert asset.body == (tmp_path / "assets" / job["asset"].split("/")[-1]).read_bytes()
+    assert partial.code == 206
+    assert partial.body == asset.body[:2]
+    assert not_modified.code == 304
+    assert [(run["task"], run["asset"]) for run in runs] == [("Say hello", job["asset"])]
+
+
+def test_errors(tmp_path):
+    async def client(host):
+        codes = []
+        for method, url, body in [
+            ("POST", "api/jobs", {"agent": "Unknown", "task": "Say hello"}),
+            ("POST", "api/jobs", {"agent": "Offline"}),
+            ("POST", "api/jobs", {"agent": "Offline", "task": "Say hello", "priority": "urgent"}),
+            ("POST", "api/jobs", {"agent": "OpenAI", "task": "Say hello"}),
+            ("GET", "api/jobs/abc", None),
+            ("DELETE", "api/jobs/abc", None),
+        ]:
+            try:
+                await AsyncHTTPClient().fetch(
+                    f"http://{host}/{url}",
+                    method=method,
+                    body=None if body is None else json.dumps(body),
+                )
+            except HTTPClientError as exc:
+                codes.append((exc.code, json.loads(exc.response.body)["error"]))
+        return codes
+
+    assert _serve(tmp_path, client) == [
+        (400, "Unknown agent 'Unknown'"),
+        (400, "A task is required"),
+        (400, "Unknown priority 'urgent'"),
+        (401, "A token of agent 'OpenAI' is required"),
+        (404, "Job 'abc' not found"),
+        (404, "Job 'abc' not found"),
+    ]
+
+
+def test_server_token_is_opt_in(monkeypatch):
+    monkeypatch.delenv(SERVER_TOKEN_ENV_VALUE, raising=False)
+    assert not is_server_token_enabled()
+
+    monkeypatch.setenv(SERVER_TOKEN_ENV_VALUE, "true")
+    assert is_server_token_enabled()
+
+
+def test_jobs_are_read_outside_of_the_event_loop(tmp_path):
+    threads = []
+
+    async def client(host):
+        threads.append(threading.current_thread())
+        try:
+            await AsyncHTTPClient().fetch(f"http://{host}/api/jobs/abc")
+        except HTTPClientError as exc:
+            return exc.code
+        return 200
+
+    get_job = JobQueue.get
+
+    def get(self, job_id):
+        threads.append(threading.current_thread())
+        return get_job(self, job_id)
+
+    with mock.patch.object(JobQueue, "get", get):
+        assert _serve(tmp_path, client) == 404
+    assert threads[1] is not threads[0]
@@ -0,0 +1,51 @@
+"""We can compare the runs of the task by several models side by side"""
+# pylint: disable=missing-function-docstring
+import threading
+from unittest import mock
+
+from transformers_agent_ui.domain.agent import TransformersAgent
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.ui import compare
+from transformers_agent_ui.ui.compare import ComparisonView
+
+
+def _create_view() -> ComparisonView:
+    agent = TransformersAgent(
+        agent="Offline", task="Say hello", cache=InMemoryStore(), sandbox=None
+    )
+    return ComparisonView(agent=agent, models=["Offline/fixtures"])
+
+
+def test_comparison_view():
+    # Given
+    view = _create_view()
+    assert view.__panel__()
+    # When
+    view.param.trigger("compare")
+    view.join(timeout=10)
+    # Then
+    assert [result.value for result in view.results] == ["Hello"]
+    assert not view.is_running
+    assert view._results_view()  # pylint: disable=protected-access
+
+
+def test_comparison_does_not_block_the_click():
+    # Given a comparison that runs until released
+    released = threading.Event()
+    run_models = compare.compare
+
+    def slow_compare(agent, models):
+        released.wait(10)
+        return run_models(agent, models)
+
+    view = _create_view()
+    with mock.patch.object(compare, "compare", side_effect=slow_compare):
+        # When
+        view.param.trigger("compare")
+        # Then the click returns while the models run
+        assert view.is_running
+        assert not view.results
+        released.set()
+        view.join(timeout=10)
+    assert [result.value for result in view.results] == ["Hello"]
+    assert not view.is_running
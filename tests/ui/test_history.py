@@ -0,0 +1,63 @@
+"""We can browse the runs in the Store"""
+# pylint: disable=redefined-outer-name, missing-function-docstring
+import panel as pn
+import pytest
+from PIL import Image
+
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.store import Store
+from transformers_agent_ui.ui.history import HistoryBrowser
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(path=tmp_path)
+    for index in range(5):
+        store.write(
+            "HuggingFace", "Starcoder", f"Task {index}", {}, "A", "B", "C", f"Value {index}"
+        )
+    return store
+
+
+@pytest.mark.filterwarnings("ignore:Saved type")
+def test_history_browser(store):
+    # Given
+    browser = HistoryBrowser(store=store, page_size=2)
+    # Then
+    assert browser.__panel__()
+    assert [run["task"] for run in browser.runs] == ["Task 4", "Task 3"]
+    assert browser.is_first_page and not browser.is_last_page
+    # When/ Then
+    browser.param.trigger("next_page")
+    assert [run["task"] for run in browser.runs] == ["Task 2", "Task 1"]
+    browser.param.trigger("next_page")
+    assert [run["task"] for run in browser.runs] == ["Task 0"]
+    assert browser.is_last_page
+    browser.param.trigger("previous_page")
+    assert browser.page == 2
+    # When/ Then
+    browser.search = "4"
+    assert [run["task"] for run in browser.runs] == ["Task 4"]
+    assert browser.page == 1
+
+
+def test_history_browser_unsupported_store():
+    browser = HistoryBrowser(store=InMemoryStore())
+
+    assert not browser.runs
+    assert browser.__panel__()
+
+
+def test_history_browser_corrupt_value(tmp_path):
+    # Given
+    store = Store(path=tmp_path)
+    image = Image.new("RGB", (200, 200), "blue")
+    store.write("HuggingFace", "Starcoder", "Draw", {}, "A", "B", "C", image)
+    browser = HistoryBrowser(store=store)
+    path = store.asset_path / browser.runs[0]["value"]
+    path.write_bytes(path.read_bytes()[:100])
+    # When
+    preview = browser._get_preview(browser.runs[0]["value"])  # pylint: disable=protected-access
+    # Then
+    assert isinstance(preview, pn.pane.Markdown)
+    assert preview.object == "*Value not available*"
@@ -0,0 +1,30 @@
+"""We can serve the metrics as an extra route of the server"""
+import asyncio
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+
+from transformers_agent_ui.domain.metrics import RUNS
+from transformers_agent_ui.ui.metrics import CONTENT_TYPE, get_routes
+
+
+def test_metrics_endpoint():
+    """The metrics are served on the endpoint in the Prometheus text format"""
+    RUNS.inc(agent="HuggingFace", model="StarcoderBase", outcome="run")
+
+    async def get_metrics():
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(Application(get_routes("metrics")))
+        server.add_sockets(sockets)
+        port = sockets[0].getsockname()[1]
+        try:
+            return await AsyncHTTPClient().fetch(f"http://127.0.0.1:{port}/metrics")
+        finally:
+            server.stop()
+
+    response = asyncio.run(get_metrics())
+
+    assert response.headers["Content-Type"] == CONTENT_TYPE
+    assert "transformers_agent_ui_runs_total{" in response.body.decode()
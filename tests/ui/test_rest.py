@@ -0,0 +1,33 @@
+"""We can serve the API and the metrics via a single `panel.io.rest` provider"""
+import subprocess  # nosec
+import sys
+
+from transformers_agent_ui.ui import api
+from transformers_agent_ui.ui.metrics import MetricsHandler
+from transformers_agent_ui.ui.rest import api_rest_provider, metrics_rest_provider
+
+
+def test_api_provider_serves_the_metrics(monkeypatch):
+    """`panel serve` accepts a single provider. So the API provider also serves the metrics"""
+    monkeypatch.setattr(api, "get_routes", lambda endpoint: [(rf"^/{endpoint}/jobs/?$", None)])
+
+    routes = api_rest_provider(files=[], endpoint="api")
+
+    assert routes == [(r"^/api/jobs/?$", None), (r"^/metrics/?$", MetricsHandler)]
+
+
+def test_metrics_provider():
+    """The metrics provider only serves the metrics on the endpoint"""
+    assert metrics_rest_provider(files=[], endpoint="stats") == [(r"^/stats/?$", MetricsHandler)]
+
+
+def test_providers_are_imported_lazily():
+    """Panel loads the providers in every process. So they should not import torch"""
+    code = (
+        "import sys, transformers_agent_ui.ui.rest;"
+        "print(sorted({'torch', 'transformers'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )  # nosec
+    assert output.stdout.strip() == "[]"
@@ -1,7 +1,19 @@
 """We have a UI for the Hugging Face Transformers Agent"""
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import panel as pn
 import pytest
+import torch
+from bokeh.document import Document
+from panel.io.state import set_curdoc
 
 from transformers_agent_ui import TransformersAgentUI
+from transformers_agent_ui.domain.jobs import JobQueue
+from transformers_agent_ui.domain.memory_store import InMemoryStore
+from transformers_agent_ui.domain.token import EnvTokenProvider, TokenManager
 from transformers_agent_ui.ui.config import (
     TransformersAgentUIConfig,
     TransformersAgentUIStyles,
@@ -31,3 +43,102 @@ def test_submit():
     agent.param.trigger("submit")
     assert agent.value
     assert agent.value != "Running ..."
+
+
+def test_logs_are_capped():
+    """Only the last lines of the logs are kept"""
+    agent = TransformersAgentUI()
+    max_log_lines = agent.config.max_log_lines
+
+    for index in range(3 * max_log_lines):
+        agent.write_log(f"line {index}")
+
+    assert agent._logs.output.count("\n") < 2 * max_log_lines  # pylint: disable=protected-access
+    assert (
+        f"line {3 * max_log_lines - 1}\n" in agent._logs.output
+    )  # pylint: disable=protected-access
+
+
+def test_session_destroyed():
+    """The values held by a session are released when it is destroyed"""
+    # Given
+    doc = Document()
+    with set_curdoc(doc):
+        agent = TransformersAgentUI(cache=InMemoryStore())
+        doc.add_root(agent.__panel__().get_root(doc))
+    agent.value = "some value"
+    agent.write_log("some log")
+    # When
+    for callback in list(doc.session_destroyed_callbacks):
+        callback(SimpleNamespace(id="session", _document=doc))
+    # Then
+    assert agent.value is None
+    assert agent.kwargs == {}
+    assert "some log" not in agent._logs.output  # pylint: disable=protected-access
+
+
+def test_run_logs_are_shown():
+    """The logs of the runs are written to the Logs tab in batches"""
+    token_manager = TokenManager(provider=EnvTokenProvider(env_values={}))
+    agent = TransformersAgentUI(cache=InMemoryStore(), token_manager=token_manager)
+
+    agent.run()
+    assert "No token found" not in agent._logs.output  # pylint: disable=protected-access
+    agent.flush_logs()
+
+    assert "No token found" in agent._logs.output  # pylint: disable=protected-access
+
+
+def test_run_via_job_queue(tmp_path):
+    """The runs can be submitted to the job queue and re-attached to after a reload"""
+    job_queue = JobQueue(store=InMemoryStore(), db_path=tmp_path / "jobs.db").start()
+    with mock.patch(
+        "transformers_agent_ui.ui.transformers_agent_ui.get_job_queue", return_value=job_queue
+    ):
+        # Given
+        agent = TransformersAgentUI(agent="Offline", task="Say hello", use_job_queue=True)
+        # When
+        agent.param.trigger("submit")
+        # Then
+        assert agent.job_id
+        while agent.is_running:
+            time.sleep(0.01)
+            agent.update_from_job()
+        assert agent.value == "Hello"
+        assert agent.code
+        # When the page is reloaded
+        reloaded = TransformersAgentUI(use_job_queue=True)
+        reloaded.attach(agent.job_id)
+        # Then the result of the job is shown
+        assert (reloaded.agent, reloaded.task, reloaded.value) == ("Offline", "Say hello", "Hello")
+        assert not reloaded.is_running
+    job_queue.stop()
+
+
+def test_cancel_job(tmp_path):
+    """A job submitted to the job queue can be cancelled via the CANCEL button"""
+    job_queue = JobQueue(store=InMemoryStore(), db_path=tmp_path / "jobs.db")
+    with mock.patch(
+        "transformers_agent_ui.ui.transformers_agent_ui.get_job_queue", return_value=job_queue
+    ):
+        agent = TransformersAgentUI(agent="Offline", task="Say hello", use_job_queue=True)
+        agent.param.trigger("submit")
+        assert agent.is_running
+
+        agent.param.trigger("cancel")
+        agent.update_from_job()
+
+        assert not agent.is_running
+        assert agent.error == "The job was cancelled"
+
+
+def test_audio_is_converted_once():
+    """The audio is converted once and not every time the view is updated"""
+    agent = TransformersAgentUI()
+    agent.param.update(code="audio = text_reader(text)", value=torch.zeros(16000))
+
+    pane = agent.get_value_pane()
+
+    assert isinstance(pane, pn.pane.Audio)
+    assert pane.object.dtype == np.int16
+    assert agent.get_value_pane().object is pane.object